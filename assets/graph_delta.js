@@ -0,0 +1,30 @@
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    graph: {
+        // Apply changes of the call graph sent by the server to the shown
+        // elements, returns the new elements and the version they show
+        apply_delta: function(delta, elements) {
+            const no_update = window.dash_clientside.no_update;
+            if (!delta) {
+                return [no_update, no_update];
+            }
+            if (delta.reset) {
+                return [delta.upsert, delta.version];
+            }
+            const updated = (elements || []).slice();
+            const positions = {};
+            updated.forEach(function(element, position) {
+                positions[element.data.id] = position;
+            });
+            delta.upsert.forEach(function(element) {
+                const position = positions[element.data.id];
+                if (position === undefined) {
+                    positions[element.data.id] = updated.length;
+                    updated.push(element);
+                } else {
+                    updated[position] = element;
+                }
+            });
+            return [updated, delta.version];
+        }
+    }
+});
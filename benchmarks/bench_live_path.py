@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+'''
+Measures the whole live tracing path, from the tracing process
+to the call graph, by replaying a synthetic bcc trace output
+instead of running bcc, so it needs neither bcc nor root
+'''
+from argparse import ArgumentParser
+import os
+from random import Random
+import sys
+from tempfile import TemporaryDirectory
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tracerface.call_graph import CallGraph
+from tracerface.trace_controller import DEFAULT_BATCH_SIZE, DEFAULT_BATCH_WINDOW, TraceController
+from tracerface.trace_process import QUEUE_TRANSPORT, RING_TRANSPORT
+from tracerface.trace_source import ReplayTraceSource
+
+
+# Write an output of call-stacks of varying depth and parameters
+def _write_synthetic_output(path, stack_count):
+    rng = Random(42)
+    functions = ['func{}'.format(index) for index in range(50)]
+    with open(path, 'w') as output:
+        output.write('PID    TID    COMM         FUNC             \n')
+        for _ in range(stack_count):
+            params = ' '.join("b'param{}'".format(rng.randrange(3)) for _ in range(rng.randrange(3)))
+            output.write('24622  24622  test_applicatio func  {}\n'.format(params))
+            output.write('-14\n')
+            for function in rng.sample(functions, rng.randrange(1, 12)):
+                output.write("b'{}+0x{:x} [test_application]'\n".format(function, rng.randrange(256)))
+            output.write("b'[unknown]'\n\n")
+
+
+# Returns seconds taken to replay the output into a call graph,
+# the number of call-stacks in the graph, the number of dropped and
+# sampled call-stacks and the metrics of merging batches into the graph
+def _measure(path, stacks_per_second, **options):
+    call_graph = CallGraph()
+    trace_controller = TraceController(
+        source_factory=lambda functions: ReplayTraceSource(path, stacks_per_second), **options)
+    start = time.perf_counter()
+    trace_controller.start_trace(['replayed'], call_graph)
+    trace_controller.join()
+    elapsed = time.perf_counter() - start
+    stack_count = sum(node['call_count'] for node in call_graph.get_nodes().values())
+    return (elapsed, stack_count, trace_controller.dropped_stacks(), trace_controller.sampled_stacks(),
+            trace_controller.metrics())
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--stacks', type=int, default=50000, help='Number of call-stacks to replay')
+    parser.add_argument('--rate', type=float, help='Call-stacks replayed per second, as fast as possible by default')
+    parser.add_argument('--batch-window', type=float, default=DEFAULT_BATCH_WINDOW * 1000,
+                        help='Milliseconds to collect call-stacks for before merging them')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='Number of call-stacks merged at once, even before the window ends')
+    args = parser.parse_args()
+    batching = {'batch_window': args.batch_window / 1000, 'batch_size': args.batch_size}
+
+    configurations = [
+        ('queue', {'transport': QUEUE_TRANSPORT}),
+        ('ring', {'transport': RING_TRANSPORT}),
+        ('ring, folded in tracer', {'transport': RING_TRANSPORT, 'fold_in_tracer': True})
+    ]
+    with TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'output')
+        _write_synthetic_output(path, args.stacks)
+        for name, options in configurations:
+            elapsed, stack_count, dropped, sampled, metrics = _measure(path, args.rate, **options, **batching)
+            print('{:>22}: {:7d} call-stacks in {:6.2f} s, {:8.0f} call-stacks/s, {} dropped, {} sampled out'.format(
+                name, stack_count, elapsed, stack_count / elapsed, dropped, sampled))
+            print('{:>22}  {} batches, flush latency mean {:.1f} ms, max {:.1f} ms, merging took {:.2f} s'.format(
+                '', metrics['batches'], metrics['mean_flush_latency'] * 1000,
+                metrics['max_flush_latency'] * 1000, metrics['merge_seconds']))
+
+
+if __name__ == '__main__':
+    main()
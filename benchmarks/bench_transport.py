@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+'''
+Compares the ways of passing the output of the tracing to the
+controller, with a fake trace source printing call-stacks at full speed
+'''
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tracerface.trace_process import QUEUE_TRANSPORT, RING_TRANSPORT, TraceProcess
+
+
+_STACK = [
+    "19059  19059  dummy_source func1        b'param1' b'param2'",
+    '-14',
+    "b'func1+0x0 [dummy_source]'",
+    "b'func2+0x26 [dummy_source]'",
+    "b'main+0x19 [dummy_source]'",
+    ''
+]
+
+
+# Trace source printing the same call-stack at full speed
+class FakeTraceSource:
+    def __init__(self, stack_count):
+        self._stack_count = stack_count
+
+    def run(self):
+        for _ in range(self._stack_count):
+            for line in _STACK:
+                print(line)
+
+
+# Returns seconds taken until every call-stack was read, CPU seconds spent
+# by the reader, the number of call-stacks read and of call-stacks dropped
+def _measure(stack_count, transport, fold_window):
+    trace_process = TraceProcess(source=FakeTraceSource(stack_count), transport=transport, fold_window=fold_window)
+    received = 0
+    start = time.perf_counter()
+    start_cpu = time.process_time()
+    trace_process.start()
+    while True:
+        if fold_window is None:
+            outputs, _ = trace_process.get_lines(0.1)
+            received += outputs.count('') # the empty line ending a call-stack
+        else:
+            outputs = trace_process.get_deltas(0.1)
+            received += sum(count for delta in outputs for _, _, count in delta.stacks)
+        if not outputs and not trace_process.is_alive():
+            break
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - start_cpu
+    trace_process.join()
+    dropped = trace_process.dropped_stacks()
+    trace_process.close_output()
+    return elapsed, cpu, received, dropped
+
+
+def main():
+    stack_count = 100000
+    for transport, fold_window in ((QUEUE_TRANSPORT, None), (RING_TRANSPORT, None), (RING_TRANSPORT, 0.1)):
+        elapsed, cpu, received, dropped = _measure(stack_count, transport, fold_window)
+        name = transport if fold_window is None else '{}, folded in tracer'.format(transport)
+        print('{:>22}: {:7d} call-stacks in {:6.2f} s, {:8.0f} call-stacks/s, reader CPU {:6.2f} s, {} dropped'.format(
+            name, received, elapsed, received / elapsed, cpu, dropped))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+'''
+Times building the cytoscape node list for graphs of growing size,
+comparing the former scan of all edges for each node with parameters
+collected by the call graph while merging
+'''
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tracerface.call_graph import CallGraph
+from tracerface.param_counter import ParamCounter
+from tracerface.web_ui.ui_format import convert_nodes_to_cytoscape_format
+
+
+# Previous way of finding the parameters of a node, kept for comparison
+def _scan_params_of_node(node_id, edges):
+    params = ParamCounter()
+    for edge in edges:
+        if edge[1] == node_id:
+            params.update(edges[edge]['params'])
+    return params
+
+
+# Node list built by scanning all edges for every node
+def _convert_with_scan(nodes, edges):
+    node_params = {node_id: _scan_params_of_node(node_id, edges) for node_id in nodes}
+    return convert_nodes_to_cytoscape_format(nodes, edges, node_params)
+
+
+# Build a random call graph with the given number of edges
+def _build_call_graph(edge_count):
+    randomizer = random.Random(edge_count)
+    node_count = max(2, edge_count // 4)
+    call_graph = CallGraph()
+    call_graph.load_nodes({
+        node_id: {'name': 'func{}'.format(node_id), 'source': 'source', 'call_count': 1}
+        for node_id in range(node_count)
+    })
+    edges = {}
+    while len(edges) < edge_count:
+        edge = (randomizer.randrange(node_count), randomizer.randrange(node_count))
+        edges[edge] = {'param': [str(randomizer.randrange(16))], 'call_count': 1}
+    call_graph.load_edges(edges)
+    return call_graph
+
+
+def main():
+    for edge_count in (1000, 5000, 20000):
+        call_graph = _build_call_graph(edge_count)
+        nodes = call_graph.get_nodes()
+        edges = call_graph.get_edges()
+        node_params = call_graph.get_node_params()
+        repeat = 1 if edge_count > 5000 else 3
+        scan = timeit.timeit(lambda: _convert_with_scan(nodes, edges), number=repeat) / repeat
+        indexed = timeit.timeit(
+            lambda: convert_nodes_to_cytoscape_format(nodes, edges, node_params), number=repeat) / repeat
+        print('{:>6} edges {:>6} nodes: scan {:8.3f} s, indexed {:8.4f} s'.format(
+            edge_count, len(nodes), scan, indexed))
+
+
+if __name__ == '__main__':
+    main()
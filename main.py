@@ -5,21 +5,59 @@ import sys
 from dash import Dash
 from dash_bootstrap_components.themes import BOOTSTRAP
 
+from tracerface.graph_cache import GraphCache
 from tracerface.init_resources import initialize
+from tracerface.param_counter import DEFAULT_CAPACITY
+from tracerface.trace_controller import DEFAULT_BATCH_SIZE, DEFAULT_BATCH_WINDOW, DEFAULT_WARM_TRACERS
+from tracerface.trace_process import DEFAULT_OUTPUT_BUDGET, QUEUE_TRANSPORT, RING_TRANSPORT
+from tracerface.trace_source import bcc_trace_source, ReplayTraceSource
 
 
 def parse_args(args):
     parser = ArgumentParser(description=__doc__)
     parser.add_argument('--debug', action='store_true', help='Start server in debug mode')
     parser.add_argument('--routes-logging', action='store_true', help='Show routes access logging in the console')
+    parser.add_argument('--load-workers', type=int, default=1, help='Number of processes used to load output files')
+    parser.add_argument('--cache-dir', help='Directory to cache parsed output files in')
+    parser.add_argument('--cache-size', type=int, default=1024, help='Size limit of the cache in MiB, 0 disables it')
+    parser.add_argument('--clear-cache', action='store_true', help='Remove every parsed output file from the cache')
+    parser.add_argument('--compact-graph', action='store_true', help='Store the call graph in compact arrays, useful for huge graphs')
+    parser.add_argument('--param-capacity', type=int, default=DEFAULT_CAPACITY, help='Number of distinct parameters kept per edge')
+    parser.add_argument('--transport', choices=[RING_TRANSPORT, QUEUE_TRANSPORT], default=RING_TRANSPORT,
+                        help='Pass the output of the tracing through shared memory or through a queue')
+    parser.add_argument('--fold-in-tracer', action='store_true', help='Parse and count call-stacks in the tracing process')
+    parser.add_argument('--trace-shards', type=int, default=1, help='Number of processes to split the traced functions between')
+    parser.add_argument('--replay', help='Replay a recorded bcc trace output when tracing instead of running bcc trace')
+    parser.add_argument('--replay-rate', type=float, help='Call-stacks replayed per second, as fast as possible by default')
+    parser.add_argument('--batch-window', type=float, default=DEFAULT_BATCH_WINDOW * 1000,
+                        help='Milliseconds to collect traced call-stacks for before showing them')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='Number of traced call-stacks shown at once, even before the window ends')
+    parser.add_argument('--output-budget', type=int, default=DEFAULT_OUTPUT_BUDGET // (1024 * 1024),
+                        help='MiB of trace output waiting to be shown before call-stacks are dropped')
+    parser.add_argument('--warm-tracers', type=int, default=DEFAULT_WARM_TRACERS,
+                        help='Number of tracing processes kept ready, which restart traces of the same functions quickly')
     return parser.parse_args(args)
 
 
 # Create resources and start application
 def main(args):
     parsed_args = parse_args(args)
+    graph_cache = GraphCache(parsed_args.cache_dir, parsed_args.cache_size * 1024 * 1024)
+    if parsed_args.clear_cache:
+        graph_cache.invalidate()
+    if parsed_args.cache_size <= 0:
+        graph_cache = None
+    source_factory = bcc_trace_source
+    if parsed_args.replay:
+        source_factory = lambda functions: ReplayTraceSource(parsed_args.replay, parsed_args.replay_rate)
     app = Dash(__name__, external_stylesheets=[BOOTSTRAP])
-    initialize(app)
+    initialize(app, load_workers=parsed_args.load_workers, graph_cache=graph_cache,
+               compact_graph=parsed_args.compact_graph, param_capacity=parsed_args.param_capacity,
+               transport=parsed_args.transport, fold_in_tracer=parsed_args.fold_in_tracer,
+               trace_shards=parsed_args.trace_shards, source_factory=source_factory,
+               batch_window=parsed_args.batch_window / 1000, batch_size=parsed_args.batch_size,
+               output_budget=parsed_args.output_budget * 1024 * 1024, warm_tracers=parsed_args.warm_tracers)
     silent = not parsed_args.routes_logging
     app.run_server(debug=parsed_args.debug, dev_tools_silence_routes_logging=silent)
 
@@ -83,6 +83,7 @@ def test_trace(tmp_path):
         time.sleep(5) # BCC trace needs a bit of time to setup
         subprocess.run(app) # run monitored application
         trace_controller.stop_trace() # stop
+        trace_controller.join() # wait for the last batch to be merged
 
     edges = convert_edges_to_cytoscape_format(call_graph.get_nodes(), call_graph.get_edges())
     nodes = convert_nodes_to_cytoscape_format(call_graph.get_nodes(), call_graph.get_edges())
@@ -1,7 +1,19 @@
 #!/usr/bin/env python3
-from unittest import main, TestCase
+from threading import Event, Thread
+from unittest import main, mock, TestCase
 
-from tracerface.call_graph import CallGraph
+from tracerface.call_graph import ArrayCallGraph, CallGraph, GraphBatch
+from tracerface.param_counter import ParamCounter
+from tracerface.symbol_table import SymbolTable
+from tracerface.web_ui.ui_format import CytoscapeCache
+
+
+# Build a parameter counter from (parameters, count) pairs
+def _params(*counts):
+    counter = ParamCounter()
+    for params, count in counts:
+        counter.add(params, count)
+    return counter
 
 
 class TestConstructor(TestCase):
@@ -43,8 +55,8 @@ class TestGetEdges(TestCase):
             ('node_hash3', 'node_hash4'): {'param': ['dummy_param'], 'call_count': 3}
         })
         expected_edges = {
-            ('node_hash1', 'node_hash2'): {'params': [], 'call_count': 0},
-            ('node_hash3', 'node_hash4'): {'params': [['dummy_param']], 'call_count': 3}
+            ('node_hash1', 'node_hash2'): {'params': _params(), 'call_count': 0},
+            ('node_hash3', 'node_hash4'): {'params': _params((('dummy_param',), 1)), 'call_count': 3}
         }
         self.assertEqual(call_graph.get_edges(), expected_edges)
 
@@ -67,6 +79,21 @@ class TestLoadNodes(TestCase):
         }
         self.assertEqual(call_graph.get_nodes(), expected_nodes)
 
+    def test_load_nodes_multiplies_call_counts(self):
+        call_graph = CallGraph()
+        call_graph.load_nodes({
+            'dummy_hash1': {'name': 'dummy_name1', 'source': 'dummy_source1', 'call_count': 1}
+        }, 3)
+        call_graph.load_nodes({
+            'dummy_hash1': {'name': 'dummy_name1', 'source': 'dummy_source1', 'call_count': 1},
+            'dummy_hash2': {'name': 'dummy_name2', 'source': 'dummy_source2', 'call_count': 0}
+        }, 2)
+        expected_nodes = {
+            'dummy_hash1': {'name': 'dummy_name1', 'source': 'dummy_source1', 'call_count': 5},
+            'dummy_hash2': {'name': 'dummy_name2', 'source': 'dummy_source2', 'call_count': 0}
+        }
+        self.assertEqual(call_graph.get_nodes(), expected_nodes)
+
 
 class TestLoadEdges(TestCase):
     def test_load_edges_updates_returned_edges(self):
@@ -81,13 +108,28 @@ class TestLoadEdges(TestCase):
         })
         expected_edges = {
             ('node_hash1', 'node_hash2'): {
-                'params': [], 'call_count': 0
+                'params': _params(), 'call_count': 0
             },
             ('node_hash2', 'node_hash3'): {
-                'params': [], 'call_count': 2
+                'params': _params(), 'call_count': 2
             },
             ('node_hash3', 'node_hash4'): {
-                'params': [['dummy_param1'], ['dummy_param2', 'dummy_param3']], 'call_count': 6
+                'params': _params((('dummy_param1',), 1), (('dummy_param2', 'dummy_param3'), 1)), 'call_count': 6
+            }
+        }
+        self.assertEqual(call_graph.get_edges(), expected_edges)
+
+    def test_load_edges_multiplies_call_counts_and_params(self):
+        call_graph = CallGraph()
+        call_graph.load_edges({
+            ('node_hash1', 'node_hash2'): {'param': ['dummy_param1'], 'call_count': 1}
+        }, 2)
+        call_graph.load_edges({
+            ('node_hash1', 'node_hash2'): {'param': ['dummy_param2'], 'call_count': 1}
+        }, 1)
+        expected_edges = {
+            ('node_hash1', 'node_hash2'): {
+                'params': _params((('dummy_param1',), 2), (('dummy_param2',), 1)), 'call_count': 3
             }
         }
         self.assertEqual(call_graph.get_edges(), expected_edges)
@@ -148,6 +190,31 @@ class TestMaxCount(TestCase):
         })
         self.assertEqual(call_graph.max_count(), 10)
 
+    def test_max_count_follows_merged_call_counts(self):
+        call_graph = CallGraph()
+        call_graph.load_nodes({
+            'dummy_hash1': {'name': 'dummy_name1', 'source': 'dummy_source1', 'call_count': 4}
+        })
+        call_graph.load_nodes({
+            'dummy_hash2': {'name': 'dummy_name2', 'source': 'dummy_source2', 'call_count': 3}
+        })
+        self.assertEqual(call_graph.max_count(), 4)
+        call_graph.load_nodes({
+            'dummy_hash2': {'name': 'dummy_name2', 'source': 'dummy_source2', 'call_count': 2}
+        })
+        self.assertEqual(call_graph.max_count(), 5)
+
+    def test_max_count_is_reset_by_clear(self):
+        call_graph = CallGraph()
+        call_graph.load_nodes({
+            'dummy_hash1': {'name': 'dummy_name1', 'source': 'dummy_source1', 'call_count': 4}
+        })
+        call_graph.clear()
+        self.assertEqual(call_graph.max_count(), 0)
+
+    def test_max_count_of_empty_graph_is_zero(self):
+        self.assertEqual(CallGraph().max_count(), 0)
+
 
 class TestExpandElements(TestCase):
     def test_element_clicked_adds_element_to_returned_elements(self):
@@ -163,5 +230,320 @@ class TestExpandElements(TestCase):
         self.assertEqual(call_graph.get_expanded_elements(), ['dummy_id2'])
 
 
+class TestParams(TestCase):
+    def test_params_are_capped_per_edge(self):
+        call_graph = CallGraph(param_capacity=2)
+        for index in range(5):
+            call_graph.load_edges({('node_hash1', 'node_hash2'): {'param': [str(index)], 'call_count': 1}})
+
+        params = call_graph.get_edges()[('node_hash1', 'node_hash2')]['params']
+        self.assertEqual(len(params), 2)
+        self.assertEqual(params.total(), 5)
+
+    def test_param_stats_sums_parameter_data_of_edges(self):
+        call_graph = CallGraph(param_capacity=2)
+        for index in range(5):
+            call_graph.load_edges({('node_hash1', 'node_hash2'): {'param': [str(index)], 'call_count': 1}})
+        call_graph.load_edges({('node_hash2', 'node_hash3'): {'param': ['param'], 'call_count': 1}})
+        call_graph.load_edges({('node_hash3', 'node_hash4'): {'param': [], 'call_count': 1}})
+
+        stats = call_graph.param_stats()
+        self.assertEqual(stats['distinct'], 3)
+        self.assertEqual(stats['evictions'], 3)
+        self.assertEqual(stats['other'], 3)
+
+    def test_param_stats_are_kept_up_to_date_by_merges(self):
+        for call_graph in (CallGraph(param_capacity=3), ArrayCallGraph(param_capacity=3)):
+            for index in range(200):
+                edge = (index % 7, index % 5)
+                call_graph.load_edges({edge: {'param': [str(index * index % 11)], 'call_count': 1}})
+
+            counters = [edge['params'] for edge in call_graph.get_edges().values()]
+            self.assertEqual(call_graph.param_stats(), {
+                'distinct': sum(len(counter) for counter in counters),
+                'evictions': sum(counter.evictions() for counter in counters),
+                'other': sum(counter.total() - sum(count for _, count in counter.items()) for counter in counters)
+            })
+            call_graph.clear()
+            self.assertEqual(call_graph.param_stats(), {'distinct': 0, 'evictions': 0, 'other': 0})
+
+
+class TestMergeBatch(TestCase):
+    def _batch(self):
+        symbols = SymbolTable()
+        symbols.intern('dummy_name1', 'dummy_source1')
+        symbols.intern('dummy_name2', 'dummy_source2')
+        symbols.intern('dummy_name3', 'dummy_source1')
+        return GraphBatch(
+            symbols=symbols,
+            node_counts={0: 3, 1: 0, 2: 1},
+            edge_counts={(1, 0): 3, (2, 1): 0},
+            edge_params={(1, 0): {('dummy_param1',): 2, ('dummy_param2', 'dummy_param3'): 1}}
+        )
+
+    def test_merge_batch_updates_nodes_and_edges(self):
+        call_graph = CallGraph()
+        call_graph.merge_batch(self._batch())
+        call_graph.merge_batch(self._batch())
+        self.assertEqual(call_graph.get_nodes(), {
+            0: {'name': 'dummy_name1', 'source': 'dummy_source1', 'call_count': 6},
+            1: {'name': 'dummy_name2', 'source': 'dummy_source2', 'call_count': 0},
+            2: {'name': 'dummy_name3', 'source': 'dummy_source1', 'call_count': 2}
+        })
+        self.assertEqual(call_graph.get_edges(), {
+            (1, 0): {
+                'params': _params((('dummy_param1',), 4), (('dummy_param2', 'dummy_param3'), 2)),
+                'call_count': 6
+            },
+            (2, 1): {'params': _params(), 'call_count': 0}
+        })
+
+
+class TestNodeParams(TestCase):
+    def _edges(self):
+        return {
+            (1, 2): {'param': [], 'call_count': 1},
+            (1, 3): {'param': ['dummy_param1'], 'call_count': 2},
+            (2, 3): {'param': ['dummy_param2'], 'call_count': 1}
+        }
+
+    def test_node_params_are_collected_from_incoming_edges(self):
+        for call_graph in (CallGraph(), ArrayCallGraph()):
+            call_graph.load_edges(self._edges())
+            self.assertEqual(call_graph.get_node_params(), {
+                3: _params((('dummy_param1',), 1), (('dummy_param2',), 1))
+            })
+
+    def test_clear_removes_indexes(self):
+        for call_graph in (CallGraph(), ArrayCallGraph()):
+            call_graph.load_edges(self._edges())
+            call_graph.clear()
+            self.assertEqual(call_graph.get_node_params(), {})
+
+
+class TestDirtyTracking(TestCase):
+    def test_version_grows_with_changes(self):
+        for call_graph in (CallGraph(), ArrayCallGraph()):
+            version = call_graph.version()
+            call_graph.merge_batch(TestMergeBatch()._batch())
+            self.assertGreater(call_graph.version(), version)
+            version = call_graph.version()
+            call_graph.clear()
+            self.assertGreater(call_graph.version(), version)
+
+    def test_drain_dirty_returns_changed_elements_once(self):
+        for call_graph in (CallGraph(), ArrayCallGraph()):
+            call_graph.drain_dirty()
+            call_graph.merge_batch(TestMergeBatch()._batch())
+            self.assertEqual(call_graph.drain_dirty(), (False, {0, 1, 2}, {(1, 0), (2, 1)}))
+            call_graph.load_edges({(2, 1): {'param': ['dummy_param'], 'call_count': 1}})
+            self.assertEqual(call_graph.drain_dirty(), (False, {1}, {(2, 1)}))
+            self.assertEqual(call_graph.drain_dirty(), (False, set(), set()))
+
+    def test_mark_changed_adds_to_dirty_elements(self):
+        for call_graph in (CallGraph(), ArrayCallGraph()):
+            call_graph.merge_batch(TestMergeBatch()._batch())
+            call_graph.drain_dirty()
+            version = call_graph.version()
+            call_graph.mark_changed(nodes=[1], edges=[(2, 1)])
+            self.assertGreater(call_graph.version(), version)
+            self.assertEqual(call_graph.drain_dirty(), (False, {1}, {(2, 1)}))
+
+    def test_mark_changed_ignores_elements_not_in_graph(self):
+        for call_graph in (CallGraph(), ArrayCallGraph()):
+            call_graph.merge_batch(TestMergeBatch()._batch())
+            call_graph.drain_dirty()
+            call_graph.element_clicked('n42')
+            call_graph.mark_changed(nodes=[42], edges=[(42, 1)])
+            self.assertEqual(call_graph.drain_changes().dirty_nodes, set())
+            call_graph.mark_changed(nodes=[42, 1])
+            cache = CytoscapeCache()
+            self.assertTrue(cache.update(call_graph))
+            self.assertEqual(len(cache.elements()), 1)
+
+    def test_drain_dirty_reports_clear(self):
+        call_graph = CallGraph()
+        call_graph.load_edges({(2, 1): {'param': [], 'call_count': 1}})
+        call_graph.clear()
+        self.assertEqual(call_graph.drain_dirty(), (True, set(), set()))
+
+    def test_drain_changes_copies_changed_elements(self):
+        for call_graph in (CallGraph(), ArrayCallGraph()):
+            call_graph.drain_dirty()
+            call_graph.load_nodes({
+                0: {'name': 'dummy_name1', 'source': 'dummy_source1', 'call_count': 1},
+                1: {'name': 'dummy_name2', 'source': 'dummy_source2', 'call_count': 1}
+            })
+            call_graph.drain_dirty()
+            call_graph.load_edges({(0, 1): {'param': ['dummy_param'], 'call_count': 1}})
+            call_graph.element_clicked('n1')
+
+            changes = call_graph.drain_changes()
+            call_graph.load_edges({(0, 1): {'param': ['dummy_param'], 'call_count': 1}})
+
+            self.assertEqual(changes.version, call_graph.version() - 1)
+            self.assertFalse(changes.cleared)
+            self.assertEqual(changes.dirty_nodes, {1})
+            self.assertEqual(changes.dirty_edges, {(0, 1)})
+            self.assertEqual(set(changes.nodes), {0, 1})
+            self.assertEqual(changes.edges, {(0, 1): {'params': _params((('dummy_param',), 1)), 'call_count': 1}})
+            self.assertEqual(changes.node_params, {1: _params((('dummy_param',), 1))})
+            self.assertEqual(changes.expanded, {'n1'})
+            self.assertEqual(call_graph.drain_changes().dirty_edges, {(0, 1)})
+
+
+# Every batch calls the node 1 from the node 0 with a parameter, so in any
+# consistent state both nodes, the edge and its parameters count the same
+class TestConcurrency(TestCase):
+    def _batch(self, symbols):
+        return GraphBatch(
+            symbols=symbols,
+            node_counts={0: 1, 1: 1},
+            edge_counts={(0, 1): 1},
+            edge_params={(0, 1): {('dummy_param',): 1}}
+        )
+
+    def _assert_consistent(self, nodes, edges, node_params):
+        if (0, 1) not in edges:
+            return
+        count = edges[(0, 1)]['call_count']
+        self.assertEqual(nodes[0]['call_count'], count)
+        self.assertEqual(nodes[1]['call_count'], count)
+        self.assertEqual(edges[(0, 1)]['params'].total(), count)
+        if 1 in node_params:
+            self.assertEqual(node_params[1].total(), count)
+
+    def _stress(self, call_graph, read):
+        symbols = SymbolTable()
+        symbols.intern('dummy_name1', 'dummy_source')
+        symbols.intern('dummy_name2', 'dummy_source')
+        done = Event()
+        errors = []
+
+        def write():
+            try:
+                for _ in range(2000):
+                    call_graph.merge_batch(self._batch(symbols))
+                    call_graph.mark_changed(nodes=[0])
+            except Exception as e:
+                errors.append(e)
+
+        def keep_reading():
+            try:
+                while not done.is_set():
+                    read(call_graph)
+            except Exception as e:
+                errors.append(e)
+
+        writers = [Thread(target=write) for _ in range(4)]
+        readers = [Thread(target=keep_reading) for _ in range(4)]
+        for thread in readers + writers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        done.set()
+        for thread in readers:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(call_graph.get_edges()[(0, 1)]['call_count'], 8000)
+        self.assertEqual(call_graph.max_count(), 8000)
+
+    def test_changes_are_consistent_while_merging(self):
+        def read(call_graph):
+            changes = call_graph.drain_changes()
+            self._assert_consistent(changes.nodes, changes.edges, changes.node_params)
+
+        for call_graph in (CallGraph(), ArrayCallGraph()):
+            self._stress(call_graph, read)
+
+    def test_cytoscape_cache_updates_while_merging(self):
+        cache = CytoscapeCache()
+        def read(call_graph):
+            cache.update(call_graph)
+            cache.delta(None)
+            yellow, red, max_count = call_graph.get_color_state()
+            self.assertLessEqual(red, max_count)
+
+        for call_graph in (CallGraph(), ArrayCallGraph()):
+            self._stress(call_graph, read)
+
+    def test_iterating_under_lock_is_consistent_while_merging(self):
+        def read(call_graph):
+            with call_graph.lock():
+                self._assert_consistent(call_graph.get_nodes(), call_graph.get_edges(), call_graph.get_node_params())
+                sum(node['call_count'] for node in call_graph.get_nodes().values())
+
+        for call_graph in (CallGraph(), ArrayCallGraph()):
+            self._stress(call_graph, read)
+
+
+class TestArrayCallGraph(TestCase):
+    def _nodes(self):
+        return {
+            0: {'name': 'dummy_name1', 'source': 'dummy_source1', 'call_count': 3},
+            2: {'name': 'dummy_name2', 'source': 'dummy_source2', 'call_count': 1}
+        }
+
+    def _edges(self):
+        return {
+            (0, 2): {'param': [], 'call_count': 0},
+            (2, 0): {'param': ['dummy_param'], 'call_count': 3}
+        }
+
+    def test_array_call_graph_loads_same_as_call_graph(self):
+        call_graph = CallGraph()
+        array_call_graph = ArrayCallGraph()
+        for graph in (call_graph, array_call_graph):
+            graph.load_nodes(self._nodes())
+            graph.load_edges(self._edges())
+            graph.load_nodes(self._nodes(), 2)
+            graph.load_edges(self._edges(), 2)
+            graph.merge_batch(TestMergeBatch()._batch())
+
+        self.assertEqual(array_call_graph.get_nodes(), call_graph.get_nodes())
+        self.assertEqual(array_call_graph.get_edges(), call_graph.get_edges())
+        self.assertEqual(array_call_graph.max_count(), call_graph.max_count())
+
+    def test_get_nodes_returns_view_of_present_nodes(self):
+        call_graph = ArrayCallGraph()
+        call_graph.load_nodes(self._nodes())
+        nodes = call_graph.get_nodes()
+        self.assertEqual(len(nodes), 2)
+        self.assertEqual(list(nodes), [0, 2])
+        self.assertNotIn(1, nodes)
+        self.assertEqual(nodes[2], {'name': 'dummy_name2', 'source': 'dummy_source2', 'call_count': 1})
+
+    def test_get_edges_returns_view_of_edges(self):
+        call_graph = ArrayCallGraph()
+        call_graph.load_edges(self._edges())
+        edges = call_graph.get_edges()
+        self.assertEqual(len(edges), 2)
+        self.assertEqual(list(edges), [(0, 2), (2, 0)])
+        self.assertNotIn((1, 2), edges)
+        self.assertEqual(edges[(2, 0)], {'params': _params((('dummy_param',), 1)), 'call_count': 3})
+
+    @mock.patch('tracerface.call_graph._EDGE_COMPACT_SIZE', 4)
+    def test_edges_are_found_after_compaction(self):
+        call_graph = ArrayCallGraph()
+        for _ in range(2):
+            for caller in range(10):
+                call_graph.load_edges({(caller, caller + 1): {'param': [], 'call_count': caller}})
+
+        edges = call_graph.get_edges()
+        self.assertEqual(len(edges), 10)
+        for caller in range(10):
+            self.assertEqual(edges[(caller, caller + 1)]['call_count'], caller * 2)
+
+    def test_clear_removes_all_nodes_and_edges(self):
+        call_graph = ArrayCallGraph()
+        call_graph.load_nodes(self._nodes())
+        call_graph.load_edges(self._edges())
+        call_graph.clear()
+        self.assertEqual(call_graph.get_nodes(), {})
+        self.assertEqual(call_graph.get_edges(), {})
+        self.assertEqual(call_graph.max_count(), 0)
+
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+from unittest import main, TestCase
+
+from tracerface.folded_output import decode_delta, encode_delta, fold_delta, FoldedDelta, FoldingWriter
+from tracerface.parse_stack import FoldedStack
+from tracerface.stack_folder import StackFolder
+from tracerface.symbol_table import SymbolTable
+
+
+_OUTPUT = (
+    "19059  19059  dummy_source func1        b'param1'\n"
+    '-14\n'
+    "b'func1+0x0 [dummy_source]'\n"
+    "b'func2+0x26 [dummy_source]'\n"
+    '\n'
+)
+
+
+class TestFoldedDelta(TestCase):
+    def test_decoded_delta_equals_encoded_one(self):
+        delta = FoldedDelta(symbols=[('func1', 'dummy_source')], stacks=[((0,), ('param1',), 2)])
+        self.assertEqual(decode_delta(encode_delta(delta)), delta)
+
+    def test_fold_delta_translates_node_ids(self):
+        symbols = SymbolTable()
+        symbols.intern('func2', 'dummy_source')
+        folder = StackFolder(symbols)
+        node_ids = []
+        fold_delta(FoldedDelta(symbols=[('func1', 'dummy_source')], stacks=[]), node_ids, folder)
+        fold_delta(FoldedDelta(symbols=[('func2', 'dummy_source')], stacks=[((0, 1), (), 3)]), node_ids, folder)
+
+        self.assertEqual(node_ids, [1, 0])
+        self.assertEqual(folder.stacks(), {FoldedStack(frames=(1, 0), params=()): 3})
+
+
+class TestFoldingWriter(TestCase):
+    def test_call_stacks_are_sent_folded(self):
+        sent = []
+        writer = FoldingWriter(lambda data: sent.append(decode_delta(data)) or True)
+        for line in _OUTPUT.split('\n'):
+            writer.write(line)
+            writer.write('\n')
+        writer.write(_OUTPUT)
+        writer.send_delta()
+        writer.write(_OUTPUT)
+        writer.send_delta()
+
+        self.assertEqual(sent, [
+            FoldedDelta(symbols=[('func1', 'dummy_source'), ('func2', 'dummy_source')], stacks=[((0, 1), ('param1',), 2)]),
+            FoldedDelta(symbols=[], stacks=[((0, 1), ('param1',), 1)])
+        ])
+
+    def test_nothing_is_sent_without_call_stacks(self):
+        sent = []
+        writer = FoldingWriter(sent.append)
+        writer.write(_OUTPUT[:-1])
+        writer.send_delta()
+        self.assertEqual(sent, [])
+
+    def test_call_stacks_are_dropped_when_delta_can_not_be_sent(self):
+        sent = []
+        dropped = []
+        writer = FoldingWriter(lambda data: False, dropped.append)
+        writer.write(_OUTPUT * 2)
+        writer.send_delta()
+        writer._send = lambda data: sent.append(decode_delta(data)) or True
+        writer.write(_OUTPUT)
+        writer.send_delta()
+
+        self.assertEqual(dropped, [2])
+        self.assertEqual(sent, [
+            FoldedDelta(symbols=[('func1', 'dummy_source'), ('func2', 'dummy_source')], stacks=[((0, 1), ('param1',), 1)])
+        ])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import main, mock, TestCase
+
+from tracerface.call_graph import CallGraph
+from tracerface.graph_cache import GraphCache
+from tracerface.load_output import load_trace_output_from_file_to_call_graph
+
+
+class TestGraphCache(TestCase):
+    def setUp(self):
+        self._directory = TemporaryDirectory()
+        self.root = Path(self._directory.name)
+        self.trace_file = self.root.joinpath('output')
+        self.trace_file.write_text('dummy output')
+        self.cache = GraphCache(self.root.joinpath('cache'))
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def _stacks(self):
+        return [((0, 1), ('param',), 3), ((1,), (), 1)]
+
+    def test_get_returns_none_for_file_not_cached(self):
+        self.assertIsNone(self.cache.get(self.trace_file))
+
+    def test_get_returns_stored_entry(self):
+        self.cache.put(self.trace_file, [('func1', 'source'), ('func2', 'source')], self._stacks())
+        self.assertEqual(
+            self.cache.get(self.trace_file),
+            ([('func1', 'source'), ('func2', 'source')], self._stacks())
+        )
+
+    def test_get_returns_none_after_file_changed(self):
+        self.cache.put(self.trace_file, [('func1', 'source')], self._stacks())
+        self.trace_file.write_text('other output')
+        os.utime(self.trace_file, ns=(0, 0))
+        self.assertIsNone(self.cache.get(self.trace_file))
+
+    def test_get_drops_corrupt_entry(self):
+        self.cache.put(self.trace_file, [('func1', 'source')], self._stacks())
+        entry = next(self.root.joinpath('cache').iterdir())
+        entry.write_bytes(b'corrupt')
+        self.assertIsNone(self.cache.get(self.trace_file))
+        self.assertFalse(entry.exists())
+
+    def test_put_without_room_stores_nothing(self):
+        with mock.patch('tracerface.graph_cache.pickle.dump', side_effect=OSError(28, 'No space left on device')):
+            self.cache.put(self.trace_file, [('func1', 'source')], self._stacks())
+        self.assertEqual(list(self.root.joinpath('cache').iterdir()), [])
+        self.assertIsNone(self.cache.get(self.trace_file))
+
+    def test_put_evicts_least_recently_used_entries(self):
+        files = [self.root.joinpath('output{}'.format(index)) for index in range(3)]
+        for file in files:
+            file.write_text(file.name)
+            self.cache.put(file, [('func1', 'source')], self._stacks())
+        entry_size = self.cache.size() // 3
+        cache = GraphCache(self.root.joinpath('cache'), max_size=entry_size * 2)
+        for index, entry in enumerate(sorted(self.root.joinpath('cache').iterdir())):
+            os.utime(entry, ns=(index, index))
+        cache.get(files[0]) # most recently used from now on
+
+        cache.put(self.trace_file, [('func1', 'source')], self._stacks())
+
+        self.assertIsNotNone(cache.get(files[0]))
+        self.assertIsNotNone(cache.get(self.trace_file))
+        self.assertIsNone(cache.get(files[1]))
+        self.assertIsNone(cache.get(files[2]))
+        self.assertLessEqual(cache.size(), entry_size * 2)
+
+    def test_invalidate_removes_entry_of_file(self):
+        other_file = self.root.joinpath('other_output')
+        other_file.write_text('other output')
+        self.cache.put(self.trace_file, [('func1', 'source')], self._stacks())
+        self.cache.put(other_file, [('func1', 'source')], self._stacks())
+
+        self.cache.invalidate(self.trace_file)
+
+        self.assertIsNone(self.cache.get(self.trace_file))
+        self.assertIsNotNone(self.cache.get(other_file))
+
+    def test_invalidate_without_file_removes_every_entry(self):
+        self.cache.put(self.trace_file, [('func1', 'source')], self._stacks())
+        self.cache.invalidate()
+        self.assertIsNone(self.cache.get(self.trace_file))
+        self.assertEqual(self.cache.size(), 0)
+
+
+class TestLoadWithGraphCache(TestCase):
+    def test_load_from_cache_matches_parsed_load(self):
+        test_file_path = str(Path(__file__).absolute().parent.parent.joinpath(
+            'resources', 'test_static_output'
+        ))
+        with TemporaryDirectory() as directory:
+            cache = GraphCache(directory)
+            parsed = CallGraph()
+            load_trace_output_from_file_to_call_graph(test_file_path, parsed, cache=cache)
+
+            cached = CallGraph()
+            with mock.patch('tracerface.load_output._fold_lines') as fold_lines:
+                load_trace_output_from_file_to_call_graph(test_file_path, cached, cache=cache)
+            fold_lines.assert_not_called()
+
+        self.assertEqual(cached.get_nodes(), parsed.get_nodes())
+        self.assertEqual(cached.get_edges(), parsed.get_edges())
+
+    def test_load_with_unusable_cache_directory_parses_file(self):
+        test_file_path = str(Path(__file__).absolute().parent.parent.joinpath(
+            'resources', 'test_static_output'
+        ))
+        with TemporaryDirectory() as directory:
+            # A file where the cache directory should be can not be written as root either
+            not_a_directory = Path(directory).joinpath('cache')
+            not_a_directory.write_text('')
+            call_graph = CallGraph()
+            load_trace_output_from_file_to_call_graph(test_file_path, call_graph, cache=GraphCache(not_a_directory))
+        self.assertGreater(len(call_graph.get_nodes()), 0)
+
+
+if __name__ == '__main__':
+    main()
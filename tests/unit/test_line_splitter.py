@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+from unittest import main, TestCase
+
+from tracerface.line_splitter import LineSplitter
+
+
+class TestLineSplitter(TestCase):
+    def test_complete_lines_are_returned(self):
+        splitter = LineSplitter()
+        self.assertEqual(splitter.feed('line1\nline2\n'), ['line1', 'line2'])
+        self.assertEqual(splitter.flush(), [])
+
+    def test_line_split_between_chunks_is_returned_once_complete(self):
+        splitter = LineSplitter()
+        self.assertEqual(splitter.feed('li'), [])
+        self.assertEqual(splitter.feed('n'), [])
+        self.assertEqual(splitter.feed('e1\nline'), ['line1'])
+        self.assertEqual(splitter.feed('2\n'), ['line2'])
+
+    def test_empty_lines_are_kept(self):
+        splitter = LineSplitter()
+        self.assertEqual(splitter.feed('line1\n'), ['line1'])
+        self.assertEqual(splitter.feed('\n'), [''])
+        self.assertEqual(splitter.feed('\n\n'), ['', ''])
+
+    def test_flush_returns_unfinished_line(self):
+        splitter = LineSplitter()
+        splitter.feed('line1\nli')
+        splitter.feed('ne2')
+        self.assertEqual(splitter.flush(), ['line2'])
+        self.assertEqual(splitter.flush(), [])
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,22 @@
 #!/usr/bin/env python3
+import bz2
+import gzip
+from io import BytesIO
+import lzma
 from pathlib import Path
-from unittest import main, TestCase
+from random import Random
+from tempfile import TemporaryDirectory
+from unittest import main, mock, TestCase
 
-from tracerface.load_output import load_trace_output_from_file_to_call_graph
+from tracerface import load_output
+from tracerface.load_output import (
+    _split_at_stacks,
+    CORRUPT_COMPRESSION_ERRORS,
+    iter_lines,
+    load_trace_output_from_file_to_call_graph,
+    open_trace_output,
+    UnsupportedCompressionError
+)
 from tracerface.call_graph import CallGraph
 from tests.integration.test_trace import EXPECTED_NODES
 
@@ -22,5 +36,128 @@ class TestLoadFromFile(TestCase):
             assert result['source'] == expected['source']
 
 
+# Write an output file shaped like a long bcc trace capture:
+# a header followed by many call-stacks of varying depth and parameters
+def _write_synthetic_output(path, stack_count):
+    rng = Random(42)
+    functions = ['func{}'.format(index) for index in range(50)]
+    with open(path, 'w') as output:
+        output.write('PID    TID    COMM         FUNC             \n')
+        for _ in range(stack_count):
+            params = ' '.join("b'param{}'".format(rng.randrange(3)) for _ in range(rng.randrange(3)))
+            output.write('24622  24622  test_applicatio func  {}\n'.format(params))
+            output.write('-14\n')
+            for function in rng.sample(functions, rng.randrange(1, 12)):
+                output.write("b'{}+0x{:x} [test_application]'\n".format(function, rng.randrange(256)))
+            output.write("b'[unknown]'\n\n")
+
+
+class TestParallelLoad(TestCase):
+    @mock.patch('tracerface.load_output._MIN_RANGE_SIZE', 1)
+    def test_parallel_load_matches_sequential_load(self):
+        with TemporaryDirectory() as directory:
+            path = str(Path(directory).joinpath('output'))
+            _write_synthetic_output(path, 5000)
+            sequential = CallGraph()
+            parallel = CallGraph()
+
+            load_trace_output_from_file_to_call_graph(path, sequential)
+            load_trace_output_from_file_to_call_graph(path, parallel, workers=4)
+
+        self.assertEqual(parallel.get_nodes(), sequential.get_nodes())
+        self.assertEqual(parallel.get_edges(), sequential.get_edges())
+        self.assertEqual(parallel.get_red(), sequential.get_red())
+
+    @mock.patch('tracerface.load_output._MIN_RANGE_SIZE', 1)
+    def test_parallel_load_does_not_fork_workers(self):
+        with TemporaryDirectory() as directory:
+            path = str(Path(directory).joinpath('output'))
+            _write_synthetic_output(path, 100)
+            with mock.patch('tracerface.load_output.ProcessPoolExecutor',
+                            wraps=load_output.ProcessPoolExecutor) as executor:
+                load_trace_output_from_file_to_call_graph(path, CallGraph(), workers=2)
+
+        self.assertNotEqual(executor.call_args.kwargs['mp_context'].get_start_method(), 'fork')
+
+    def test_split_at_stacks_splits_after_empty_lines(self):
+        content = b'stack1\nline\n\nstack2\nline\n\nstack3\n\n'
+        ranges = _split_at_stacks(BytesIO(content), len(content), 3)
+        self.assertListEqual(
+            [content[start:end] for start, end in ranges],
+            [b'stack1\nline\n\n', b'stack2\nline\n\n', b'stack3\n\n']
+        )
+
+    def test_split_at_stacks_returns_whole_stream_without_separators(self):
+        content = b'stack1\nline\n'
+        self.assertListEqual(_split_at_stacks(BytesIO(content), len(content), 4), [(0, len(content))])
+
+
+class TestCompressedLoad(TestCase):
+    def _test_file_path(self):
+        return Path(__file__).absolute().parent.parent.joinpath('resources', 'test_static_output')
+
+    def _assert_loads_like_plain_file(self, compress):
+        plain = CallGraph()
+        load_trace_output_from_file_to_call_graph(str(self._test_file_path()), plain)
+        with TemporaryDirectory() as directory:
+            path = str(Path(directory).joinpath('output.compressed'))
+            Path(path).write_bytes(compress(self._test_file_path().read_bytes()))
+            compressed = CallGraph()
+            load_trace_output_from_file_to_call_graph(path, compressed, workers=4)
+        self.assertEqual(compressed.get_nodes(), plain.get_nodes())
+        self.assertEqual(compressed.get_edges(), plain.get_edges())
+
+    def test_load_gzip_compressed_output(self):
+        self._assert_loads_like_plain_file(gzip.compress)
+
+    def test_load_xz_compressed_output(self):
+        self._assert_loads_like_plain_file(lzma.compress)
+
+    def test_load_bzip2_compressed_output(self):
+        self._assert_loads_like_plain_file(bz2.compress)
+
+    @mock.patch('tracerface.load_output._zstd_open', None)
+    def test_load_zstd_compressed_output_without_zstandard(self):
+        with TemporaryDirectory() as directory:
+            path = str(Path(directory).joinpath('output.zst'))
+            Path(path).write_bytes(b'\x28\xb5\x2f\xfd' + b'\x00' * 16)
+            with self.assertRaises(UnsupportedCompressionError):
+                load_trace_output_from_file_to_call_graph(path, CallGraph())
+
+    def test_corrupt_compressed_output_raises_known_error(self):
+        output = b"24622  24622  test_applicatio func\nb'func+0x0 [test_application]'\n\n" * 1000
+        with TemporaryDirectory() as directory:
+            for compress in (gzip.compress, lzma.compress, bz2.compress):
+                data = bytearray(compress(output))
+                data[20:40] = bytes(20)
+                path = Path(directory).joinpath('output')
+                path.write_bytes(bytes(data))
+                with self.assertRaises(CORRUPT_COMPRESSION_ERRORS):
+                    load_trace_output_from_file_to_call_graph(str(path), CallGraph())
+
+    def test_open_trace_output_decompresses_while_reading(self):
+        with TemporaryDirectory() as directory:
+            path = str(Path(directory).joinpath('output.gz'))
+            Path(path).write_bytes(gzip.compress(b'first line\nsecond line\n'))
+            with open_trace_output(path) as stream:
+                self.assertListEqual(list(iter_lines(stream)), ['first line', 'second line'])
+
+
+class TestIterLines(TestCase):
+    def test_iter_lines_joins_lines_split_across_chunks(self):
+        stream = BytesIO(b'first line\nsecond line\n\nlast line')
+        self.assertListEqual(
+            list(iter_lines(stream, chunk_size=4)),
+            ['first line', 'second line', '', 'last line']
+        )
+
+    def test_iter_lines_decodes_characters_split_across_chunks(self):
+        stream = BytesIO('árvíztűrő\n'.encode())
+        self.assertListEqual(list(iter_lines(stream, chunk_size=1)), ['árvíztűrő'])
+
+    def test_iter_lines_yields_nothing_for_empty_stream(self):
+        self.assertListEqual(list(iter_lines(BytesIO(b''))), [])
+
+
 if __name__ == '__main__':
     main()
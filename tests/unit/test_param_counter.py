@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+from unittest import main, TestCase
+
+from tracerface.param_counter import ParamCounter
+
+
+class TestParamCounter(TestCase):
+    def test_add_counts_distinct_tuples(self):
+        counter = ParamCounter()
+        counter.add(('param1',))
+        counter.add(('param2', 'param3'), 3)
+        counter.add(('param1',))
+
+        self.assertEqual(len(counter), 2)
+        self.assertEqual(counter.total(), 5)
+        self.assertEqual(counter.items(), [(('param2', 'param3'), 3), (('param1',), 2)])
+        self.assertEqual(counter.other_count(), 0)
+        self.assertEqual(counter.evictions(), 0)
+
+    def test_add_keeps_number_of_tuples_under_capacity(self):
+        counter = ParamCounter(capacity=3)
+        for index in range(100):
+            counter.add(('param{}'.format(index),))
+
+        self.assertEqual(len(counter), 3)
+        self.assertEqual(counter.total(), 100)
+        self.assertEqual(counter.evictions(), 97)
+        self.assertEqual(sum(count for _, count in counter.items()) + counter.other_count(), 100)
+
+    def test_add_keeps_heavy_hitters_over_capacity(self):
+        counter = ParamCounter(capacity=4)
+        for index in range(200):
+            counter.add(('frequent',))
+            counter.add(('rare{}'.format(index),))
+            if index % 2:
+                counter.add(('common',))
+
+        kept = dict(counter.items())
+        self.assertIn(('frequent',), kept)
+        self.assertIn(('common',), kept)
+        self.assertLessEqual(kept[('frequent',)], 200)
+        self.assertEqual(counter.items()[0][0], ('frequent',))
+        self.assertGreater(counter.other_count(), 0)
+
+    def test_update_counts_everything_of_other_counter(self):
+        counter = ParamCounter()
+        other = ParamCounter()
+        for params in [('param1',), ('param2',), ('param1',)]:
+            other.add(params)
+        counter.add(('param1',))
+
+        counter.update(other)
+
+        self.assertEqual(counter.total(), 4)
+        self.assertEqual(counter.items(), [(('param1',), 3), (('param2',), 1)])
+
+    def test_update_keeps_other_count_of_other_counter(self):
+        counter = ParamCounter()
+        other = ParamCounter(capacity=1)
+        other.add(('param1',), 3)
+        other.add(('param2',))
+
+        counter.update(other)
+
+        self.assertEqual(counter.total(), 4)
+        self.assertEqual(counter.other_count(), other.other_count())
+
+    def test_copy_counts_the_same_independently(self):
+        counter = ParamCounter(capacity=1)
+        counter.add(('param1',), 2)
+        counter.add(('param2',))
+
+        copy = counter.copy()
+        counter.add(('param1',))
+
+        self.assertEqual(copy.total(), 3)
+        self.assertEqual(copy.evictions(), 1)
+        self.assertEqual(copy.items(), [(('param2',), 1)])
+        self.assertEqual(copy.other_count(), 2)
+        self.assertEqual(counter.total(), 4)
+
+    def test_empty_counter_is_falsy(self):
+        self.assertFalse(ParamCounter())
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 from unittest import main, TestCase
 
-from tracerface.parse_stack import parse_stack
+from tracerface.parse_stack import FrameCache, parse_stack, StackParser
+from tracerface.symbol_table import SymbolTable
 
 
 class TestParseStack(TestCase):
@@ -112,6 +113,175 @@ class TestParseStack(TestCase):
         self.assertDictEqual(result.nodes, {})
         self.assertDictEqual(result.edges, {})
 
+    def test_parse_stack_uses_interned_ids_as_keys(self):
+        symbols = SymbolTable()
+        stack = [
+            "19059  19059  dummy_source1 func1",
+            "-14",
+            "b'func1+0x0 [dummy_source1]'",
+            "b'func2+0x26 [dummy_source1]'"
+        ]
+
+        result = parse_stack(stack, symbols)
+
+        func1 = symbols.intern('func1', 'dummy_source1')
+        func2 = symbols.intern('func2', 'dummy_source1')
+        self.assertEqual(len(symbols), 2)
+        self.assertListEqual(sorted(result.nodes), [func1, func2])
+        self.assertListEqual(list(result.edges), [(func2, func1)])
+
+
+class TestStackParser(TestCase):
+    def test_feed_returns_none_until_stack_ends(self):
+        parser = StackParser()
+        self.assertIsNone(parser.feed("19059  19059  dummy_source1 func1"))
+        self.assertIsNone(parser.feed("-14"))
+        self.assertIsNone(parser.feed("b'func1+0x0 [dummy_source1]'"))
+        self.assertIsNone(parser.feed("b'func2+0x26 [dummy_source1]'"))
+
+        result = parser.feed('')
+
+        self.assertListEqual(
+            sorted(list(result.nodes.values()), key = lambda i: i['name']),
+            [
+                {'call_count': 1, 'name': 'func1', 'source': 'dummy_source1'},
+                {'call_count': 0, 'name': 'func2', 'source': 'dummy_source1'},
+            ]
+        )
+        self.assertListEqual(list(result.edges.values()), [{'call_count': 1, 'param': []}])
+
+    def test_feed_returns_none_for_empty_lines_between_stacks(self):
+        parser = StackParser()
+        self.assertIsNone(parser.feed(''))
+        self.assertIsNone(parser.feed('\n'))
+
+    def test_feed_parses_consecutive_stacks_independently(self):
+        parser = StackParser()
+        stacks = []
+        for line in [
+            "PID    TID    COMM         FUNC             ",
+            "19059  19059  dummy_source1 func1        b'param1'",
+            "-14",
+            "b'func1+0x0 [dummy_source1]'",
+            "b'func2+0x26 [dummy_source1]'",
+            "",
+            "19059  19059  dummy_source1 func3",
+            "-14",
+            "b'func3+0x0 [dummy_source2]'",
+            "b'func2+0x26 [dummy_source1]'",
+            ""
+        ]:
+            stack = parser.feed(line)
+            if stack:
+                stacks.append(stack)
+
+        self.assertEqual(len(stacks), 2)
+        self.assertListEqual(list(stacks[0].edges.values()), [{'call_count': 1, 'param': ['param1']}])
+        self.assertListEqual(list(stacks[1].edges.values()), [{'call_count': 1, 'param': []}])
+        self.assertListEqual(
+            sorted(list(stacks[1].nodes.values()), key = lambda i: i['name']),
+            [
+                {'call_count': 0, 'name': 'func2', 'source': 'dummy_source1'},
+                {'call_count': 1, 'name': 'func3', 'source': 'dummy_source2'},
+            ]
+        )
+
+    def test_feed_folded_returns_frames_and_params(self):
+        symbols = SymbolTable()
+        parser = StackParser(symbols=symbols)
+        parser.feed_folded("19059  19059  dummy_source1 func1        b'param1' b'param2'")
+        parser.feed_folded("-14")
+        parser.feed_folded("b'func1+0x0 [dummy_source1]'")
+        parser.feed_folded("b'func2+0x26 [dummy_source1]'")
+        parser.feed_folded("b'[unknown]'")
+
+        result = parser.feed_folded('')
+
+        self.assertEqual(result.frames, (
+            symbols.intern('func1', 'dummy_source1'),
+            symbols.intern('func2', 'dummy_source1')
+        ))
+        self.assertEqual(result.params, ('param1', 'param2'))
+
+    def test_flush_returns_unfinished_stack(self):
+        parser = StackParser()
+        parser.feed("19059  19059  dummy_source1 func1")
+        parser.feed("-14")
+        parser.feed("b'func1+0x0 [dummy_source1]'")
+
+        result = parser.flush()
+
+        self.assertListEqual(
+            list(result.nodes.values()),
+            [{'call_count': 1, 'name': 'func1', 'source': 'dummy_source1'}]
+        )
+        self.assertIsNone(parser.flush())
+
+
+class TestFrameCache(TestCase):
+    def test_resolve_returns_interned_id_of_frame(self):
+        symbols = SymbolTable()
+        cache = FrameCache(symbols)
+
+        node_id = cache.resolve("b'func1+0x0 [dummy_source1]'")
+
+        self.assertEqual(symbols.symbol(node_id), ('func1', 'dummy_source1'))
+
+    def test_resolve_returns_none_for_non_frame_lines(self):
+        cache = FrameCache(SymbolTable())
+        self.assertIsNone(cache.resolve("b'[unknown]'"))
+        self.assertIsNone(cache.resolve("b'[unknown]'"))
+        self.assertEqual(cache.hits(), 1)
+
+    def test_resolve_counts_hits_and_misses(self):
+        cache = FrameCache(SymbolTable())
+        first = cache.resolve("b'func1+0x0 [dummy_source1]'")
+        cache.resolve("b'func2+0x0 [dummy_source1]'")
+        self.assertEqual(cache.resolve("b'func1+0x0 [dummy_source1]'"), first)
+        self.assertEqual(cache.resolve("b'func1+0x0 [dummy_source1]'"), first)
+
+        self.assertEqual(cache.hits(), 2)
+        self.assertEqual(cache.misses(), 2)
+        self.assertEqual(cache.hit_rate(), 0.5)
+
+    def test_resolve_evicts_oldest_line_when_full(self):
+        cache = FrameCache(SymbolTable(), max_size=2)
+        func1 = cache.resolve("b'func1+0x0 [dummy_source1]'")
+        cache.resolve("b'func2+0x0 [dummy_source1]'")
+        cache.resolve("b'func3+0x0 [dummy_source1]'")
+
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.resolve("b'func1+0x0 [dummy_source1]'"), func1)
+        self.assertEqual(cache.misses(), 4)
+
+    def test_repeated_stacks_are_resolved_from_cache(self):
+        parser = StackParser(symbols=SymbolTable())
+        stack = [
+            "19059  19059  dummy_source1 func1",
+            "-14",
+            "b'func1+0x0 [dummy_source1]'",
+            "b'func2+0x26 [dummy_source1]'",
+            "b'func3+0x17 [dummy_source2]'",
+            "b'[unknown]'",
+            ""
+        ]
+        for _ in range(1000):
+            for line in stack:
+                parser.feed(line)
+
+        self.assertGreater(parser.frame_cache().hit_rate(), 0.99)
+
+    def test_parsers_without_symbol_table_do_not_share_frames(self):
+        parser1 = StackParser()
+        parser2 = StackParser()
+        parser1.feed("19059  19059  dummy_source1 func1")
+        parser1.feed("b'func1+0x0 [dummy_source1]'")
+        parser1.feed('')
+
+        self.assertIsNot(parser1.frame_cache(), parser2.frame_cache())
+        self.assertIsNot(parser1.symbols(), parser2.symbols())
+        self.assertEqual(len(parser2.frame_cache()), 0)
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+from unittest import main, TestCase
+
+from tracerface.probe_sharding import ProbeRates, shard_probes
+
+
+class TestProbeRates(TestCase):
+    def test_events_are_divided_between_probes(self):
+        rates = ProbeRates()
+        rates.observe(['probe1', 'probe2'], 100, 10)
+        self.assertEqual(rates.rate('probe1'), 5)
+        self.assertEqual(rates.rate('probe2'), 5)
+
+    def test_unknown_probe_gets_average_rate(self):
+        rates = ProbeRates()
+        self.assertEqual(rates.rate('probe1'), 1)
+        rates.observe(['probe1'], 10, 1)
+        rates.observe(['probe2'], 30, 1)
+        self.assertEqual(rates.rate('probe3'), 20)
+
+    def test_observation_without_duration_is_ignored(self):
+        rates = ProbeRates()
+        rates.observe(['probe1'], 10, 0)
+        self.assertEqual(len(rates), 0)
+
+
+class TestShardProbes(TestCase):
+    def test_unknown_probes_are_split_evenly(self):
+        shards = shard_probes(['probe1', 'probe2', 'probe3', 'probe4'], 2, ProbeRates())
+        self.assertEqual(shards, [['probe1', 'probe3'], ['probe2', 'probe4']])
+
+    def test_busy_probes_are_balanced(self):
+        rates = ProbeRates()
+        rates.observe(['busy'], 100, 1)
+        rates.observe(['probe1', 'probe2', 'probe3', 'probe4'], 40, 1)
+        shards = shard_probes(['probe1', 'probe2', 'busy', 'probe3', 'probe4'], 2, rates)
+        self.assertEqual(shards, [['busy'], ['probe1', 'probe2', 'probe3', 'probe4']])
+
+    def test_shards_are_never_empty(self):
+        self.assertEqual(shard_probes(['probe1', 'probe2'], 4, ProbeRates()), [['probe1'], ['probe2']])
+        self.assertEqual(shard_probes(['probe1'], 0, ProbeRates()), [['probe1']])
+
+
+if __name__ == '__main__':
+    main()
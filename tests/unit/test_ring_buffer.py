@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+from multiprocessing import get_context
+from queue import Empty
+from unittest import main, mock, TestCase
+
+from tracerface.ring_buffer import RingBuffer, SharedMemoryUnavailableError
+
+
+# Write records from another process
+def _write_records(ring_buffer, records):
+    for record in records:
+        ring_buffer.write(record)
+
+
+class TestRingBuffer(TestCase):
+    def setUp(self):
+        self.ring_buffer = RingBuffer(size=32)
+
+    def tearDown(self):
+        self.ring_buffer.unlink()
+
+    def test_records_are_read_in_order(self):
+        self.ring_buffer.write('dummy_val1')
+        self.ring_buffer.write('\n')
+        self.assertEqual(self.ring_buffer.get_nowait(), 'dummy_val1')
+        self.assertEqual(self.ring_buffer.get_nowait(), '\n')
+
+    def test_get_nowait_raises_empty_for_empty_buffer(self):
+        with self.assertRaises(Empty):
+            self.ring_buffer.get_nowait()
+
+    def test_get_raises_empty_after_timeout(self):
+        with self.assertRaises(Empty):
+            self.ring_buffer.get(timeout=0.01)
+
+    def test_records_wrap_around_end_of_buffer(self):
+        for index in range(20):
+            self.ring_buffer.write('dummy_val{}'.format(index))
+            self.assertEqual(self.ring_buffer.get_nowait(), 'dummy_val{}'.format(index))
+        self.assertEqual(self.ring_buffer.dropped(), 0)
+
+    def test_records_not_fitting_are_dropped(self):
+        self.ring_buffer.write('a' * 20)
+        self.ring_buffer.write('b' * 20)
+        self.ring_buffer.write('c')
+        self.assertEqual(self.ring_buffer.dropped(), 1)
+        self.assertEqual(self.ring_buffer.get_nowait(), 'a' * 20)
+        self.assertEqual(self.ring_buffer.get_nowait(), 'c')
+
+    def test_backlog_is_part_of_buffer_taken(self):
+        self.assertEqual(self.ring_buffer.backlog(), 0)
+        self.ring_buffer.write('a' * 12)
+        self.assertEqual(self.ring_buffer.backlog(), 0.5)
+        self.ring_buffer.get_nowait()
+        self.assertEqual(self.ring_buffer.backlog(), 0)
+
+    def test_records_are_passed_between_processes(self):
+        records = ['dummy_val{}'.format(index) for index in range(100)]
+        ring_buffer = RingBuffer(size=4096)
+        try:
+            process = get_context().Process(target=_write_records, args=(ring_buffer, records))
+            process.start()
+            received = [ring_buffer.get(timeout=5) for _ in records]
+            process.join()
+            self.assertEqual(received, records)
+        finally:
+            ring_buffer.unlink()
+
+    @mock.patch('tracerface.ring_buffer.SharedMemory', None)
+    def test_missing_shared_memory_raises_error(self):
+        with self.assertRaises(SharedMemoryUnavailableError):
+            RingBuffer()
+
+
+if __name__ == '__main__':
+    main()
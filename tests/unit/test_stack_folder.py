@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+from unittest import main, TestCase
+
+from tracerface.call_graph import CallGraph
+from tracerface.param_counter import ParamCounter
+from tracerface.parse_stack import FoldedStack
+from tracerface.stack_folder import StackFolder
+from tracerface.symbol_table import SymbolTable
+
+
+# Build a parameter counter from (parameters, count) pairs
+def _params(*counts):
+    counter = ParamCounter()
+    for params, count in counts:
+        counter.add(params, count)
+    return counter
+
+
+class TestStackFolder(TestCase):
+    def setUp(self):
+        self.symbols = SymbolTable()
+        self.func1 = self.symbols.intern('func1', 'dummy_source1')
+        self.func2 = self.symbols.intern('func2', 'dummy_source1')
+        self.func3 = self.symbols.intern('func3', 'dummy_source2')
+
+    def test_add_counts_identical_stacks_once(self):
+        folder = StackFolder(self.symbols)
+        folder.add(FoldedStack(frames=(self.func1, self.func2), params=()))
+        folder.add(FoldedStack(frames=(self.func1, self.func2), params=()))
+        folder.add(FoldedStack(frames=(self.func3, self.func2), params=()), count=3)
+
+        self.assertEqual(len(folder), 2)
+        self.assertEqual(folder.stack_count(), 5)
+        self.assertEqual(folder.stacks()[FoldedStack(frames=(self.func1, self.func2), params=())], 2)
+
+    def test_add_counts_stacks_with_different_params_separately(self):
+        folder = StackFolder(self.symbols)
+        folder.add(FoldedStack(frames=(self.func1, self.func2), params=('param1',)))
+        folder.add(FoldedStack(frames=(self.func1, self.func2), params=('param2',)))
+
+        self.assertEqual(len(folder), 2)
+
+    def test_add_folder_translates_node_ids(self):
+        other_symbols = SymbolTable()
+        other = StackFolder(other_symbols)
+        other.add(FoldedStack(frames=(other_symbols.intern('func3', 'dummy_source2'),), params=()))
+        folder = StackFolder(self.symbols)
+        node_ids = []
+
+        folder.add_folder(other, node_ids)
+        other.add(FoldedStack(frames=(other_symbols.intern('func4', 'dummy_source2'), 0), params=()), count=2)
+        folder.add_folder(other, node_ids)
+
+        func4 = self.symbols.intern('func4', 'dummy_source2')
+        self.assertEqual(node_ids, [self.func3, func4])
+        self.assertEqual(folder.stacks(), {
+            FoldedStack(frames=(self.func3,), params=()): 2,
+            FoldedStack(frames=(func4, self.func3), params=()): 2
+        })
+
+    def test_apply_merges_stacks_multiplied_by_count(self):
+        folder = StackFolder(self.symbols)
+        call_graph = CallGraph()
+        for _ in range(3):
+            folder.add(FoldedStack(frames=(self.func1, self.func2, self.func3), params=('param1',)))
+        folder.add(FoldedStack(frames=(self.func1, self.func2, self.func3), params=('param2',)))
+
+        folder.apply(call_graph)
+
+        self.assertEqual(call_graph.get_nodes(), {
+            self.func1: {'name': 'func1', 'source': 'dummy_source1', 'call_count': 4},
+            self.func2: {'name': 'func2', 'source': 'dummy_source1', 'call_count': 0},
+            self.func3: {'name': 'func3', 'source': 'dummy_source2', 'call_count': 0}
+        })
+        self.assertEqual(call_graph.get_edges(), {
+            (self.func2, self.func1): {
+                'params': _params((('param1',), 3), (('param2',), 1)),
+                'call_count': 4
+            },
+            (self.func3, self.func2): {'params': _params(), 'call_count': 0}
+        })
+
+    def test_apply_starts_new_window(self):
+        folder = StackFolder(self.symbols)
+        folder.add(FoldedStack(frames=(self.func1, self.func2), params=()))
+
+        folder.apply(CallGraph())
+
+        self.assertEqual(len(folder), 0)
+        self.assertEqual(folder.stack_count(), 0)
+
+
+if __name__ == '__main__':
+    main()
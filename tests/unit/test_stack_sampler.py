@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+from unittest import main, TestCase
+
+from tracerface.stack_sampler import AdaptiveSampler
+
+
+class TestAdaptiveSampler(TestCase):
+    def test_every_call_stack_is_kept_without_backlog(self):
+        sampler = AdaptiveSampler()
+        sampler.adjust(0)
+        self.assertEqual([sampler.keep() for _ in range(3)], [1, 1, 1])
+        self.assertEqual(sampler.interval(), 1)
+        self.assertEqual(sampler.skipped(), 0)
+
+    def test_high_backlog_keeps_one_in_interval_call_stacks(self):
+        sampler = AdaptiveSampler()
+        sampler.adjust(0.5)
+        sampler.adjust(0.9)
+        self.assertEqual(sampler.interval(), 4)
+        self.assertEqual([sampler.keep() for _ in range(8)], [0, 0, 0, 4] * 2)
+        self.assertEqual(sampler.skipped(), 6)
+
+    def test_interval_is_capped(self):
+        sampler = AdaptiveSampler(max_interval=4)
+        for _ in range(5):
+            sampler.adjust(1)
+        self.assertEqual(sampler.interval(), 4)
+
+    def test_low_backlog_shrinks_interval(self):
+        sampler = AdaptiveSampler()
+        for _ in range(3):
+            sampler.adjust(1)
+        sampler.adjust(0.3)
+        self.assertEqual(sampler.interval(), 8)
+        sampler.adjust(0.1)
+        self.assertEqual(sampler.interval(), 4)
+        for _ in range(5):
+            sampler.adjust(0)
+        self.assertEqual(sampler.interval(), 1)
+
+    def test_call_stacks_left_out_are_counted_when_interval_shrinks(self):
+        sampler = AdaptiveSampler()
+        for _ in range(3):
+            sampler.adjust(1)
+        counts = [sampler.keep() for _ in range(6)]
+        sampler.adjust(0)
+        counts += [sampler.keep() for _ in range(6)]
+        self.assertEqual(counts, [0] * 6 + [7, 0, 0, 0, 4, 0])
+        self.assertEqual(sum(counts), 11)
+        self.assertEqual(sampler.skipped(), 10)
+
+
+if __name__ == '__main__':
+    main()
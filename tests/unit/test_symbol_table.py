@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+from unittest import main, TestCase
+
+from tracerface.symbol_table import SymbolTable
+
+
+class TestSymbolTable(TestCase):
+    def test_intern_returns_consecutive_ids_for_new_symbols(self):
+        symbols = SymbolTable()
+        self.assertEqual(symbols.intern('func1', 'dummy_source1'), 0)
+        self.assertEqual(symbols.intern('func2', 'dummy_source1'), 1)
+        self.assertEqual(symbols.intern('func1', 'dummy_source2'), 2)
+        self.assertEqual(len(symbols), 3)
+
+    def test_intern_returns_same_id_for_same_symbol(self):
+        symbols = SymbolTable()
+        first = symbols.intern('func1', 'dummy_source1')
+        symbols.intern('func2', 'dummy_source1')
+        self.assertEqual(symbols.intern('func1', 'dummy_source1'), first)
+        self.assertEqual(len(symbols), 2)
+
+    def test_symbol_returns_name_and_source_of_id(self):
+        symbols = SymbolTable()
+        symbols.intern('func1', 'dummy_source1')
+        symbol_id = symbols.intern('func2', 'dummy_source2')
+        self.assertEqual(symbols.symbol(symbol_id), ('func2', 'dummy_source2'))
+        self.assertEqual(symbols.symbols(), [('func1', 'dummy_source1'), ('func2', 'dummy_source2')])
+
+
+if __name__ == '__main__':
+    main()
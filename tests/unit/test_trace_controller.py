@@ -1,7 +1,62 @@
 #!/usr/bin/env python3
+from pathlib import Path
+import time
 from unittest import main, mock, TestCase
 
+from tracerface.call_graph import CallGraph
+from tracerface.folded_output import FoldedDelta
+from tracerface.load_output import load_trace_output_from_file_to_call_graph
 from tracerface.trace_controller import TraceController
+from tracerface.trace_process import DEFAULT_OUTPUT_BUDGET
+from tracerface.trace_source import ReplayTraceSource
+
+
+# Stand-in for a tracing process which outputs a
+# single call-stack for each of the traced functions
+class FakeTraceProcess:
+    instances = []
+
+    def __init__(self, source, transport, fold_window, output_budget):
+        self.functions = source.args()[2:]
+        self._lines = []
+        for function in self.functions:
+            self._lines.extend(['19059  19059  dummy_source ' + function, '-14',
+                                "b'{}+0x0 [dummy_source]'".format(function), "b'main+0x1 [dummy_source]'", ''])
+        self._alive = True
+        FakeTraceProcess.instances.append(self)
+
+    def start(self):
+        pass
+
+    def is_alive(self):
+        return self._alive
+
+    def folds_output(self):
+        return False
+
+    def get_lines(self, timeout):
+        lines, self._lines = self._lines, []
+        if not lines:
+            time.sleep(timeout)
+        return lines, len(lines)
+
+    def flush_lines(self):
+        return []
+
+    def dropped_stacks(self):
+        return 0
+
+    def backlog(self):
+        return 0
+
+    def stop(self):
+        self._alive = False
+
+    def join(self):
+        pass
+
+    def close_output(self):
+        pass
 
 
 class TestTraceController(TestCase):
@@ -14,7 +69,44 @@ class TestTraceController(TestCase):
 
         self.assertIsNone(trace_controller.thread_error())
         self.assertTrue(trace_controller._thread_enabled)
-        process.assert_called_once_with(args=['', '-UK', 'dummy', 'functions'])
+        process.assert_called_once_with(source=mock.ANY, transport='ring', fold_window=None,
+                                        output_budget=DEFAULT_OUTPUT_BUDGET)
+        self.assertEqual(process.call_args.kwargs['source'].args(), ['', '-UK', 'dummy', 'functions'])
+
+
+    @mock.patch('tracerface.trace_controller.Thread')
+    @mock.patch('tracerface.trace_controller.TraceProcess')
+    @mock.patch('tracerface.trace_controller.TracerPool')
+    def test_start_trace_runs_warm_tracer(self, pool, process, thread):
+        trace_controller = TraceController(warm_tracers=2)
+        trace_controller.start_trace(['dummy'], mock.Mock())
+
+        pool.assert_called_once_with(2, DEFAULT_OUTPUT_BUDGET)
+        pool.return_value.acquire.assert_called_once_with(mock.ANY, None)
+        pool.return_value.acquire.return_value.start.assert_called_once()
+        process.assert_not_called()
+        # Workers which died are replaced when a trace starts
+        self.assertEqual(pool.return_value.start.call_count, 2)
+        trace_controller.close()
+        self.assertFalse(trace_controller._thread_enabled)
+        pool.return_value.close.assert_called_once()
+
+
+    @mock.patch('tracerface.trace_controller.Thread')
+    @mock.patch('tracerface.trace_controller.TraceProcess')
+    @mock.patch('tracerface.trace_controller.TracerPool')
+    def test_start_trace_starts_process_without_free_warm_tracer(self, pool, process, thread):
+        pool.return_value.acquire.return_value = None
+        trace_controller = TraceController(warm_tracers=1)
+        trace_controller.start_trace(['dummy'], mock.Mock())
+
+        process.return_value.start.assert_called_once()
+
+
+    @mock.patch('tracerface.trace_controller.TracerPool')
+    def test_queue_transport_has_no_warm_tracers(self, pool):
+        TraceController(transport='queue', warm_tracers=1)
+        pool.assert_not_called()
 
 
     def test_start_trace_without_functions(self):
@@ -31,6 +123,247 @@ class TestTraceController(TestCase):
         self.assertFalse(trace_controller._thread_enabled)
 
 
+    def test_monitor_tracing_loads_batches_of_outputs(self):
+        trace_controller = TraceController()
+        trace_controller._thread_enabled = True
+        stack = [
+            '19059  19059  dummy_source func1',
+            '-14',
+            "b'func1+0x0 [dummy_source]'",
+            "b'func2+0x26 [dummy_source]'",
+            ''
+        ]
+        batches = [stack[:3], [], stack[3:]]
+
+        # Stop tracing once every batch was read
+        def get_lines(timeout):
+            if len(batches) == 1:
+                trace_controller.stop_trace()
+            lines = batches.pop(0)
+            return lines, len(lines)
+
+        trace_process = mock.Mock()
+        trace_process.get_lines.side_effect = get_lines
+        trace_process.is_alive.return_value = True
+        trace_process.folds_output.return_value = False
+        trace_process.backlog.return_value = 0
+        call_graph = CallGraph()
+
+        trace_controller._monitor_tracing(trace_process, call_graph)
+
+        self.assertEqual(sorted(node['name'] for node in call_graph.get_nodes().values()), ['func1', 'func2'])
+        self.assertEqual(sum(edge['call_count'] for edge in call_graph.get_edges().values()), 1)
+        trace_process.stop.assert_called_once()
+
+
+    def test_monitor_tracing_loads_folded_deltas(self):
+        trace_controller = TraceController()
+        trace_controller._thread_enabled = True
+        batches = [
+            [FoldedDelta(symbols=[('func1', 'dummy_source'), ('func2', 'dummy_source')], stacks=[((0, 1), (), 2)])],
+            [FoldedDelta(symbols=[], stacks=[((0, 1), (), 1)])]
+        ]
+
+        # Stop tracing once every batch was read
+        def get_deltas(timeout):
+            if len(batches) == 1:
+                trace_controller.stop_trace()
+            return batches.pop(0)
+
+        trace_process = mock.Mock()
+        trace_process.get_deltas.side_effect = get_deltas
+        trace_process.is_alive.return_value = True
+        trace_process.folds_output.return_value = True
+        call_graph = CallGraph()
+
+        trace_controller._monitor_tracing(trace_process, call_graph)
+
+        self.assertEqual(sorted(node['name'] for node in call_graph.get_nodes().values()), ['func1', 'func2'])
+        self.assertEqual(sum(edge['call_count'] for edge in call_graph.get_edges().values()), 3)
+        trace_process.get_lines.assert_not_called()
+
+
+    def _stack_lines(self, function):
+        return ['19059  19059  dummy_source ' + function, '-14', "b'{}+0x0 [dummy_source]'".format(function), '']
+
+    def _run_monitor(self, trace_controller, batches, call_graph, backlog=0):
+        timeouts = []
+        # Stop tracing once every batch was read
+        def get_lines(timeout):
+            timeouts.append(timeout)
+            if len(batches) == 1:
+                trace_controller.stop_trace()
+            lines = batches.pop(0)
+            return lines, len(lines)
+
+        trace_process = mock.Mock()
+        trace_process.get_lines.side_effect = get_lines
+        trace_process.is_alive.return_value = True
+        trace_process.folds_output.return_value = False
+        trace_process.backlog.return_value = backlog
+        trace_process.dropped_stacks.return_value = 0
+        trace_controller._thread_enabled = True
+        trace_controller._monitor_tracing(trace_process, call_graph)
+        return timeouts
+
+
+    def test_monitor_tracing_merges_full_batch_before_window_ends(self):
+        trace_controller = TraceController(batch_window=60, batch_size=2)
+        call_graph = CallGraph()
+        batches = [self._stack_lines('func1'), self._stack_lines('func2'), self._stack_lines('func3'), []]
+
+        timeouts = self._run_monitor(trace_controller, batches, call_graph)
+
+        metrics = trace_controller.metrics()
+        self.assertEqual(metrics['batches'], 2)
+        self.assertEqual(metrics['stacks'], 3)
+        self.assertGreaterEqual(metrics['max_flush_latency'], metrics['last_flush_latency'])
+        self.assertGreaterEqual(metrics['mean_flush_latency'], 0)
+        self.assertEqual(sum(node['call_count'] for node in call_graph.get_nodes().values()), 3)
+        # Reading waits only for the rest of the window of a started batch
+        self.assertEqual(timeouts[0], 60)
+        self.assertLess(timeouts[1], 60)
+
+
+    def test_monitor_tracing_merges_batch_when_window_ends(self):
+        trace_controller = TraceController(batch_window=0, batch_size=100)
+        call_graph = CallGraph()
+        batches = [self._stack_lines('func1'), self._stack_lines('func2'), []]
+
+        self._run_monitor(trace_controller, batches, call_graph)
+
+        self.assertEqual(trace_controller.metrics()['batches'], 2)
+        self.assertEqual(trace_controller.metrics()['stacks'], 2)
+
+
+    def test_monitor_tracing_samples_call_stacks_while_behind(self):
+        trace_controller = TraceController(batch_window=60)
+        call_graph = CallGraph()
+        # The backlog doubles the interval to 2 on the first read
+        batches = [sum((self._stack_lines('func{}'.format(index)) for index in range(4)), []), []]
+
+        self._run_monitor(trace_controller, batches, call_graph, backlog=0.75)
+
+        counts = {node['name']: node['call_count'] for node in call_graph.get_nodes().values()}
+        self.assertEqual(counts, {'func1': 2, 'func3': 2})
+        self.assertEqual(trace_controller.sampled_stacks(), 2)
+        self.assertTrue(trace_controller.approximate())
+
+
+    def test_monitor_tracing_counts_every_call_stack_while_keeping_up(self):
+        trace_controller = TraceController(batch_window=60)
+        call_graph = CallGraph()
+        batches = [sum((self._stack_lines('func{}'.format(index)) for index in range(4)), []), []]
+
+        self._run_monitor(trace_controller, batches, call_graph)
+
+        self.assertEqual(len(call_graph.get_nodes()), 4)
+        self.assertEqual(trace_controller.sampled_stacks(), 0)
+        self.assertFalse(trace_controller.approximate())
+
+
+    @mock.patch('tracerface.trace_controller.Thread')
+    @mock.patch('tracerface.trace_controller.TraceProcess')
+    def test_start_trace_resets_metrics(self, process, thread):
+        trace_controller = TraceController()
+        trace_controller._record_flush(1, 0.5, 0.1)
+
+        trace_controller.start_trace(['dummy'], mock.Mock())
+
+        self.assertEqual(trace_controller.metrics()['batches'], 0)
+        self.assertEqual(trace_controller.metrics()['max_flush_latency'], 0)
+
+
+    @mock.patch('tracerface.trace_controller.Thread')
+    @mock.patch('tracerface.trace_controller.TraceProcess')
+    def test_start_trace_resets_symbols(self, process, thread):
+        trace_controller = TraceController()
+        trace_controller._symbols.intern('func1', 'dummy_source1')
+
+        trace_controller.start_trace(['dummy'], mock.Mock())
+
+        self.assertEqual(len(trace_controller._symbols), 0)
+
+
+    @mock.patch('tracerface.trace_controller.TraceProcess', FakeTraceProcess)
+    def test_sharded_trace_merges_every_shard_into_graph(self):
+        FakeTraceProcess.instances = []
+        trace_controller = TraceController(shards=2)
+        call_graph = CallGraph()
+
+        trace_controller.start_trace(['func1', 'func2', 'func3'], call_graph)
+        deadline = time.monotonic() + 5
+        while call_graph.max_count() == 0 or len(call_graph.get_nodes()) < 4:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+        trace_controller.stop_trace()
+        trace_controller.join()
+
+        self.assertEqual([process.functions for process in FakeTraceProcess.instances], [['func1', 'func3'], ['func2']])
+        self.assertEqual(sorted(node['name'] for node in call_graph.get_nodes().values()), ['func1', 'func2', 'func3', 'main'])
+        self.assertEqual(sum(edge['call_count'] for edge in call_graph.get_edges().values()), 3)
+        self.assertEqual(len(trace_controller._probe_rates), 3)
+        self.assertIsNone(trace_controller.thread_error())
+
+
+    @mock.patch('tracerface.trace_controller.TraceProcess', FakeTraceProcess)
+    def test_restarted_trace_stops_previous_trace_first(self):
+        FakeTraceProcess.instances = []
+        trace_controller = TraceController()
+        call_graph = CallGraph()
+
+        trace_controller.start_trace(['func1'], call_graph)
+        trace_controller.stop_trace()
+        trace_controller.start_trace(['func2'], call_graph)
+        deadline = time.monotonic() + 5
+        while len(call_graph.get_nodes()) < 2:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+        trace_controller.stop_trace()
+        trace_controller.join()
+
+        self.assertFalse(FakeTraceProcess.instances[0].is_alive())
+        self.assertEqual(sorted(node['name'] for node in call_graph.get_nodes().values()), ['func2', 'main'])
+        self.assertIsNone(trace_controller.thread_error())
+
+
+    def test_replayed_trace_loads_same_graph_as_output_file(self):
+        output_path = str(Path(__file__).absolute().parent.parent.joinpath('resources', 'test_static_output'))
+        expected = CallGraph()
+        load_trace_output_from_file_to_call_graph(output_path, expected)
+
+        for fold_in_tracer in (False, True):
+            trace_controller = TraceController(fold_in_tracer=fold_in_tracer,
+                                               source_factory=lambda functions: ReplayTraceSource(output_path))
+            call_graph = CallGraph()
+            trace_controller.start_trace(['dummy'], call_graph)
+            trace_controller.join(10)
+
+            self.assertIsNone(trace_controller.thread_error())
+            self.assertEqual(sorted(call_graph.get_nodes().values(), key=lambda node: node['name']),
+                             sorted(expected.get_nodes().values(), key=lambda node: node['name']))
+
+
+    def test_restarted_trace_of_warm_tracer_loads_same_graph(self):
+        output_path = str(Path(__file__).absolute().parent.parent.joinpath('resources', 'test_static_output'))
+        expected = CallGraph()
+        load_trace_output_from_file_to_call_graph(output_path, expected)
+
+        trace_controller = TraceController(source_factory=lambda functions: ReplayTraceSource(output_path),
+                                           warm_tracers=1)
+        try:
+            for _ in range(2):
+                call_graph = CallGraph()
+                trace_controller.start_trace(['dummy'], call_graph)
+                trace_controller.join(10)
+
+                self.assertIsNone(trace_controller.thread_error())
+                self.assertEqual(sorted(call_graph.get_nodes().values(), key=lambda node: node['name']),
+                                 sorted(expected.get_nodes().values(), key=lambda node: node['name']))
+        finally:
+            trace_controller.close()
+
+
     def test_thread_error_returns_error(self):
         trace_controller = TraceController()
         trace_controller._thread_error = 'Dummy Error'
@@ -1,10 +1,13 @@
 #!/usr/bin/env python3
+from ctypes import c_int, CDLL, CFUNCTYPE, POINTER, sizeof
 from multiprocessing import get_context
 import sys
 import time
 from unittest import main, mock, TestCase
 
-from tracerface.trace_process import TraceProcess, WritableQueue
+from tracerface.folded_output import FoldedDelta
+from tracerface.trace_process import QUEUE_TRANSPORT, RING_TRANSPORT, StackWriter, TraceProcess, WritableQueue
+from tracerface.trace_stop import check_stopped
 
 
 class TestWritableQueue(TestCase):
@@ -13,44 +16,285 @@ class TestWritableQueue(TestCase):
         queue.write('val')
         self.assertEqual(queue.get(), 'val')
 
+    def test_records_over_budget_are_dropped(self):
+        queue = WritableQueue(8, ctx=get_context())
+        queue.write('val1')
+        queue.write('val2val3')
+        queue.write('val4')
+        queue.write('val5')
+        self.assertEqual(queue.dropped(), 2)
+        self.assertEqual(queue.backlog(), 1)
+        self.assertEqual(queue.get(), 'val1')
+        self.assertEqual(queue.get(), 'val4')
+        self.assertEqual(queue.backlog(), 0)
+        self.assertTrue(queue.put_bytes(b'val6'))
+
+
+# Transport which records the writes and can be made full
+class _FakeTransport:
+    def __init__(self):
+        self.records = []
+        self.full = False
+
+    def write(self, s):
+        if not self.full:
+            self.records.append(s)
+
+
+class TestStackWriter(TestCase):
+    def _print_stack(self, writer, function):
+        for line in ['19059  19059  dummy_source ' + function, "b'{}+0x0 [dummy_source]'".format(function), '']:
+            writer.write(line)
+            writer.write('\n')
+
+    def test_writes_of_a_call_stack_are_written_together(self):
+        transport = _FakeTransport()
+        writer = StackWriter(transport)
+        self._print_stack(writer, 'func1')
+        writer.write('partial')
+        self.assertEqual(transport.records, ["19059  19059  dummy_source func1\nb'func1+0x0 [dummy_source]'\n\n"])
+        writer.close()
+        self.assertEqual(transport.records[1], 'partial\n')
+
+    def test_call_stacks_are_dropped_whole(self):
+        transport = _FakeTransport()
+        writer = StackWriter(transport)
+        transport.full = True
+        self._print_stack(writer, 'func1')
+        transport.full = False
+        self._print_stack(writer, 'func2')
+        self.assertEqual(len(transport.records), 1)
+        self.assertIn("b'func2+0x0 [dummy_source]'\n", transport.records[0])
+
+    def test_writes_of_any_size_are_split_between_call_stacks(self):
+        transport = _FakeTransport()
+        writer = StackWriter(transport)
+        writer.write('header\nfra')
+        writer.write('me\n  \nnext')
+        self.assertEqual(transport.records, ['header\nframe\n  \n'])
+        writer.close()
+        self.assertEqual(transport.records[1], 'next\n')
+
+
+# Source printing call-stacks until it is stopped
+class _EndlessSource:
+    def run(self):
+        while True:
+            print('19059  19059  dummy_source func1')
+            print("b'func1+0x0 [dummy_source]'")
+            print()
+            check_stopped()
+            time.sleep(0.001)
+
+
+# Source printing call-stacks from callbacks of a C function the way
+# bcc prints events, checking whether it was stopped between the calls
+class _CallbackSource:
+    def run(self):
+        def compare(a, b):
+            print('19059  19059  dummy_source func1')
+            print()
+            time.sleep(0.01)
+            return a[0] - b[0]
+
+        compare_function = CFUNCTYPE(c_int, POINTER(c_int), POINTER(c_int))(compare)
+        values = (c_int * 8)(*range(8))
+        while True:
+            CDLL(None).qsort(values, len(values), sizeof(c_int), compare_function)
+            check_stopped()
+
 
 class TesTraceProcess(TestCase):
-    def test_get_value_returns_none_for_empty_trace_process(self):
+    def test_get_lines_returns_nothing_for_empty_trace_process(self):
         process = TraceProcess('dummy_args')
-        self.assertEqual(process.get_output(), None)
+        self.assertEqual(process.get_lines(0.01), ([], 0))
+        self.assertEqual(process.flush_lines(), [])
 
-    @mock.patch('tracerface.trace_process._get_bcc_trace_tool')
-    def test_get_value_returns_value_from_tool(self, tool):
+    @mock.patch('tracerface.trace_source._get_bcc_trace_tool')
+    @mock.patch('tracerface.trace_source._poll_events')
+    def test_get_lines_returns_value_from_tool(self, poll, tool):
         def dummy_print():
             print('dummy_val')
 
-        tool.return_value.run = dummy_print
+        poll.side_effect = lambda tool: dummy_print()
         process = TraceProcess('dummy_args')
         process.start()
         process.join()
-        self.assertEqual(process.get_output(), 'dummy_val')
+        self.assertEqual(process.get_lines(1), (['dummy_val'], 1))
 
-    @mock.patch('tracerface.trace_process._get_bcc_trace_tool')
-    def test_get_value_strips_spaces(self, tool):
+    @mock.patch('tracerface.trace_source._get_bcc_trace_tool')
+    @mock.patch('tracerface.trace_source._poll_events')
+    def test_get_lines_strips_spaces(self, poll, tool):
         def dummy_print():
             print('         dummy_val         ')
 
-        tool.return_value.run = dummy_print
+        poll.side_effect = lambda tool: dummy_print()
         process = TraceProcess('dummy_args')
         process.start()
         process.join()
-        self.assertEqual(process.get_output(), 'dummy_val')
+        self.assertEqual(process.get_lines(1), (['dummy_val'], 1))
 
-    @mock.patch('tracerface.trace_process._get_bcc_trace_tool')
-    def test_get_value_keeps_empty_line(self, tool):
+    @mock.patch('tracerface.trace_source._get_bcc_trace_tool')
+    @mock.patch('tracerface.trace_source._poll_events')
+    def test_get_lines_keeps_empty_lines(self, poll, tool):
         def dummy_print():
             print('\n')
 
-        tool.return_value.run = dummy_print
+        poll.side_effect = lambda tool: dummy_print()
+        process = TraceProcess('dummy_args')
+        process.start()
+        process.join()
+        self.assertEqual(process.get_lines(1), (['', ''], 2))
+
+    @mock.patch('tracerface.trace_source._get_bcc_trace_tool')
+    @mock.patch('tracerface.trace_source._poll_events')
+    def test_get_lines_returns_available_lines_at_once(self, poll, tool):
+        def dummy_print():
+            print('dummy_val1')
+            print('dummy_val2')
+            print()
+            print('dummy_val3')
+
+        poll.side_effect = lambda tool: dummy_print()
         process = TraceProcess('dummy_args')
         process.start()
         process.join()
-        self.assertEqual(process.get_output(), '\n')
+        self.assertEqual(process.get_lines(1), (['dummy_val1', 'dummy_val2', '', 'dummy_val3'], 2))
+
+    @mock.patch('tracerface.trace_source._get_bcc_trace_tool')
+    @mock.patch('tracerface.trace_source._poll_events')
+    def test_lines_written_in_chunks_are_reassembled(self, poll, tool):
+        def dummy_print():
+            sys.stdout.write('dummy_')
+            sys.stdout.write('val1\ndummy_val2\n\ndummy_')
+            sys.stdout.write('val3')
+
+        poll.side_effect = lambda tool: dummy_print()
+        for transport in (QUEUE_TRANSPORT, RING_TRANSPORT):
+            process = TraceProcess('dummy_args', transport=transport)
+            try:
+                process.start()
+                process.join()
+                self.assertEqual(process.get_lines(1)[0], ['dummy_val1', 'dummy_val2', '', 'dummy_val3'])
+            finally:
+                process.close_output()
+
+    @mock.patch('tracerface.trace_source._get_bcc_trace_tool')
+    @mock.patch('tracerface.trace_source._poll_events')
+    def test_get_lines_through_ring_buffer(self, poll, tool):
+        def dummy_print():
+            print('         dummy_val         ')
+
+        poll.side_effect = lambda tool: dummy_print()
+        process = TraceProcess('dummy_args', transport=RING_TRANSPORT)
+        try:
+            process.start()
+            process.join()
+            self.assertEqual(process.get_lines(1), (['dummy_val'], 1))
+            self.assertEqual(process.dropped_stacks(), 0)
+        finally:
+            process.close_output()
+
+    def test_partial_line_is_returned_by_flush(self):
+        process = TraceProcess('dummy_args')
+        process._queue.write('dummy_val1\ndummy_')
+        self.assertEqual(process.get_lines(1), (['dummy_val1'], 1))
+        self.assertEqual(process.flush_lines(), ['dummy_'])
+
+    @mock.patch('tracerface.trace_source._get_bcc_trace_tool')
+    @mock.patch('tracerface.trace_source._poll_events')
+    def test_get_deltas_returns_call_stacks_folded_by_process(self, poll, tool):
+        def dummy_print():
+            for _ in range(3):
+                print('19059  19059  dummy_source func1')
+                print('-14')
+                print("b'func1+0x0 [dummy_source]'")
+                print()
+
+        poll.side_effect = lambda tool: dummy_print()
+        for transport in (QUEUE_TRANSPORT, RING_TRANSPORT):
+            process = TraceProcess('dummy_args', transport=transport, fold_window=10)
+            try:
+                process.start()
+                process.join()
+                self.assertTrue(process.folds_output())
+                self.assertEqual(process.get_deltas(1), [
+                    FoldedDelta(symbols=[('func1', 'dummy_source')], stacks=[((0,), (), 3)])
+                ])
+            finally:
+                process.close_output()
+
+    @mock.patch('tracerface.trace_source._get_bcc_trace_tool')
+    @mock.patch('tracerface.trace_source._poll_events')
+    def test_call_stacks_over_output_budget_are_dropped(self, poll, tool):
+        def dummy_print():
+            for index in range(10):
+                print('19059  19059  dummy_source func{}'.format(index))
+                print()
+
+        poll.side_effect = lambda tool: dummy_print()
+        for transport in (QUEUE_TRANSPORT, RING_TRANSPORT):
+            process = TraceProcess('dummy_args', transport=transport, output_budget=100)
+            try:
+                process.start()
+                process.join()
+                lines = []
+                while True:
+                    batch, record_count = process.get_lines(0.1)
+                    if not record_count:
+                        break
+                    lines.extend(batch)
+                kept = [line for line in lines if line.startswith('19059')]
+                self.assertGreater(process.dropped_stacks(), 0)
+                self.assertEqual(len(kept) + process.dropped_stacks(), 10)
+                self.assertEqual(lines.count(''), len(kept))
+            finally:
+                process.close_output()
+
+    def test_stopped_process_passes_last_folded_window(self):
+        for transport in (QUEUE_TRANSPORT, RING_TRANSPORT):
+            process = TraceProcess(transport=transport, fold_window=60, source=_EndlessSource())
+            try:
+                process.start()
+                process._ready.wait(5)
+                time.sleep(0.1)
+                process.stop()
+                self.assertEqual(process.exitcode, 0)
+                deltas = process.get_deltas(1)
+                self.assertEqual(len(deltas), 1)
+                self.assertGreater(deltas[0].stacks[0][2], 0)
+            finally:
+                process.close_output()
+
+    def test_process_stopped_while_printing_from_callback_ends(self):
+        process = TraceProcess(transport=RING_TRANSPORT, fold_window=60, source=_CallbackSource())
+        try:
+            process.start()
+            process._ready.wait(5)
+            time.sleep(0.1)
+            process.stop()
+            self.assertEqual(process.exitcode, 0)
+            self.assertEqual(len(process.get_deltas(1)), 1)
+        finally:
+            process.close_output()
+
+    def test_call_stacks_of_deltas_which_can_not_be_sent_are_dropped(self):
+        for transport in (QUEUE_TRANSPORT, RING_TRANSPORT):
+            process = TraceProcess(transport=transport, fold_window=60, source=_EndlessSource(), output_budget=16)
+            try:
+                process.start()
+                process._ready.wait(5)
+                time.sleep(0.1)
+                process.stop()
+                self.assertEqual(process.get_deltas(0.1), [])
+                self.assertGreater(process.dropped_stacks(), 0)
+            finally:
+                process.close_output()
+
+    @mock.patch('tracerface.ring_buffer.SharedMemory', None)
+    def test_ring_transport_falls_back_to_queue(self):
+        process = TraceProcess('dummy_args', transport=RING_TRANSPORT)
+        self.assertIsInstance(process._queue, WritableQueue)
 
 
 if __name__ == '__main__':
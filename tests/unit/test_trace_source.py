@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+from contextlib import redirect_stdout
+import gzip
+from io import StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import time
+from unittest import main, mock, TestCase
+
+from tracerface.trace_source import (
+    _poll_events,
+    _POLL_MILLISECONDS,
+    bcc_trace_source,
+    BccToolCache,
+    BccTraceSource,
+    ReplayTraceSource
+)
+from tracerface.trace_stop import request_stop, stoppable, TraceStopped
+
+
+_OUTPUT = (
+    'PID    TID    COMM         FUNC             -\n'
+    '24622  24622  test_applicatio func2\n'
+    '-14\n'
+    "b'func2+0x0 [test_application]'\n"
+    '\n'
+    '24622  24622  test_applicatio func3\n'
+    '-14\n'
+    "b'func3+0x0 [test_application]'\n"
+    '\n'
+)
+
+
+class TestBccTraceSource(TestCase):
+    def test_bcc_trace_source_for_functions(self):
+        source = bcc_trace_source(['func1', 'func2'])
+        self.assertEqual(source.args(), ['', '-UK', 'func1', 'func2'])
+        self.assertFalse(source.ends_by_itself())
+
+    @mock.patch('tracerface.trace_source._poll_events')
+    @mock.patch('tracerface.trace_source._get_bcc_trace_tool')
+    def test_run_runs_bcc_trace_tool(self, get_tool, poll):
+        tool = _fake_tool()
+        get_tool.return_value = tool
+        BccTraceSource(['', 'dummy_arg']).run()
+        get_tool.assert_called_once_with(['', 'dummy_arg'])
+        poll.assert_called_once_with(tool)
+        tool.bpf.cleanup.assert_called_once()
+
+    @mock.patch('tracerface.trace_source._get_bcc_trace_tool')
+    def test_run_runs_tool_of_cache(self, tool):
+        tools = mock.Mock()
+        BccTraceSource(['', 'dummy_arg']).run(tools)
+        tools.run.assert_called_once_with(['', 'dummy_arg'])
+        tool.assert_not_called()
+
+
+# Returns a bcc trace tool with a kernel probe, its program is loaded
+# once its probes are attached for the first time
+def _fake_tool():
+    tool = mock.Mock()
+    tool.probes = [mock.Mock(library='', probe_type='p')]
+    tool.bpf = None
+    def attach_probes():
+        tool.bpf = mock.Mock(kprobe_fds={'p_func1': 3}, uprobe_fds={}, tracepoint_fds={})
+    tool._attach_probes.side_effect = attach_probes
+    return tool
+
+
+class TestBccToolCache(TestCase):
+    def test_events_are_polled_until_trace_is_stopped(self):
+        tool = _fake_tool()
+        tool._attach_probes()
+        timeouts = []
+        def poll(timeout):
+            timeouts.append(timeout)
+            # The signal arrives while bcc prints an event of the second poll
+            if len(timeouts) == 2:
+                request_stop()
+        tool.bpf.perf_buffer_poll.side_effect = poll
+        with self.assertRaises(TraceStopped), stoppable():
+            _poll_events(tool)
+        self.assertEqual(timeouts, [_POLL_MILLISECONDS] * 2)
+
+    @mock.patch('tracerface.trace_source._poll_events')
+    @mock.patch('tracerface.trace_source._discard_stale_events')
+    @mock.patch('tracerface.trace_source._get_bcc_trace_tool')
+    def test_tool_is_compiled_once_for_same_arguments(self, get_tool, discard, poll):
+        tool = _fake_tool()
+        get_tool.return_value = tool
+        tools = BccToolCache()
+        tools.run(['', 'func1'])
+        tools.run(['', 'func1'])
+        get_tool.assert_called_once_with(['', 'func1'])
+        tool._generate_program.assert_called_once()
+        tool._attach_probes.assert_called_once()
+        tool.probes[0]._attach_k.assert_called_once_with(tool.bpf)
+        self.assertEqual(poll.call_count, 2)
+        self.assertEqual(len(tools), 1)
+
+    @mock.patch('tracerface.trace_source._poll_events')
+    @mock.patch('tracerface.trace_source._discard_stale_events')
+    @mock.patch('tracerface.trace_source._get_bcc_trace_tool')
+    def test_probes_are_detached_when_run_stops(self, get_tool, discard, poll):
+        tool = _fake_tool()
+        get_tool.return_value = tool
+        poll.side_effect = TraceStopped()
+        with self.assertRaises(TraceStopped):
+            BccToolCache().run(['', 'func1'])
+        tool.bpf.detach_kprobe_event.assert_called_once_with('p_func1')
+        tool.bpf.cleanup.assert_not_called()
+        discard.assert_called_once_with(tool)
+
+    @mock.patch('tracerface.trace_source._poll_events')
+    @mock.patch('tracerface.trace_source._discard_stale_events')
+    @mock.patch('tracerface.trace_source._get_bcc_trace_tool')
+    def test_stop_while_attaching_detaches_after_attaching(self, get_tool, discard, poll):
+        tool = _fake_tool()
+        get_tool.return_value = tool
+        tool._generate_program.side_effect = request_stop
+        tools = BccToolCache()
+        with self.assertRaises(TraceStopped), stoppable():
+            tools.run(['', 'func1'])
+        tool._attach_probes.assert_called_once()
+        poll.assert_not_called()
+        tool.bpf.detach_kprobe_event.assert_called_once_with('p_func1')
+        self.assertEqual(len(tools), 1)
+
+    @mock.patch('tracerface.trace_source._poll_events')
+    @mock.patch('tracerface.trace_source._discard_stale_events')
+    @mock.patch('tracerface.trace_source._get_bcc_trace_tool')
+    def test_least_recently_run_tool_is_unloaded(self, get_tool, discard, poll):
+        first, second, third = _fake_tool(), _fake_tool(), _fake_tool()
+        get_tool.side_effect = [first, second, third]
+        tools = BccToolCache(size=2)
+        tools.run(['', 'func1'])
+        tools.run(['', 'func2'])
+        tools.run(['', 'func1'])
+        tools.run(['', 'func3'])
+        second.bpf.cleanup.assert_called_once()
+        first.bpf.cleanup.assert_not_called()
+        self.assertEqual(len(tools), 2)
+
+    @mock.patch('tracerface.trace_source._poll_events')
+    @mock.patch('tracerface.trace_source._discard_stale_events')
+    @mock.patch('tracerface.trace_source._get_bcc_trace_tool')
+    def test_tool_with_usdt_probes_is_not_cached(self, get_tool, discard, poll):
+        tool = _fake_tool()
+        tool.probes[0].probe_type = 'u'
+        get_tool.return_value = tool
+        tools = BccToolCache()
+        tools.run(['', 'u:lib:probe'])
+        tool.bpf.cleanup.assert_called_once()
+        self.assertEqual(len(tools), 0)
+
+
+class TestReplayTraceSource(TestCase):
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.path = Path(self.directory.name).joinpath('output')
+        self.path.write_text(_OUTPUT)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _replay(self, source):
+        output = StringIO()
+        with redirect_stdout(output):
+            source.run()
+        return output.getvalue()
+
+    def test_output_is_printed_as_recorded(self):
+        source = ReplayTraceSource(str(self.path))
+        self.assertEqual(self._replay(source), _OUTPUT)
+        self.assertTrue(source.ends_by_itself())
+
+    def test_compressed_output_is_replayed(self):
+        compressed_path = Path(self.directory.name).joinpath('output.gz')
+        compressed_path.write_bytes(gzip.compress(_OUTPUT.encode()))
+        self.assertEqual(self._replay(ReplayTraceSource(str(compressed_path))), _OUTPUT)
+
+    def test_output_is_repeated(self):
+        self.assertEqual(self._replay(ReplayTraceSource(str(self.path), repeat=2)), _OUTPUT * 2)
+
+    def test_call_stacks_are_replayed_at_given_rate(self):
+        start = time.monotonic()
+        self._replay(ReplayTraceSource(str(self.path), stacks_per_second=20))
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+from unittest import main, TestCase
+
+from tracerface.trace_stop import check_stopped, protected, request_stop, stoppable, TraceStopped
+
+
+class TestTraceStop(TestCase):
+    def test_stop_is_ignored_while_no_trace_runs(self):
+        request_stop()
+        with stoppable():
+            check_stopped()
+
+    def test_stop_is_raised_when_running_trace_checks_for_it(self):
+        checked = False
+        with self.assertRaises(TraceStopped), stoppable():
+            request_stop()
+            checked = True
+            check_stopped()
+        self.assertTrue(checked)
+
+    def test_stop_is_not_raised_while_protected(self):
+        with self.assertRaises(TraceStopped), stoppable():
+            with protected():
+                request_stop()
+                check_stopped()
+
+    def test_stop_is_raised_after_protected_block(self):
+        finished = False
+        with self.assertRaises(TraceStopped), stoppable():
+            with protected():
+                request_stop()
+                finished = True
+        self.assertTrue(finished)
+
+    def test_stop_of_last_trace_does_not_stop_next_one(self):
+        with stoppable():
+            with self.assertRaises(TraceStopped):
+                with protected():
+                    request_stop()
+        with stoppable():
+            with protected():
+                pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import time
+from unittest import main, mock, TestCase
+
+from tracerface.trace_source import ReplayTraceSource
+from tracerface.trace_stop import check_stopped
+from tracerface.tracer_pool import TracerPool
+
+
+_OUTPUT = (
+    '24622  24622  test_applicatio func2\n'
+    "b'func2+0x0 [test_application]'\n"
+    '\n'
+)
+
+
+# Source printing call-stacks until it is stopped
+class _EndlessSource:
+    def run(self, tools=None):
+        while True:
+            print(_OUTPUT, end='')
+            check_stopped()
+            time.sleep(0.01)
+
+    def ends_by_itself(self):
+        return False
+
+
+# Source printing call-stacks without ever checking whether it was stopped
+class _StubbornSource:
+    def run(self, tools=None):
+        while True:
+            print(_OUTPUT, end='')
+            time.sleep(0.01)
+
+    def ends_by_itself(self):
+        return False
+
+
+# Read every line of a trace until it ended
+def _read_lines(trace):
+    lines = []
+    while trace.is_alive():
+        lines.extend(trace.get_lines(0.05)[0])
+    while True:
+        new_lines, record_count = trace.get_lines(0.05)
+        if not record_count:
+            return lines + trace.flush_lines()
+        lines.extend(new_lines)
+
+
+class TestTracerPool(TestCase):
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.path = Path(self.directory.name).joinpath('output')
+        self.path.write_text(_OUTPUT * 3)
+        self.pool = TracerPool(1)
+        self.pool.start()
+
+    def tearDown(self):
+        self.pool.close()
+        self.directory.cleanup()
+
+    def test_trace_is_run_by_warm_worker(self):
+        trace = self.pool.acquire(ReplayTraceSource(str(self.path)))
+        self.assertEqual(self.pool.idle_count(), 0)
+        trace.start()
+        lines = _read_lines(trace)
+        self.assertEqual(lines.count('24622  24622  test_applicatio func2'), 3)
+        self.assertEqual(trace.exitcode, 0)
+        trace.close_output()
+        self.assertEqual(self.pool.idle_count(), 1)
+
+    def test_worker_is_reused_for_next_trace(self):
+        trace = self.pool.acquire(ReplayTraceSource(str(self.path)))
+        worker_pid = trace._worker.pid
+        trace.start()
+        _read_lines(trace)
+        trace.close_output()
+        trace = self.pool.acquire(ReplayTraceSource(str(self.path)))
+        self.assertEqual(trace._worker.pid, worker_pid)
+        trace.start()
+        self.assertEqual(len(_read_lines(trace)), 9)
+        trace.close_output()
+
+    def test_output_left_by_last_trace_is_discarded(self):
+        trace = self.pool.acquire(ReplayTraceSource(str(self.path)))
+        trace.start()
+        trace.join()
+        trace.close_output()
+        trace = self.pool.acquire(ReplayTraceSource(str(self.path)))
+        trace.start()
+        self.assertEqual(len(_read_lines(trace)), 9)
+        trace.close_output()
+
+    def test_stopped_trace_ends_and_worker_stays_ready(self):
+        trace = self.pool.acquire(_EndlessSource())
+        trace.start()
+        self.assertTrue(trace.get_lines(5)[1])
+        trace.stop()
+        trace.join(5)
+        self.assertFalse(trace.is_alive())
+        self.assertEqual(trace.exitcode, 0)
+        trace.close_output()
+        trace = self.pool.acquire(ReplayTraceSource(str(self.path)))
+        trace.start()
+        self.assertEqual(len(_read_lines(trace)), 9)
+        trace.close_output()
+
+    def test_trace_stopped_right_after_start_ends(self):
+        trace = self.pool.acquire(_EndlessSource())
+        trace.start()
+        trace.stop()
+        trace.join(5)
+        self.assertFalse(trace.is_alive())
+        trace.close_output()
+
+    @mock.patch('tracerface.tracer_pool._STOP_SECONDS', 0.5)
+    def test_trace_which_does_not_stop_in_time_is_terminated(self):
+        trace = self.pool.acquire(_StubbornSource())
+        trace.start()
+        trace._worker.wait(0.1)
+        trace.stop()
+        trace.join()
+        self.assertFalse(trace.is_alive())
+        self.assertEqual(trace.exitcode, -15)
+        trace.close_output()
+        self.pool.start()
+        self.assertEqual(self.pool.idle_count(), 1)
+
+    def test_no_trace_while_every_worker_is_busy(self):
+        trace = self.pool.acquire(ReplayTraceSource(str(self.path)))
+        self.assertIsNone(self.pool.acquire(ReplayTraceSource(str(self.path))))
+        trace.close_output()
+        trace = self.pool.acquire(ReplayTraceSource(str(self.path)))
+        self.assertIsNotNone(trace)
+        trace.close_output()
+
+    def test_dead_worker_is_replaced(self):
+        trace = self.pool.acquire(ReplayTraceSource(str(self.path)))
+        trace._worker.terminate()
+        trace._worker.join()
+        self.assertEqual(trace.exitcode, -15)
+        trace.close_output()
+        self.assertIsNone(self.pool.acquire(ReplayTraceSource(str(self.path))))
+        self.pool.start()
+        trace = self.pool.acquire(ReplayTraceSource(str(self.path)))
+        self.assertTrue(trace._worker.is_alive())
+        trace.start()
+        self.assertEqual(len(_read_lines(trace)), 9)
+        trace.close_output()
+
+
+    def test_close_stops_busy_workers(self):
+        trace = self.pool.acquire(_EndlessSource())
+        trace.start()
+        worker = trace._worker
+        self.pool.close()
+        self.assertFalse(worker.is_alive())
+        trace.close_output()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,32 +1,47 @@
 #!/usr/bin/env python3
-from unittest import main, TestCase
+from threading import Event, Thread
+from unittest import main, mock, TestCase
 
+from tracerface.call_graph import CallGraph
+from tracerface.param_counter import ParamCounter
 from tracerface.web_ui.ui_format import (
     convert_edges_to_cytoscape_format,
-    convert_nodes_to_cytoscape_format
+    convert_nodes_to_cytoscape_format,
+    CytoscapeCache,
+    edge_element_id,
+    node_element_id,
+    parse_element_id
 )
 
 
+# Build a parameter counter from (parameters, count) pairs
+def _params(*counts):
+    counter = ParamCounter()
+    for params, count in counts:
+        counter.add(params, count)
+    return counter
+
+
 class TestConvertNodes(TestCase):
     def _edges(self):
         return {
-            ('dummy_hash1', 'dummy_hash2'): {
-                'params': [],
+            (1, 2): {
+                'params': _params(),
                 'call_count': 0
             },
-            ('dummy_hash1', 'dummy_hash3'): {
-                'params': [['dummy_param']],
+            (1, 3): {
+                'params': _params((('dummy_param',), 1)),
                 'call_count': 3
             },
-            ('dummy_hash2', 'dummy_hash3'): {
-                'params': [['dummy_param1'], ['dummy_param2'], ['dummy_param3']],
+            (2, 3): {
+                'params': _params((('dummy_param1',), 1), (('dummy_param2',), 1), (('dummy_param3',), 1)),
                 'call_count': 4
             }
         }
 
     def test_convert_node_without_params(self):
         nodes = {
-            'dummy_hash1': {
+            1: {
                 'name': 'dummy_name1',
                 'source': 'dummy_source1',
                 'call_count': 0
@@ -34,7 +49,7 @@ class TestConvertNodes(TestCase):
         }
         expected = [{
             'data': {
-                'id': 'dummy_hash1',
+                'id': 'n1',
                 'name': 'dummy_name1',
                 'source': 'dummy_source1',
                 'count': 0,
@@ -46,7 +61,7 @@ class TestConvertNodes(TestCase):
 
     def test_convert_node_with_params(self):
         nodes = {
-            'dummy_hash3': {
+            3: {
                 'name': 'dummy_name3',
                 'source': 'dummy_source1',
                 'call_count': 2
@@ -57,7 +72,7 @@ class TestConvertNodes(TestCase):
         expected_info += 'dummy_param2\n' + 'dummy_param3'
         expected = [{
             'data': {
-                'id': 'dummy_hash3',
+                'id': 'n3',
                 'name': 'dummy_name3',
                 'source': 'dummy_source1',
                 'count': 2,
@@ -67,22 +82,46 @@ class TestConvertNodes(TestCase):
         result = convert_nodes_to_cytoscape_format(nodes, self._edges())
         self.assertEqual(result, expected)
 
+    def test_convert_node_with_given_node_params(self):
+        nodes = {
+            3: {
+                'name': 'dummy_name3',
+                'source': 'dummy_source1',
+                'call_count': 2
+            }
+        }
+        node_params = {3: _params((('dummy_param',), 2))}
+        expected_info = 'dummy_name3\n' + 'Source: dummy_source1\n' + 'Called 2 times\n'
+        expected_info += 'With parameters:\n' + 'dummy_param (2 times)'
+        result = convert_nodes_to_cytoscape_format(nodes, {}, node_params)
+        self.assertEqual(result[0]['data']['info'], expected_info)
+
+    def test_params_of_node_keep_capacity_of_edges(self):
+        nodes = {3: {'name': 'dummy_name3', 'source': 'dummy_source1', 'call_count': 3}}
+        edges = {}
+        for caller in (1, 2, 4):
+            params = ParamCounter(capacity=1)
+            params.add(('dummy_param{}'.format(caller),))
+            edges[(caller, 3)] = {'params': params, 'call_count': 1}
+        result = convert_nodes_to_cytoscape_format(nodes, edges)
+        self.assertTrue(result[0]['data']['info'].endswith('Other parameters (2 times)'))
+
 
 
 class TestConvertEdges(TestCase):
     def _nodes(self):
         return {
-            'dummy_hash1': {
+            1: {
                 'name': 'dummy_name1',
                 'source': 'dummy_source1',
                 'call_count': 0
             },
-            'dummy_hash2': {
+            2: {
                 'name': 'dummy_name2',
                 'source': 'dummy_source2',
                 'call_count': 1
             },
-            'dummy_hash3': {
+            3: {
                 'name': 'dummy_name3',
                 'source': 'dummy_source1',
                 'call_count': 2
@@ -90,8 +129,8 @@ class TestConvertEdges(TestCase):
         }
     def test_convert_edge_without_params(self):
         edges = {
-            ('dummy_hash1', 'dummy_hash2'): {
-                'params': [],
+            (1, 2): {
+                'params': _params(),
                 'call_count': 0
             }
         }
@@ -102,8 +141,9 @@ class TestConvertEdges(TestCase):
                     'caller_name': 'dummy_name1',
                     'info': 'Call made 0 times',
                     'params': '',
-                    'source': 'dummy_hash1',
-                    'target': 'dummy_hash2'
+                    'id': 'e1-2',
+                    'source': 'n1',
+                    'target': 'n2'
             }
         }]
         result = convert_edges_to_cytoscape_format(self._nodes(), edges)
@@ -111,8 +151,8 @@ class TestConvertEdges(TestCase):
 
     def test_convert_edge_with_single_param(self):
         edges = {
-            ('dummy_hash1', 'dummy_hash3'): {
-                'params': [['dummy_param']],
+            (1, 3): {
+                'params': _params((('dummy_param',), 1)),
                 'call_count': 3
             }
         }
@@ -123,8 +163,9 @@ class TestConvertEdges(TestCase):
                 'caller_name': 'dummy_name1',
                 'info': 'Call made 3 times\nWith parameters:\ndummy_param',
                 'params': 'dummy_param',
-                'source': 'dummy_hash1',
-                'target': 'dummy_hash3'
+                'id': 'e1-3',
+                'source': 'n1',
+                'target': 'n3'
             }
         }]
         result = convert_edges_to_cytoscape_format(self._nodes(), edges)
@@ -132,8 +173,8 @@ class TestConvertEdges(TestCase):
 
     def test_convert_edge_with_multiple_params(self):
         edges = {
-            ('dummy_hash2', 'dummy_hash3'): {
-                'params': [['dummy_param1'], ['dummy_param2'], ['dummy_param3']],
+            (2, 3): {
+                'params': _params((('dummy_param1',), 1), (('dummy_param2',), 1), (('dummy_param3',), 1)),
                 'call_count': 4
             }
         }
@@ -146,13 +187,203 @@ class TestConvertEdges(TestCase):
                 'caller_name': 'dummy_name2',
                 'info': expected_info,
                 'params': '...',
-                'source': 'dummy_hash2',
-                'target': 'dummy_hash3'
+                'id': 'e2-3',
+                'source': 'n2',
+                'target': 'n3'
             }
         }]
         result = convert_edges_to_cytoscape_format(self._nodes(), edges)
         self.assertEqual(result, expected)
 
+    def test_convert_edge_with_repeated_and_evicted_params(self):
+        params = ParamCounter(capacity=2)
+        params.add(('dummy_param1', 'dummy_param2'), 3)
+        params.add(('dummy_param3',))
+        params.add(('dummy_param4',))
+        edges = {(1, 2): {'params': params, 'call_count': 5}}
+        expected_info = 'Call made 5 times\n' + 'With parameters:\n'
+        expected_info += 'dummy_param1, dummy_param2 (3 times)\n' + 'dummy_param4\n'
+        expected_info += 'Other parameters (1 times)'
+
+        result = convert_edges_to_cytoscape_format(self._nodes(), edges)
+
+        self.assertEqual(result[0]['data']['info'], expected_info)
+        self.assertEqual(result[0]['data']['params'], '...')
+
+
+class TestElementIds(TestCase):
+    def test_node_element_id_is_derived_from_node_id(self):
+        self.assertEqual(node_element_id(12), 'n12')
+
+    def test_edge_element_id_is_derived_from_node_ids(self):
+        self.assertEqual(edge_element_id((3, 7)), 'e3-7')
+
+    def test_parse_element_id_returns_node_id_or_edge(self):
+        self.assertEqual(parse_element_id(node_element_id(12)), 12)
+        self.assertEqual(parse_element_id(edge_element_id((3, 7))), (3, 7))
+
+
+class TestCytoscapeCache(TestCase):
+    def _call_graph(self):
+        call_graph = CallGraph()
+        call_graph.load_nodes({
+            1: {'name': 'dummy_name1', 'source': 'dummy_source1', 'call_count': 0},
+            2: {'name': 'dummy_name2', 'source': 'dummy_source2', 'call_count': 1}
+        })
+        call_graph.load_edges({(1, 2): {'param': ['dummy_param'], 'call_count': 1}})
+        return call_graph
+
+    def test_elements_match_full_conversion_without_info(self):
+        call_graph = self._call_graph()
+        cache = CytoscapeCache()
+        self.assertTrue(cache.update(call_graph))
+        nodes = call_graph.get_nodes()
+        edges = call_graph.get_edges()
+        expected = convert_nodes_to_cytoscape_format(nodes, edges) + convert_edges_to_cytoscape_format(nodes, edges)
+        for element in expected:
+            del element['data']['info']
+        self.assertEqual(cache.elements(), expected)
+
+    def test_info_is_built_for_expanded_elements(self):
+        call_graph = self._call_graph()
+        cache = CytoscapeCache()
+        cache.update(call_graph)
+        call_graph.element_clicked('n2')
+        call_graph.mark_changed(nodes=[2])
+        call_graph.element_clicked('e1-2')
+        call_graph.mark_changed(edges=[(1, 2)])
+        cache.update(call_graph)
+
+        elements = cache.elements()
+        self.assertNotIn('info', elements[0]['data'])
+        self.assertEqual(elements[1]['data']['info'],
+                         'dummy_name2\nSource: dummy_source2\nCalled 1 times\nWith parameters:\ndummy_param')
+        self.assertEqual(elements[2]['data']['info'], 'Call made 1 times\nWith parameters:\ndummy_param')
+
+    def test_info_is_dropped_for_collapsed_elements(self):
+        call_graph = self._call_graph()
+        cache = CytoscapeCache()
+        call_graph.element_clicked('n2')
+        cache.update(call_graph)
+        call_graph.element_clicked('n2')
+        call_graph.mark_changed(nodes=[2])
+        cache.update(call_graph)
+        self.assertNotIn('info', cache.elements()[1]['data'])
+
+    def test_update_returns_false_when_graph_did_not_change(self):
+        call_graph = self._call_graph()
+        cache = CytoscapeCache()
+        cache.update(call_graph)
+        self.assertFalse(cache.update(call_graph))
+
+    def test_only_changed_elements_are_converted_again(self):
+        call_graph = self._call_graph()
+        cache = CytoscapeCache()
+        cache.update(call_graph)
+        unchanged_node = cache.elements()[0]
+        call_graph.load_nodes({2: {'name': 'dummy_name2', 'source': 'dummy_source2', 'call_count': 4}})
+
+        self.assertTrue(cache.update(call_graph))
+        elements = cache.elements()
+        self.assertIs(elements[0], unchanged_node)
+        self.assertEqual(elements[1]['data']['count'], 5)
+
+    def test_cleared_graph_removes_elements(self):
+        call_graph = self._call_graph()
+        cache = CytoscapeCache()
+        cache.update(call_graph)
+        call_graph.clear()
+        self.assertTrue(cache.update(call_graph))
+        self.assertEqual(cache.elements(), [])
+
+    def test_delta_for_new_browser_resets_elements(self):
+        call_graph = self._call_graph()
+        cache = CytoscapeCache()
+        cache.update(call_graph)
+        delta = cache.delta(None)
+        self.assertTrue(delta['reset'])
+        self.assertEqual(delta['version'], call_graph.version())
+        self.assertEqual(delta['upsert'], cache.elements())
+
+    def test_delta_is_none_for_up_to_date_browser(self):
+        call_graph = self._call_graph()
+        cache = CytoscapeCache()
+        cache.update(call_graph)
+        self.assertIsNone(cache.delta(call_graph.version()))
+
+    def test_delta_contains_only_changed_elements(self):
+        call_graph = self._call_graph()
+        cache = CytoscapeCache()
+        cache.update(call_graph)
+        client_version = call_graph.version()
+        call_graph.load_nodes({3: {'name': 'dummy_name3', 'source': 'dummy_source3', 'call_count': 1}})
+        cache.update(call_graph)
+        call_graph.load_edges({(2, 3): {'param': [], 'call_count': 1}})
+        cache.update(call_graph)
+
+        delta = cache.delta(client_version)
+        self.assertFalse(delta['reset'])
+        self.assertEqual(delta['version'], call_graph.version())
+        self.assertEqual([element['data']['id'] for element in delta['upsert']], ['n3', 'e2-3'])
+
+    def test_delta_resets_browser_older_than_clear(self):
+        call_graph = self._call_graph()
+        cache = CytoscapeCache()
+        cache.update(call_graph)
+        client_version = call_graph.version()
+        call_graph.clear()
+        cache.update(call_graph)
+        self.assertEqual(cache.delta(client_version), {'version': call_graph.version(), 'reset': True, 'upsert': []})
+
+    @mock.patch('tracerface.web_ui.ui_format._CHANGELOG_SIZE', 1)
+    def test_delta_resets_browser_older_than_changelog(self):
+        call_graph = self._call_graph()
+        cache = CytoscapeCache()
+        cache.update(call_graph)
+        client_version = call_graph.version()
+        for _ in range(2):
+            call_graph.load_nodes({1: {'name': 'dummy_name1', 'source': 'dummy_source1', 'call_count': 1}})
+            cache.update(call_graph)
+        self.assertTrue(cache.delta(client_version)['reset'])
+
+
+    def test_concurrent_readers_get_consistent_deltas(self):
+        call_graph = self._call_graph()
+        cache = CytoscapeCache()
+        done = Event()
+        errors = []
+
+        def write():
+            for count in range(1, 3001):
+                call_graph.load_nodes({1: {'name': 'dummy_name1', 'source': 'dummy_source1', 'call_count': count}})
+                call_graph.mark_changed(nodes=[2], edges=[(1, 2)])
+            done.set()
+
+        def read():
+            try:
+                while not done.is_set():
+                    with cache.lock():
+                        cache.update(call_graph)
+                        version = cache.delta(None)['version']
+                        delta = cache.delta(version - 1)
+                    self.assertEqual(delta['version'], version)
+                    # versions never move backwards, so older deltas are never empty
+                    self.assertTrue(delta['reset'] or delta['upsert'])
+            except Exception as e:
+                errors.append(e)
+                done.set()
+
+        readers = [Thread(target=read) for _ in range(4)]
+        for thread in readers:
+            thread.start()
+        write()
+        for thread in readers:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        cache.update(call_graph)
+        self.assertEqual(cache.delta(None)['version'], call_graph.version())
+
 
 if __name__ == '__main__':
     main()
@@ -1,57 +1,207 @@
 #!/usr/bin/env python3
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+from collections.abc import Mapping
+from threading import RLock
+
+from tracerface.param_counter import DEFAULT_CAPACITY, ParamCounter
+
+
+# Aggregated changes of many call-stacks to be merged into a call graph at once.
+# Call counts are keyed by node ids and (caller, called) edges, parameters
+# are counted per distinct tuple for every edge and the names and sources
+# of nodes are looked up in the symbol table
+GraphBatch = namedtuple('GraphBatch', 'symbols node_counts edge_counts edge_params')
+
+# Consistent copy of the part of a call graph changed since the last drain.
+# Nodes hold copies of the changed nodes and of the ends of changed edges,
+# edges and node params hold copies of the changed ones only
+GraphChanges = namedtuple('GraphChanges', 'version cleared dirty_nodes dirty_edges nodes edges node_params expanded')
+
 
 # Representation of the call graph
-# generated through the tracing
+# generated through the tracing.
+# Parameters of edges are counted per distinct tuple,
+# keeping at most param_capacity distinct tuples per edge.
+# The version grows with every change, and the ids of nodes and
+# edges changed since they were last drained are kept, so views
+# of the graph can be updated without rebuilding all of it.
+# The graph is changed by the tracing threads while the web server reads
+# it from others, so every change is made under the lock of the graph.
+# Readers copy what they need under the lock and format it outside of it,
+# so the merging of call-stacks waits only for the copying
 class CallGraph:
-    def __init__(self):
-        self._nodes = {}
-        self._edges = {}
-        self._yellow = 0
-        self._red = 0
-        self._expanded_elements = []
-
-    # Merge collection of new nodes to already existing ones
-    def load_nodes(self, nodes):
-        for node in nodes:
-            if node in self._nodes:
-                self._nodes[node]['call_count'] += nodes[node]['call_count']
-            else:
-                self._nodes[node] = nodes[node]
-
-    # Merge collection of new edges to already existing ones
-    def load_edges(self, edges):
-        for edge in edges:
-            if edge in self._edges:
-                self._edges[edge]['call_count'] += edges[edge]['call_count']
-                if edges[edge]['param']:
-                    self._edges[edge]['params'].append(edges[edge]['param'])
-            else:
-                self._edges[edge] = {}
-                self._edges[edge]['params'] = []
-                self._edges[edge]['call_count'] = edges[edge]['call_count']
-                if edges[edge]['param']:
-                    self._edges[edge]['params'].append(edges[edge]['param'])
+    def __init__(self, param_capacity=DEFAULT_CAPACITY):
+        self._param_capacity = param_capacity
+        self._version = 0
+        self._lock = RLock()
+        self.clear()
+
+    # Returns the lock of the graph, held to make multiple changes at once
+    def lock(self):
+        return self._lock
+
+    # Add call count to a node, creating it if it is new
+    def _merge_node(self, node_id, name, source, call_count):
+        node = self._nodes.get(node_id)
+        if node is None:
+            node = self._nodes[node_id] = {'name': name, 'source': source, 'call_count': call_count}
+        else:
+            node['call_count'] += call_count
+        if node['call_count'] > self._max_count:
+            self._max_count = node['call_count']
+        self._dirty_nodes.add(node_id)
+
+    # Add call count to an edge, creating it if it is new,
+    # and record parameters given as (parameters, occurrences) pairs
+    def _merge_edge(self, edge, call_count, params):
+        stored = self._edges.get(edge)
+        if stored is None:
+            stored = self._edges[edge] = {'params': ParamCounter(self._param_capacity), 'call_count': 0}
+        stored['call_count'] += call_count
+        self._dirty_edges.add(edge)
+        for param, count in params:
+            self._add_edge_param(stored['params'], tuple(param), count)
+            self._index_params(edge[1], tuple(param), count)
+
+    # Count parameters of a call in the counter of its edge,
+    # keeping the parameter stats of all edges up to date
+    def _add_edge_param(self, counter, param, count):
+        distinct, evictions, other = len(counter), counter.evictions(), counter.other_count()
+        counter.add(param, count)
+        stats = self._param_stats
+        stats['distinct'] += len(counter) - distinct
+        stats['evictions'] += counter.evictions() - evictions
+        stats['other'] += counter.other_count() - other
+
+    # Count parameters of a call among all parameters the called node got
+    def _index_params(self, called, param, count):
+        params = self._node_params.get(called)
+        if params is None:
+            params = self._node_params[called] = ParamCounter(self._param_capacity)
+        params.add(param, count)
+        self._dirty_nodes.add(called)
+
+    # Merge collection of new nodes to already existing ones,
+    # the multiplier is the number of times the collection occurred
+    def load_nodes(self, nodes, multiplier=1):
+        with self._lock:
+            for node in nodes:
+                self._merge_node(node, nodes[node]['name'], nodes[node]['source'],
+                                 nodes[node]['call_count'] * multiplier)
+            self._version += 1
+
+    # Merge collection of new edges to already existing ones,
+    # the multiplier is the number of times the collection occurred
+    def load_edges(self, edges, multiplier=1):
+        with self._lock:
+            for edge in edges:
+                params = [(edges[edge]['param'], multiplier)] if edges[edge]['param'] else []
+                self._merge_edge(edge, edges[edge]['call_count'] * multiplier, params)
+            self._version += 1
 
-    # Return list of all nodes
+    # Merge a batch of aggregated call-stacks
+    def merge_batch(self, batch):
+        with self._lock:
+            for node_id, call_count in batch.node_counts.items():
+                name, source = batch.symbols.symbol(node_id)
+                self._merge_node(node_id, name, source, call_count)
+            for edge, call_count in batch.edge_counts.items():
+                self._merge_edge(edge, call_count, batch.edge_params.get(edge, {}).items())
+            self._version += 1
+
+    # Return list of all nodes, it is only safe
+    # to iterate while the lock of the graph is held
     def get_nodes(self):
         return self._nodes
 
-    # Return list of all edges
+    # Return list of all edges, it is only safe
+    # to iterate while the lock of the graph is held
     def get_edges(self):
         return self._edges
 
+    # Return parameters of calls made to each node, nodes
+    # which were never called with parameters are left out
+    def get_node_params(self):
+        return self._node_params
+
+    # Returns the version of the graph, which changes whenever the graph does
+    def version(self):
+        return self._version
+
+    # Returns whether the graph was cleared and the ids of nodes and edges
+    # changed since the last call, then starts collecting them anew
+    def drain_dirty(self):
+        with self._lock:
+            dirty = (self._cleared, self._dirty_nodes, self._dirty_edges)
+            self._cleared = False
+            self._dirty_nodes = set()
+            self._dirty_edges = set()
+            return dirty
+
+    # Returns a consistent copy of the nodes and edges changed since
+    # the last call, then starts collecting the changes anew
+    def drain_changes(self):
+        with self._lock:
+            version = self._version
+            cleared, dirty_nodes, dirty_edges = self.drain_dirty()
+            nodes = self.get_nodes()
+            edges = self.get_edges()
+            node_ids = set(dirty_nodes)
+            for edge in dirty_edges:
+                node_ids.update(edge)
+            return GraphChanges(
+                version=version,
+                cleared=cleared,
+                dirty_nodes=dirty_nodes,
+                dirty_edges=dirty_edges,
+                nodes={node_id: dict(nodes[node_id]) for node_id in node_ids},
+                edges={edge: _copy_edge(edges[edge]) for edge in dirty_edges},
+                node_params={node_id: self._node_params[node_id].copy()
+                             for node_id in dirty_nodes if node_id in self._node_params},
+                expanded=set(self._expanded_elements)
+            )
+
+    # Mark nodes and edges as changed when only the way they are shown changes,
+    # ones which are not in the graph, like those of a stale browser, are ignored
+    def mark_changed(self, nodes=(), edges=()):
+        with self._lock:
+            graph_nodes = self.get_nodes()
+            graph_edges = self.get_edges()
+            self._dirty_nodes.update(node_id for node_id in nodes if node_id in graph_nodes)
+            self._dirty_edges.update(edge for edge in edges if edge in graph_edges)
+            self._version += 1
+
+    # Returns how much parameter data the edges hold
+    def param_stats(self):
+        with self._lock:
+            return dict(self._param_stats)
+
     # Clear nodes and edges from graph
     def clear(self):
-        self._nodes = {}
-        self._edges = {}
-        self._yellow = 0
-        self._red = 0
-        self._expanded_elements = []
+        with self._lock:
+            self._nodes = {}
+            self._edges = {}
+            self._max_count = 0 # call counts only grow, so it is kept up to date on merges
+            # Kept up to date on merges, so parameters of a
+            # node do not have to be searched among all edges
+            self._node_params = {}
+            # Totals of the parameter counters of all edges
+            self._param_stats = {'distinct': 0, 'evictions': 0, 'other': 0}
+            self._yellow = 0
+            self._red = 0
+            self._expanded_elements = []
+            self._cleared = True
+            self._dirty_nodes = set()
+            self._dirty_edges = set()
+            self._version += 1
 
     # Set bounds for yellow and red coloring
     def set_colors(self, yellow, red):
-        self._yellow = yellow
-        self._red = red
+        with self._lock:
+            self._yellow = yellow
+            self._red = red
 
     # Return lower bound of call count to color with yellow
     def get_yellow(self):
@@ -63,25 +213,201 @@ class CallGraph:
 
     # Returns the maximum number of calls among nodes
     def max_count(self):
-        call_counts = [node['call_count'] for node in self._nodes.values()]
-        if call_counts:
-            return max(call_counts)
-        return 0
+        return self._max_count
+
+    # Returns the yellow and red bounds with the maximum count they belong to
+    def get_color_state(self):
+        with self._lock:
+            return self._yellow, self._red, self._max_count
 
     # Initialize color boundaries to default values based on maximum count
     def init_colors(self):
-        max_count = self.max_count()
-        new_yellow = round(max_count / 3)
-        new_red = new_yellow * 2
-        self.set_colors(new_yellow, new_red)
+        with self._lock:
+            max_count = self.max_count()
+            new_yellow = round(max_count / 3)
+            new_red = new_yellow * 2
+            self.set_colors(new_yellow, new_red)
 
     # Add to or remove element from expanded ones when the user clicks on them
     def element_clicked(self, id):
-        if id in self._expanded_elements:
-            self._expanded_elements.remove(id)
-        else:
-            self._expanded_elements.append(id)
+        with self._lock:
+            if id in self._expanded_elements:
+                self._expanded_elements.remove(id)
+            else:
+                self._expanded_elements.append(id)
 
-    # Returns all currently expanded elemenets
+    # Returns a copy of all currently expanded elemenets
     def get_expanded_elements(self):
-        return self._expanded_elements
+        with self._lock:
+            return list(self._expanded_elements)
+
+
+# Returns a copy of an edge which does not change with the graph
+def _copy_edge(edge):
+    return {'params': edge['params'].copy(), 'call_count': edge['call_count']}
+
+
+# Edges are keyed by their two node ids packed into a single integer
+_NODE_ID_BITS = 32
+_NODE_ID_MASK = (1 << _NODE_ID_BITS) - 1
+
+# Minimum number of new edges kept in a hash index before they are
+# compacted into the sorted arrays holding the rest of the edges
+_EDGE_COMPACT_SIZE = 65536
+
+
+# Read-only mapping of the nodes of an array backed call graph
+class _NodesView(Mapping):
+    def __init__(self, graph):
+        self._graph = graph
+
+    def __getitem__(self, node_id):
+        symbol = None
+        if isinstance(node_id, int) and 0 <= node_id < len(self._graph._node_symbols):
+            symbol = self._graph._node_symbols[node_id]
+        if symbol is None:
+            raise KeyError(node_id)
+        name, source = symbol
+        return {'name': name, 'source': source, 'call_count': self._graph._node_counts[node_id]}
+
+    def __iter__(self):
+        return (node_id for node_id, symbol in enumerate(self._graph._node_symbols) if symbol)
+
+    def __len__(self):
+        return self._graph._node_total
+
+
+# Read-only mapping of the edges of an array backed call graph
+class _EdgesView(Mapping):
+    def __init__(self, graph):
+        self._graph = graph
+
+    def __getitem__(self, edge):
+        slot = self._graph._edge_slot(_pack_edge(edge))
+        if slot is None:
+            raise KeyError(edge)
+        params = self._graph._edge_params.get(slot)
+        if params is None:
+            params = ParamCounter(self._graph._param_capacity)
+        return {'params': params, 'call_count': self._graph._edge_counts[slot]}
+
+    def __iter__(self):
+        return (_unpack_edge(key) for key in self._graph._edge_keys_by_slot)
+
+    def __len__(self):
+        return len(self._graph._edge_counts)
+
+
+def _pack_edge(edge):
+    return edge[0] << _NODE_ID_BITS | edge[1]
+
+
+def _unpack_edge(key):
+    return (key >> _NODE_ID_BITS, key & _NODE_ID_MASK)
+
+
+# Call graph storing call counts in arrays instead of dicts of dicts,
+# which is much more compact for graphs with millions of edges.
+# Node ids have to be non-negative integers, like the interned ids.
+# Node call counts are indexed directly by node id, every edge gets
+# a slot which indexes its call count. Edges are found by a binary
+# search in a sorted array of their keys, new edges are kept in a
+# hash index until there are enough of them to compact the two.
+# get_nodes and get_edges return read-only views of the same format
+# as the dict backed call graph has
+class ArrayCallGraph(CallGraph):
+    def clear(self):
+        with self._lock:
+            super().clear()
+            self._node_symbols = [] # (name, source) pairs indexed by node id, None if not present
+            self._node_counts = array('q')
+            self._node_total = 0
+            self._edge_keys_by_slot = array('q')
+            self._edge_counts = array('q')
+            self._edge_params = {} # only edges with parameters have an entry
+            self._sorted_edge_keys = array('q')
+            self._sorted_edge_slots = array('q')
+            self._recent_edge_slots = {}
+
+    # Make node arrays large enough to hold the given node id
+    def _reserve_nodes(self, node_id):
+        missing = node_id + 1 - len(self._node_symbols)
+        if missing > 0:
+            self._node_symbols.extend([None] * missing)
+            self._node_counts.frombytes(bytes(missing * self._node_counts.itemsize))
+
+    def _merge_node(self, node_id, name, source, call_count):
+        self._reserve_nodes(node_id)
+        if self._node_symbols[node_id] is None:
+            self._node_symbols[node_id] = (name, source)
+            self._node_total += 1
+        self._node_counts[node_id] += call_count
+        if self._node_counts[node_id] > self._max_count:
+            self._max_count = self._node_counts[node_id]
+        self._dirty_nodes.add(node_id)
+
+    # Return the slot of an edge by its key or None if it is not present
+    def _edge_slot(self, key):
+        slot = self._recent_edge_slots.get(key)
+        if slot is not None:
+            return slot
+        index = bisect_left(self._sorted_edge_keys, key)
+        if index < len(self._sorted_edge_keys) and self._sorted_edge_keys[index] == key:
+            return self._sorted_edge_slots[index]
+        return None
+
+    # Allocate a slot for a new edge
+    def _add_edge_slot(self, key):
+        slot = len(self._edge_counts)
+        self._edge_keys_by_slot.append(key)
+        self._edge_counts.append(0)
+        self._recent_edge_slots[key] = slot
+        if len(self._recent_edge_slots) >= max(_EDGE_COMPACT_SIZE, len(self._sorted_edge_keys) // 4):
+            self._compact_edges()
+        return slot
+
+    # Move every edge into the sorted arrays
+    def _compact_edges(self):
+        slots = sorted(range(len(self._edge_keys_by_slot)), key=self._edge_keys_by_slot.__getitem__)
+        self._sorted_edge_keys = array('q', (self._edge_keys_by_slot[slot] for slot in slots))
+        self._sorted_edge_slots = array('q', slots)
+        self._recent_edge_slots = {}
+
+    def _merge_edge(self, edge, call_count, params):
+        key = _pack_edge(edge)
+        slot = self._edge_slot(key)
+        if slot is None:
+            slot = self._add_edge_slot(key)
+        self._edge_counts[slot] += call_count
+        self._dirty_edges.add(edge)
+        for param, count in params:
+            if slot not in self._edge_params:
+                self._edge_params[slot] = ParamCounter(self._param_capacity)
+            self._add_edge_param(self._edge_params[slot], tuple(param), count)
+            self._index_params(edge[1], tuple(param), count)
+
+    # Merge a batch of aggregated call-stacks,
+    # the node arrays are grown only once for the whole batch
+    def merge_batch(self, batch):
+        with self._lock:
+            if batch.node_counts:
+                self._reserve_nodes(max(batch.node_counts))
+            symbols = self._node_symbols
+            counts = self._node_counts
+            for node_id, call_count in batch.node_counts.items():
+                if symbols[node_id] is None:
+                    symbols[node_id] = batch.symbols.symbol(node_id)
+                    self._node_total += 1
+                counts[node_id] += call_count
+                if counts[node_id] > self._max_count:
+                    self._max_count = counts[node_id]
+            self._dirty_nodes.update(batch.node_counts)
+            for edge, call_count in batch.edge_counts.items():
+                self._merge_edge(edge, call_count, batch.edge_params.get(edge, {}).items())
+            self._version += 1
+
+    def get_nodes(self):
+        return _NodesView(self)
+
+    def get_edges(self):
+        return _EdgesView(self)
@@ -6,6 +6,7 @@ from dash.dependencies import Input, Output, State
 from dash.exceptions import PreventUpdate
 
 from  tracerface.web_ui.alerts import (
+    ApproximateGraphAlert,
     ErrorAlert,
     SuccessAlert,
     TraceErrorAlert,
@@ -68,6 +69,25 @@ def stop_trace_on_error(app, trace_controller):
         raise PreventUpdate
 
 
+# Warn that the graph of the trace is approximate while call-stacks are
+# dropped or sampled, only updated when the counts shown by the browser change
+def show_approximate_graph(app, trace_controller):
+    output = [
+        Output('trace-approximate-notification', 'children'),
+        Output('approximate-counts-shown', 'data')
+    ]
+    input = [Input('timer', 'n_intervals')]
+    state = [State('approximate-counts-shown', 'data')]
+    @app.callback(output, input, state)
+    def show(timer_tick, shown):
+        counts = [trace_controller.dropped_stacks(), trace_controller.sampled_stacks()]
+        if counts == shown:
+            raise PreventUpdate
+        if not trace_controller.approximate():
+            return None, counts
+        return ApproximateGraphAlert(*counts), counts
+
+
 # Start realtime tracing
 def start_or_stop_trace(app, call_graph, setup, trace_controller):
     output = Output('timer', 'disabled')
@@ -76,7 +96,6 @@ def start_or_stop_trace(app, call_graph, setup, trace_controller):
     @app.callback(output, input, state)
     def switch_state(trace_on, timer_disabled):
         if trace_on:
-            call_graph.clear()
             trace_controller.start_trace(setup.generate_bcc_args(), call_graph)
         elif not timer_disabled:
             trace_controller.stop_trace()
@@ -95,9 +114,23 @@ def update_color_slider(app, call_graph):
         if not callback_context.triggered:
             raise PreventUpdate
 
-        disabled = call_graph.max_count() < 1 or not timer_off
-        return Dashboard.slider(call_graph.get_yellow(), call_graph.get_red(),
-                                call_graph.max_count(), disabled)
+        yellow, red, max_count = call_graph.get_color_state()
+        disabled = max_count < 1 or not timer_off
+        return Dashboard.slider(yellow, red, max_count, disabled)
+
+
+# Show how much parameter data the edges of the graph hold and how much
+# of it was evicted because edges reached their parameter capacity
+def show_param_stats(app, call_graph):
+    output = Output('param-stats', 'children')
+    input = [Input('graph', 'elements')]
+    @app.callback(output, input)
+    def update(elements):
+        stats = call_graph.param_stats()
+        if not stats['distinct']:
+            return None
+        return 'Parameters kept: {} distinct, {} evicted, {} calls with other parameters'.format(
+            stats['distinct'], stats['evictions'], stats['other'])
 
 
 # Disable parts of the interface while tracing is active
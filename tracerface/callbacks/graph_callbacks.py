@@ -3,78 +3,120 @@ This module contains all callbacks regarding
 the shown graph including the information cards
 '''
 from dash import callback_context
-from dash.dependencies import Input, Output, State
+from dash.dependencies import ClientsideFunction, Input, Output, State
 from dash.exceptions import PreventUpdate
 
-from tracerface.load_output import load_trace_output_from_file_to_call_graph
+from tracerface.load_output import (
+    CORRUPT_COMPRESSION_ERRORS,
+    load_trace_output_from_file_to_call_graph,
+    UnsupportedCompressionError
+)
 from tracerface.web_ui.alerts import ErrorAlert
 from tracerface.web_ui.graph import Graph
 from tracerface.web_ui.styles import expanded_style
-from tracerface.web_ui.ui_format import (
-    convert_edges_to_cytoscape_format,
-    convert_nodes_to_cytoscape_format
-)
+from tracerface.web_ui.ui_format import CytoscapeCache, parse_element_id
 
 
-# Update nodes and edges in graph
-def update_graph_elements(app, call_graph):
+# Send the changes of nodes and edges the graph in the browser does not show
+# yet, after loading an output file or expanding or collapsing a clicked element
+def update_graph_elements(app, call_graph, load_workers=1, graph_cache=None):
     output = [
-        Output('graph', 'elements'),
+        Output('graph-delta', 'data'),
         Output('load-output-notification', 'children')
     ]
     input = [
         Input('load-output-button', 'n_clicks'),
-        Input('timer', 'n_intervals')
+        Input('timer', 'n_intervals'),
+        Input('graph', 'tapNodeData'),
+        Input('graph', 'tapEdgeData')
+    ]
+    state = [
+        State('output-path', 'value'),
+        State('graph-client-version', 'data')
     ]
-    state = [State('output-path', 'value')]
+    elements = CytoscapeCache()
     @app.callback(output, input, state)
-    def update_elements(load, timer, file_path):
+    def update_elements(load, timer, node, edge, file_path, client_version):
         if not callback_context.triggered:
             raise PreventUpdate
 
         alert = None
-        id = callback_context.triggered[0]['prop_id'].split('.')[0]
-        if id == 'load-output-button' and file_path:
+        input = callback_context.triggered[0]['prop_id'].split('.')
+        id = input[0]
+        tapped = None
+        if id == 'graph' and input[1] == 'tapNodeData':
+            tapped = node
+        if id == 'graph' and input[1] == 'tapEdgeData':
+            tapped = edge
+        if tapped:
+            # The info text of the element is built or dropped on the next update
+            key = parse_element_id(tapped['id'])
+            with call_graph.lock():
+                # Elements of a graph shown before a reload are not in the graph anymore
+                if isinstance(key, tuple) and key in call_graph.get_edges():
+                    call_graph.element_clicked(tapped['id'])
+                    call_graph.mark_changed(edges=[key])
+                elif not isinstance(key, tuple) and key in call_graph.get_nodes():
+                    call_graph.element_clicked(tapped['id'])
+                    call_graph.mark_changed(nodes=[key])
+        elif id == 'load-output-button' and file_path:
             try:
-                load_trace_output_from_file_to_call_graph(file_path, call_graph)
+                load_trace_output_from_file_to_call_graph(file_path, call_graph, load_workers, graph_cache)
             except FileNotFoundError:
                 alert = ErrorAlert('Could not find output file at {}'.format(file_path))
             except IsADirectoryError:
                 alert = ErrorAlert('{} is a directory, not a file'.format(file_path))
+            except UnsupportedCompressionError as e:
+                alert = ErrorAlert(str(e))
+            except EOFError:
+                alert = ErrorAlert('Compressed file at {} is truncated'.format(file_path))
+            except CORRUPT_COMPRESSION_ERRORS as e:
+                alert = ErrorAlert('Could not read output file at {}: {}'.format(file_path, e))
         elif id == 'load-output-button' :
             alert = ErrorAlert('No path given')
 
-        edges = convert_edges_to_cytoscape_format(call_graph.get_nodes(), call_graph.get_edges())
-        nodes = convert_nodes_to_cytoscape_format(call_graph.get_nodes(), call_graph.get_edges())
-        return nodes + edges, alert
+        with elements.lock():
+            elements.update(call_graph)
+            delta = elements.delta(client_version)
+        # Nothing to redraw on timer ticks when no call was traced since the last one
+        if delta is None and id == 'timer':
+            raise PreventUpdate
+        return delta, alert
 
 
-# Display or hide inforamtion about edges and nodes
-# Update colors of the graph
+# Apply the changes sent by the server to the elements of the graph
+# in the browser and remember which version of the graph is shown
+def apply_graph_delta(app):
+    output = [
+        Output('graph', 'elements'),
+        Output('graph-client-version', 'data')
+    ]
+    input = [Input('graph-delta', 'data')]
+    state = [State('graph', 'elements')]
+    app.clientside_callback(ClientsideFunction('graph', 'apply_delta'), output, input, state)
+
+
+# Update colors of the graph and highlight expanded elements, their info
+# text is added or removed through their elements before the style changes
 def update_graph_style(app, call_graph):
     output = Output('graph', 'stylesheet')
     input = [
         Input('slider', 'value'),
         Input('searchbar', 'value'),
-        Input('graph', 'elements'),
-        Input('graph', 'tapNodeData'),
-        Input('graph', 'tapEdgeData')
+        Input('graph', 'elements')
     ]
     @app.callback(output, input)
-    def update_style(slider, search, elements, node, edge):
+    def update_style(slider, search, elements):
         if not callback_context.triggered:
             raise PreventUpdate
 
         input = callback_context.triggered[0]['prop_id'].split('.')
         if input[0] == 'slider':
             call_graph.set_colors(slider[0], slider[1])
-        if input[0] == 'graph' and input[1] == 'tapNodeData' and node:
-            call_graph.element_clicked(node['id'])
-        if input[0] == 'graph' and input[1] == 'tapEdgeData' and edge:
-            call_graph.element_clicked(edge['id'])
 
         if not search:
             search = ''
-        base_styles = Graph.stylesheet(search, call_graph.get_yellow(), call_graph.get_red())
+        yellow, red, _ = call_graph.get_color_state()
+        base_styles = Graph.stylesheet(search, yellow, red)
         node_styles = [expanded_style(id) for id in call_graph.get_expanded_elements()]
         return base_styles + node_styles
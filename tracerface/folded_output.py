@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+'''
+Folding of bcc trace output inside the tracing process.
+Instead of every line of output only the call-stacks counted
+in a time window are sent to the parent process, together with
+the functions seen for the first time, so the work left for the
+parent grows with the number of distinct call-stacks, not calls
+'''
+from collections import namedtuple
+import pickle
+from threading import Event, Lock, Thread
+
+from tracerface.line_splitter import LineSplitter
+from tracerface.parse_stack import StackParser
+from tracerface.stack_folder import StackFolder
+from tracerface.symbol_table import SymbolTable
+
+
+# Call-stacks counted in a window of the tracing process.
+# Symbols are the (name, source) pairs of functions seen since
+# the previous delta, continuing the ids of the ones sent before.
+# Stacks are (frames, params, count) tuples using these ids
+FoldedDelta = namedtuple('FoldedDelta', 'symbols stacks')
+
+
+def encode_delta(delta):
+    return pickle.dumps(tuple(delta), protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def decode_delta(data):
+    return FoldedDelta(*pickle.loads(data))
+
+
+# Count the call-stacks of a delta in the folder, translating ids of the
+# tracing process through the given list to ids in the symbol table of the folder
+def fold_delta(delta, node_ids, folder):
+    folder.add_translated(delta.symbols, delta.stacks, node_ids)
+
+
+# Text stream which parses and folds the bcc trace output written into it.
+# The counted call-stacks are encoded into deltas and passed to the send
+# function, which returns False if a delta could not be sent. In that case
+# the call-stacks are dropped, so a reader which fell behind does not make
+# the folder grow without bound, and their number is passed to the drop
+# function. Functions of the delta are sent with the next one instead
+class FoldingWriter:
+    def __init__(self, send, drop=None):
+        self._send = send
+        self._drop = drop
+        self._symbols = SymbolTable()
+        self._parser = StackParser(self._symbols)
+        self._folder = StackFolder(self._symbols)
+        self._sent_symbols = 0
+        self._lines = LineSplitter()
+        self._lock = Lock() # output is written and sent by different threads
+        self._stopped = Event()
+
+    def write(self, s):
+        with self._lock:
+            for line in self._lines.feed(s):
+                folded = self._parser.feed_folded(line.strip(' '))
+                if folded:
+                    self._folder.add(folded)
+
+    def flush(self):
+        pass
+
+    # Send the call-stacks counted since the last delta
+    def send_delta(self):
+        with self._lock:
+            if not self._folder:
+                return
+            stacks = [(folded.frames, folded.params, count) for folded, count in self._folder.stacks().items()]
+            delta = FoldedDelta(symbols=self._symbols.symbols()[self._sent_symbols:], stacks=stacks)
+            if self._send(encode_delta(delta)):
+                self._sent_symbols = len(self._symbols)
+            elif self._drop is not None:
+                self._drop(sum(count for _, _, count in stacks))
+            self._folder = StackFolder(self._symbols)
+
+    # Send a delta every window seconds in a background thread
+    def start_sending(self, window):
+        def send_periodically():
+            while not self._stopped.wait(window):
+                self.send_delta()
+        Thread(target=send_periodically, daemon=True).start()
+
+    # Stop sending in the background and send what is left,
+    # including the last call-stack if the output ended without an empty line
+    def stop_sending(self):
+        self._stopped.set()
+        with self._lock:
+            for line in self._lines.flush():
+                folded = self._parser.feed_folded(line.strip(' '))
+                if folded:
+                    self._folder.add(folded)
+            folded = self._parser.flush_folded()
+            if folded:
+                self._folder.add(folded)
+        self.send_delta()
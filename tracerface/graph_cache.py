@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+'''
+On-disk cache of parsed trace output files.
+The folded call-stacks of a file are stored along with their symbols,
+keyed by a fingerprint of the file, so loading the same file again
+only needs to deserialize them instead of parsing the whole file
+'''
+from hashlib import sha256
+import os
+from pathlib import Path
+import pickle
+
+
+# Bump when the format of the stored entries changes
+_FORMAT_VERSION = 1
+
+# Number of bytes hashed from both the start and the end of a file
+_SAMPLE_SIZE = 64 * 1024
+
+# Default maximum size of the cache directory
+_MAX_SIZE = 1024 * 1024 * 1024
+
+_ENTRY_SUFFIX = '.graph'
+
+
+# Return the default directory to keep cached files in
+def default_cache_directory():
+    cache_home = os.environ.get('XDG_CACHE_HOME') or Path.home().joinpath('.cache')
+    return Path(cache_home).joinpath('tracerface')
+
+
+# Fingerprint of a file made of its path, size, modification time
+# and a hash of its first and last bytes
+def _fingerprint(file_path):
+    path = Path(file_path).resolve()
+    with open(path, 'rb') as stream:
+        stat = os.fstat(stream.fileno())
+        digest = sha256('{}\0{}\0{}\0{}'.format(
+            _FORMAT_VERSION, path, stat.st_size, stat.st_mtime_ns
+        ).encode())
+        digest.update(stream.read(_SAMPLE_SIZE))
+        if stat.st_size > _SAMPLE_SIZE:
+            stream.seek(max(_SAMPLE_SIZE, stat.st_size - _SAMPLE_SIZE))
+            digest.update(stream.read(_SAMPLE_SIZE))
+    return digest.hexdigest()
+
+
+# Remove a file unless it was removed already
+def _remove(path):
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+
+
+# Size-capped cache directory of parsed output files,
+# the least recently used entries are evicted first.
+# The cache is only an optimization, a directory which can not be
+# read or written makes files be parsed as if they were not cached
+class GraphCache:
+    def __init__(self, directory=None, max_size=_MAX_SIZE):
+        self._directory = Path(directory) if directory else default_cache_directory()
+        self._max_size = max_size
+
+    def _entry_path(self, file_path):
+        return self._directory.joinpath(_fingerprint(file_path) + _ENTRY_SUFFIX)
+
+    def _entries(self):
+        try:
+            return list(self._directory.glob('*' + _ENTRY_SUFFIX))
+        except FileNotFoundError:
+            return []
+
+    # Return the symbols and folded call-stacks stored for a file,
+    # or None if the file was not cached or changed since then
+    def get(self, file_path):
+        entry = self._entry_path(file_path)
+        try:
+            with open(entry, 'rb') as stream:
+                version, symbols, stacks = pickle.load(stream)
+        except (EOFError, pickle.UnpicklingError, ValueError, TypeError):
+            _remove(entry)
+            return None
+        except OSError:
+            return None
+        if version != _FORMAT_VERSION:
+            return None
+        # Mark the entry as recently used
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+        return symbols, stacks
+
+    # Store the symbols and folded call-stacks of a file, where the folded
+    # call-stacks are (frames, params, count) tuples. Nothing is stored
+    # if the cache directory can not be written, for example when it is full
+    def put(self, file_path, symbols, stacks):
+        entry = self._entry_path(file_path)
+        temp_entry = entry.with_suffix('.tmp{}'.format(os.getpid()))
+        try:
+            self._directory.mkdir(parents=True, exist_ok=True)
+            with open(temp_entry, 'wb') as stream:
+                pickle.dump((_FORMAT_VERSION, symbols, stacks), stream, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_entry, entry)
+            self._evict()
+        except OSError:
+            try:
+                _remove(temp_entry)
+            except OSError:
+                pass
+
+    # Remove least recently used entries until the cache fits in its size
+    def _evict(self):
+        entries = []
+        for entry in self._entries():
+            try:
+                entries.append((entry.stat(), entry))
+            except FileNotFoundError:
+                pass
+        total_size = sum(stat.st_size for stat, _ in entries)
+        for stat, entry in sorted(entries, key=lambda item: item[0].st_mtime_ns):
+            if total_size <= self._max_size:
+                break
+            _remove(entry)
+            total_size -= stat.st_size
+
+    # Remove the entry of a file, or every entry if no file is given
+    def invalidate(self, file_path=None):
+        if file_path is None:
+            for entry in self._entries():
+                _remove(entry)
+        else:
+            _remove(self._entry_path(file_path))
+
+    # Return the number of bytes the cache takes up on disk
+    def size(self):
+        return sum(entry.stat().st_size for entry in self._entries())
@@ -1,4 +1,5 @@
 #!/usr/bin/env python3
+import atexit
 
 from tracerface.callbacks import (
     app_dialog_callbacks,
@@ -6,14 +7,26 @@ from tracerface.callbacks import (
     func_dialog_callbacks,
     graph_callbacks
 )
-from tracerface.call_graph import CallGraph
-from tracerface.trace_controller import TraceController
+from tracerface.call_graph import ArrayCallGraph, CallGraph
+from tracerface.param_counter import DEFAULT_CAPACITY
+from tracerface.trace_controller import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_BATCH_WINDOW,
+    DEFAULT_WARM_TRACERS,
+    TraceController
+)
+from tracerface.trace_process import DEFAULT_OUTPUT_BUDGET, RING_TRANSPORT
+from tracerface.trace_source import bcc_trace_source
 from tracerface.web_ui.layout import Layout
 from tracerface.web_ui.trace_setup import Setup
 
 
+# Seconds to wait for the trace to stop when the application exits
+_CLOSE_SECONDS = 5
+
+
 # Initialize all callbacks used by the application
-def _setup_callbacks(app, call_graph, setup, trace_controller):
+def _setup_callbacks(app, call_graph, setup, trace_controller, load_workers, graph_cache):
     app_dialog_callbacks.clear_traced_dropdown_menu(app)
     app_dialog_callbacks.clear_not_traced_dropdown_menu(app)
     app_dialog_callbacks.disable_manage_function_buttons(app)
@@ -28,9 +41,11 @@ def _setup_callbacks(app, call_graph, setup, trace_controller):
     dashboard_callbacks.disable_load_button(app)
     dashboard_callbacks.start_or_stop_trace(app, call_graph, setup, trace_controller)
     dashboard_callbacks.stop_trace_on_error(app, trace_controller)
+    dashboard_callbacks.show_approximate_graph(app, trace_controller)
     dashboard_callbacks.clear_selected_app(app)
     dashboard_callbacks.update_apps_dropdown_options(app, setup)
     dashboard_callbacks.update_color_slider(app, call_graph)
+    dashboard_callbacks.show_param_stats(app, call_graph)
     dashboard_callbacks.update_graph_layout(app)
 
     func_dialog_callbacks.open_or_close_dialog(app)
@@ -40,14 +55,25 @@ def _setup_callbacks(app, call_graph, setup, trace_controller):
     func_dialog_callbacks.update_parameters(app, setup)
     func_dialog_callbacks.disable_add_button(app, setup)
 
-    graph_callbacks.update_graph_elements(app, call_graph)
+    graph_callbacks.update_graph_elements(app, call_graph, load_workers, graph_cache)
+    graph_callbacks.apply_graph_delta(app)
     graph_callbacks.update_graph_style(app, call_graph)
 
 # Initialize all resources used by the application
-def initialize(app):
-    call_graph = CallGraph()
-    trace_controller = TraceController()
+def initialize(app, load_workers=1, graph_cache=None, compact_graph=False,
+               param_capacity=DEFAULT_CAPACITY, transport=RING_TRANSPORT, fold_in_tracer=False,
+               trace_shards=1, source_factory=bcc_trace_source, batch_window=DEFAULT_BATCH_WINDOW,
+               batch_size=DEFAULT_BATCH_SIZE, output_budget=DEFAULT_OUTPUT_BUDGET,
+               warm_tracers=DEFAULT_WARM_TRACERS):
+    graph_class = ArrayCallGraph if compact_graph else CallGraph
+    call_graph = graph_class(param_capacity=param_capacity)
+    trace_controller = TraceController(transport=transport, fold_in_tracer=fold_in_tracer, shards=trace_shards,
+                                       source_factory=source_factory, batch_window=batch_window,
+                                       batch_size=batch_size, output_budget=output_budget,
+                                       warm_tracers=warm_tracers)
+    # Tracing processes and their shared memory outlive the server otherwise
+    atexit.register(trace_controller.close, _CLOSE_SECONDS)
     setup = Setup()
     app.layout = Layout()
     app.title = 'Tracerface'
-    _setup_callbacks(app, call_graph, setup, trace_controller)
+    _setup_callbacks(app, call_graph, setup, trace_controller, load_workers, graph_cache)
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+'''
+Reassembly of lines from text passed in chunks of any size.
+Writes to a text stream and records of a transport do not have to
+end with a line, so lines are only handed on once they are complete
+'''
+
+
+# Splits text fed in chunks into lines, a line split
+# between chunks is returned once its end arrives
+class LineSplitter:
+    def __init__(self):
+        self._partial = [] # chunks of the line not ended yet
+
+    # Returns the lines completed by the chunk, without their line breaks
+    def feed(self, chunk):
+        if '\n' not in chunk:
+            if chunk:
+                self._partial.append(chunk)
+            return []
+        lines = chunk.split('\n')
+        if self._partial:
+            self._partial.append(lines[0])
+            lines[0] = ''.join(self._partial)
+        last = lines.pop()
+        self._partial = [last] if last else []
+        return lines
+
+    # Returns the last line if the text did not end with a line break
+    def flush(self):
+        lines = [''.join(self._partial)] if self._partial else []
+        self._partial = []
+        return lines
@@ -1,16 +1,229 @@
 #!/usr/bin/env python3
+'''
+Load the output of a bcc trace run from a file into the call graph.
+The file is streamed in fixed-size chunks, so memory usage depends on
+the number of distinct call-stacks instead of the size of the file.
+Large files can be split at call-stack boundaries and parsed by
+multiple worker processes. Files compressed with gzip, xz, bzip2
+or zstd (if the zstandard package is installed) are decompressed
+on the fly while they are streamed. Parsed files can be kept in
+a graph cache so loading them again skips parsing
+'''
+import bz2
+from codecs import getincrementaldecoder
+from concurrent.futures import ProcessPoolExecutor
+import gzip
+import lzma
+import multiprocessing
+import os
+import zlib
 
-from pathlib import Path
+try:
+    from zstandard import open as _zstd_open
+except ImportError:
+    _zstd_open = None
 
-from tracerface.parse_stack import parse_stack
+from tracerface.parse_stack import StackParser
+from tracerface.stack_folder import StackFolder
+from tracerface.symbol_table import SymbolTable
 
 
-def load_trace_output_from_file_to_call_graph(file_path, call_graph):
-    text = Path(file_path).read_text()
-    call_graph.clear()
-    stacks = [stack.split('\n') for stack in text.split('\n\n')]
-    for stack in stacks:
-        graph = parse_stack(stack)
-        call_graph.load_edges(graph.edges)
-        call_graph.load_nodes(graph.nodes)
-    call_graph.init_colors()
+# Number of bytes read from an output file at once
+_CHUNK_SIZE = 1024 * 1024
+
+# Smallest part of a file which is worth parsing in a separate process
+_MIN_RANGE_SIZE = 64 * 1024 * 1024
+
+# Call-stacks are separated by an empty line
+_STACK_SEPARATOR = b'\n\n'
+
+# Magic bytes at the start of compressed files
+_GZIP_MAGIC = b'\x1f\x8b'
+_XZ_MAGIC = b'\xfd7zXZ\x00'
+_BZIP2_MAGIC = b'BZh'
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+class UnsupportedCompressionError(Exception):
+    pass
+
+
+# Errors raised while reading a corrupt compressed file, truncated files
+# raise EOFError instead. Corrupt gzip data raises zlib.error or OSError,
+# xz data LZMAError and bzip2 data OSError
+CORRUPT_COMPRESSION_ERRORS = (OSError, lzma.LZMAError, zlib.error)
+
+
+# Binary stream which reads at most a given number of bytes of another one
+class _LimitedReader:
+    def __init__(self, stream, length):
+        self._stream = stream
+        self._remaining = length
+
+    def read(self, size):
+        data = self._stream.read(min(size, self._remaining))
+        self._remaining -= len(data)
+        return data
+
+
+# Yield the lines of a binary stream which is read in fixed-size chunks.
+# A line crossing the border of two chunks is joined together
+def iter_lines(stream, chunk_size=_CHUNK_SIZE):
+    decoder = getincrementaldecoder('utf-8')(errors='replace')
+    partial_line = ''
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        lines = (partial_line + decoder.decode(chunk)).split('\n')
+        partial_line = lines.pop()
+        yield from lines
+    partial_line += decoder.decode(b'', final=True)
+    if partial_line:
+        yield partial_line
+
+
+# Feed lines of bcc trace output to the parser
+# and count the call-stacks it finishes in the folder
+def _fold_lines(lines, parser, folder):
+    for line in lines:
+        folded = parser.feed_folded(line)
+        if folded:
+            folder.add(folded)
+    folded = parser.flush_folded()
+    if folded:
+        folder.add(folded)
+
+
+# Return the function opening a compressed file for streamed decompression
+# based on its magic bytes, or None if the file is not compressed
+def _get_decompressing_open(file_path):
+    with open(file_path, 'rb') as stream:
+        magic = stream.read(len(_XZ_MAGIC))
+    if magic.startswith(_GZIP_MAGIC):
+        return gzip.open
+    if magic.startswith(_XZ_MAGIC):
+        return lzma.open
+    if magic.startswith(_BZIP2_MAGIC):
+        return bz2.open
+    if magic.startswith(_ZSTD_MAGIC):
+        if _zstd_open is None:
+            raise UnsupportedCompressionError(
+                '{} is zstd compressed, install the zstandard package to load it'.format(file_path)
+            )
+        return _zstd_open
+    return None
+
+
+# Open an output file for reading bytes,
+# compressed files are decompressed while being read
+def open_trace_output(file_path):
+    decompressing_open = _get_decompressing_open(file_path)
+    if decompressing_open:
+        return decompressing_open(file_path, 'rb')
+    return open(file_path, 'rb')
+
+
+# Return the offset where the first call-stack starting at or after
+# the given offset begins, or the size of the stream if there is none
+def _find_stack_start(stream, offset):
+    stream.seek(offset)
+    overlap = b''
+    while True:
+        chunk = stream.read(_CHUNK_SIZE)
+        if not chunk:
+            return stream.tell()
+        index = (overlap + chunk).find(_STACK_SEPARATOR)
+        if index != -1:
+            return offset - len(overlap) + index + len(_STACK_SEPARATOR)
+        # keep the end of the chunk in case the separator crosses chunks
+        overlap = chunk[-(len(_STACK_SEPARATOR) - 1):]
+        offset += len(chunk)
+
+
+# Split a stream into at most the given number of byte ranges
+# of similar size, which all start at the beginning of a call-stack
+def _split_at_stacks(stream, size, parts):
+    bounds = [0]
+    for part in range(1, parts):
+        start = _find_stack_start(stream, max(size * part // parts, bounds[-1]))
+        if start >= size:
+            break
+        if start > bounds[-1]:
+            bounds.append(start)
+    bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+
+# Parse a byte range of an output file, runs in a worker process.
+# Returns the folder counting its call-stacks with a symbol table of its own
+def _fold_range(file_path, start, end):
+    symbols = SymbolTable()
+    parser = StackParser(symbols)
+    folder = StackFolder(symbols)
+    with open(file_path, 'rb') as stream:
+        stream.seek(start)
+        _fold_lines(iter_lines(_LimitedReader(stream, end - start)), parser, folder)
+    return folder
+
+
+# Parse byte ranges of an output file in worker processes and
+# count their call-stacks in the folder using its node ids.
+# Workers are not forked from the server, which runs threads that
+# may hold locks, such as the one of the call graph, while forking
+def _fold_ranges_in_parallel(file_path, ranges, workers, folder):
+    starts = [start for start, _ in ranges]
+    ends = [end for _, end in ranges]
+    ctx = multiprocessing.get_context('forkserver')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as executor:
+        # results are merged in order of the ranges, so the outcome
+        # is the same as if the file was parsed from start to end
+        for range_folder in executor.map(_fold_range, [file_path] * len(ranges), starts, ends):
+            folder.add_folder(range_folder, [])
+
+
+# Count the call-stacks of an uncompressed output file in the folder,
+# large files are parsed by the given number of processes
+def _fold_file(file_path, workers, parser, folder):
+    with open(file_path, 'rb') as stream:
+        size = os.fstat(stream.fileno()).st_size
+        ranges = _split_at_stacks(stream, size, min(workers, size // _MIN_RANGE_SIZE))
+        if len(ranges) == 1:
+            stream.seek(0)
+            _fold_lines(iter_lines(stream), parser, folder)
+    if len(ranges) > 1:
+        _fold_ranges_in_parallel(file_path, ranges, workers, folder)
+
+
+# Count the call-stacks stored in the graph cache in the folder
+def _fold_cached(cached, folder):
+    cached_symbols, stacks = cached
+    folder.add_translated(cached_symbols, stacks, [])
+
+
+# Load output file to the call graph using the given number of processes,
+# compressed files can only be read from start to end by a single process.
+# If a graph cache is given, it is used to skip parsing files loaded before
+def load_trace_output_from_file_to_call_graph(file_path, call_graph, workers=1, cache=None):
+    # Node ids are only used within this load, since the graph is cleared
+    symbols = SymbolTable()
+    folder = StackFolder(symbols)
+    cached = cache.get(file_path) if cache else None
+    if cached:
+        _fold_cached(cached, folder)
+    else:
+        parser = StackParser(symbols)
+        decompressing_open = _get_decompressing_open(file_path)
+        if decompressing_open:
+            with decompressing_open(file_path, 'rb') as stream:
+                _fold_lines(iter_lines(stream), parser, folder)
+        else:
+            _fold_file(file_path, workers, parser, folder)
+        if cache:
+            stacks = [(folded.frames, folded.params, count) for folded, count in folder.stacks().items()]
+            cache.put(file_path, symbols.symbols(), stacks)
+    # Readers of the graph never see it cleared but not loaded yet
+    with call_graph.lock():
+        call_graph.clear()
+        folder.apply(call_graph)
+        call_graph.init_colors()
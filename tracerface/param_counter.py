@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+'''
+Bounded storage of the parameters captured for an edge.
+Every distinct tuple of parameters is counted instead of storing
+each occurrence. Once the number of distinct tuples reaches the
+capacity, the counter turns into a Space-Saving heavy hitters sketch:
+a new tuple replaces the least frequent one, so the most frequent
+tuples are kept and the rest is accounted for as other parameters
+'''
+
+# Default number of distinct parameter tuples kept per edge
+DEFAULT_CAPACITY = 64
+
+
+class ParamCounter:
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self._capacity = capacity
+        self._counts = {}
+        self._errors = {} # count a tuple may have inherited from the one it replaced
+        self._total = 0
+        self._other = 0 # sum of the errors and of other parameters of merged counters
+        self._evictions = 0
+
+    # Count occurrences of a tuple of parameters
+    def add(self, params, count=1):
+        self._total += count
+        if params in self._counts:
+            self._counts[params] += count
+        elif len(self._counts) < self._capacity:
+            self._counts[params] = count
+        else:
+            evicted = min(self._counts, key=self._counts.__getitem__)
+            floor = self._counts.pop(evicted)
+            self._other -= self._errors.pop(evicted, 0)
+            self._evictions += 1
+            self._counts[params] = floor + count
+            self._errors[params] = floor
+            self._other += floor
+
+    # Count everything counted by another counter
+    def update(self, other):
+        for params, count in other.items():
+            self.add(params, count)
+        self._total += other.other_count()
+        self._other += other.other_count()
+
+    # Return a counter which counts the same but changes independently
+    def copy(self):
+        counter = ParamCounter(self._capacity)
+        counter._counts = dict(self._counts)
+        counter._errors = dict(self._errors)
+        counter._total = self._total
+        counter._other = self._other
+        counter._evictions = self._evictions
+        return counter
+
+    # Return (parameters, count) pairs of the kept tuples, most frequent first.
+    # Counts are guaranteed occurrences, the rest belongs to other parameters
+    def items(self):
+        counts = [(params, count - self._errors.get(params, 0)) for params, count in self._counts.items()]
+        return sorted(counts, key=lambda item: item[1], reverse=True)
+
+    # Return number of occurrences not attributed to any of the kept tuples,
+    # the counts of kept tuples add up to the total apart from it
+    def other_count(self):
+        return self._other
+
+    # Return number of occurrences counted in total
+    def total(self):
+        return self._total
+
+    # Return number of tuples which were replaced by new ones
+    def evictions(self):
+        return self._evictions
+
+    # Return maximum number of distinct tuples kept
+    def capacity(self):
+        return self._capacity
+
+    # Return number of distinct tuples kept
+    def __len__(self):
+        return len(self._counts)
+
+    def __eq__(self, other):
+        if not isinstance(other, ParamCounter):
+            return NotImplemented
+        return self.items() == other.items() and self._total == other._total
+
+    def __repr__(self):
+        return 'ParamCounter({}, other={})'.format(self.items(), self.other_count())
@@ -6,9 +6,10 @@ where the former is the called function
 and the latter is the caller function
 '''
 from collections import namedtuple
-from hashlib import sha256
 from re import compile
 
+from tracerface.symbol_table import SymbolTable
+
 
 # Regex patterns to match in bcc trace output
 _FUNCTION_PATTERN = compile(r'^b\'(.+)\+.*\s\[(.+)\]')
@@ -19,12 +20,24 @@ _HEADER_PATTERN = compile(r'^PID\s+TID\s+COMM\s+FUNC')
 # Struct to contains a call-stack from bcc trace output
 Stack = namedtuple('Stack', 'nodes edges')
 
+# Compact, hashable form of a call-stack: the node ids of its frames
+# from the traced function to the outermost caller and the
+# tuple of parameters captured for the traced function
+FoldedStack = namedtuple('FoldedStack', 'frames params')
+
+
+# Maximum number of distinct frame lines remembered by a frame cache
+_FRAME_CACHE_SIZE = 65536
+
+# Marks a frame line which is not in the cache yet
+_MISSING = object()
+
 
 # Create node for a function with its name and source
-def _create_node(regex):
+def _create_node(name, source):
     node_dict = {}
-    node_dict['name'] = regex.group(1)
-    node_dict['source'] = regex.group(2)
+    node_dict['name'] = name
+    node_dict['source'] = source
     return node_dict
 
 
@@ -42,14 +55,14 @@ def _expand_edges(called, caller, edges, params, traced):
 
 
 # Add node to the nodes to be returned
-def _expand_nodes(node_dict, node_hash, nodes, called):
+def _expand_nodes(node_id, nodes, called, symbols):
     # If the node is not already present then add it to the list
-    if node_hash not in nodes:
-        nodes[node_hash] = node_dict
-        nodes[node_hash]['call_count'] = 0
+    if node_id not in nodes:
+        nodes[node_id] = _create_node(*symbols.symbol(node_id))
+        nodes[node_id]['call_count'] = 0
     # If the function is at the top of the call-stack then increase call count
-    if not called:
-        nodes[node_hash]['call_count'] += 1
+    if called is None:
+        nodes[node_id]['call_count'] += 1
 
 
 # Get parameters from a single stack
@@ -60,31 +73,154 @@ def _get_params(header):
     return None
 
 
-def parse_stack(stack):
-    if not stack:
-        return Stack(nodes={}, edges={})
-
-    if _HEADER_PATTERN.match(stack[0]):
-        stack.pop(0)
-    if not stack:
-        return Stack(nodes={}, edges={})
-
-    params = _get_params(stack.pop(0))
-
+# Expand a folded call-stack to its nodes and edges
+def expand_stack(folded, symbols):
     nodes = {}
     edges = {}
-    called_hash = None
+    params = list(folded.params)
+    called_id = None
     traced = True
-    while stack:
-        call = stack.pop(0)
-        caller = _FUNCTION_PATTERN.match(call)
-        if caller:
-            caller_node = _create_node(caller)
-            caller_hash = sha256(repr(caller_node).encode()).hexdigest()
-            _expand_nodes(caller_node, caller_hash, nodes, called_hash)
-            if called_hash:
-                _expand_edges(called_hash, caller_hash, edges, params, traced)
-                params = None
-                traced = False
-            called_hash = caller_hash
+    for caller_id in folded.frames:
+        _expand_nodes(caller_id, nodes, called_id, symbols)
+        if called_id is not None:
+            _expand_edges(called_id, caller_id, edges, params, traced)
+            params = None
+            traced = False
+        called_id = caller_id
     return Stack(nodes=nodes, edges=edges)
+
+
+# Size-capped cache which resolves raw frame lines to node ids,
+# so the regex matching and interning only runs for new lines.
+# Lines which are not frames are remembered to resolve to None
+class FrameCache:
+    def __init__(self, symbols, max_size=_FRAME_CACHE_SIZE):
+        self._symbols = symbols
+        self._max_size = max_size
+        self._frames = {}
+        self._hits = 0
+        self._misses = 0
+
+    # Return the node id of the function in a frame line
+    def resolve(self, line):
+        node_id = self._frames.get(line, _MISSING)
+        if node_id is not _MISSING:
+            self._hits += 1
+            return node_id
+
+        self._misses += 1
+        frame = _FUNCTION_PATTERN.match(line)
+        node_id = self._symbols.intern(frame.group(1), frame.group(2)) if frame else None
+        # When full, make room by evicting the oldest line
+        if len(self._frames) >= self._max_size:
+            del self._frames[next(iter(self._frames))]
+        self._frames[line] = node_id
+        return node_id
+
+    # Return the symbol table the ids are interned in
+    def symbols(self):
+        return self._symbols
+
+    # Return number of lines resolved from the cache
+    def hits(self):
+        return self._hits
+
+    # Return number of lines which had to be parsed
+    def misses(self):
+        return self._misses
+
+    # Return the ratio of lines resolved from the cache
+    def hit_rate(self):
+        lookups = self._hits + self._misses
+        if lookups:
+            return self._hits / lookups
+        return 0
+
+    def __len__(self):
+        return len(self._frames)
+
+
+# Stateful parser which consumes bcc trace output one line at a time.
+# Every line is processed as soon as it arrives, so a call-stack
+# never has to be buffered before it can be parsed.
+# Functions are identified by their ids in the given symbol table, or in one
+# of the parser's own. Frame lines are resolved through the given frame cache
+# or through one of the parser's own, which is never shared between threads
+class StackParser:
+    def __init__(self, symbols=None, frame_cache=None):
+        if frame_cache is None:
+            frame_cache = FrameCache(symbols if symbols is not None else SymbolTable())
+        self._frame_cache = frame_cache
+        self._symbols = frame_cache.symbols()
+        self._reset()
+
+    # Forget everything about the call-stack being parsed
+    def _reset(self):
+        self._frames = []
+        self._params = ()
+        self._started = False # the first line of a call-stack holds the parameters
+
+    # Finish the current call-stack and return it in folded form,
+    # or None if no line of a call-stack was consumed yet
+    def _finish(self):
+        if not self._started:
+            return None
+        folded = FoldedStack(frames=tuple(self._frames), params=self._params)
+        self._reset()
+        return folded
+
+    # Consume a single line of output, an empty line ends the call-stack.
+    # Returns the finished call-stack in folded form
+    # or None if it is not finished yet
+    def feed_folded(self, line):
+        if not line.strip():
+            return self._finish()
+
+        if not self._started:
+            if _HEADER_PATTERN.match(line):
+                return None
+            self._params = tuple(_get_params(line) or ())
+            self._started = True
+            return None
+
+        caller_id = self._frame_cache.resolve(line)
+        if caller_id is not None:
+            self._frames.append(caller_id)
+        return None
+
+    # Consume a single line of output, an empty line ends the call-stack.
+    # Returns the finished call-stack or None if it is not finished yet
+    def feed(self, line):
+        folded = self.feed_folded(line)
+        if folded:
+            return expand_stack(folded, self._symbols)
+        return None
+
+    # End of output reached, returns the last call-stack if there is one
+    def flush(self):
+        folded = self._finish()
+        if folded:
+            return expand_stack(folded, self._symbols)
+        return None
+
+    # End of output reached, returns the last call-stack
+    # in folded form if there is one
+    def flush_folded(self):
+        return self._finish()
+
+    # Return the symbol table the node ids are interned in
+    def symbols(self):
+        return self._symbols
+
+    # Return the cache used to resolve frame lines
+    def frame_cache(self):
+        return self._frame_cache
+
+
+def parse_stack(stack, symbols=None):
+    parser = StackParser(symbols)
+    for line in stack:
+        # lines of a single call-stack can not end it
+        if line.strip():
+            parser.feed(line)
+    return parser.flush() or Stack(nodes={}, edges={})
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+'''
+Splitting of the probes of a trace between multiple tracing processes.
+Probes are balanced by the rate of events they produced while they were
+traced before, so that no process gets much busier than the others
+'''
+
+
+# Remembers how many events per second each probe produced while
+# traced. Only the events of a whole process can be counted, so they
+# are divided evenly between the probes the process was tracing
+class ProbeRates:
+    def __init__(self):
+        self._rates = {}
+
+    # Record the events counted while tracing the given probes
+    def observe(self, probes, event_count, seconds):
+        if not probes or seconds <= 0:
+            return
+        rate = event_count / seconds / len(probes)
+        for probe in probes:
+            self._rates[probe] = rate
+
+    # Return the observed rate of a probe, probes never traced
+    # are expected to be as busy as the average probe
+    def rate(self, probe):
+        if probe in self._rates:
+            return self._rates[probe]
+        if self._rates:
+            return sum(self._rates.values()) / len(self._rates)
+        return 1
+
+    def __len__(self):
+        return len(self._rates)
+
+
+# Split probes into at most shard_count non-empty shards with similar
+# total rates: starting with the busiest probe, every probe is given to
+# the shard with the lowest total so far. Probes keep their order in a shard
+def shard_probes(probes, shard_count, rates):
+    shard_count = max(1, min(shard_count, len(probes)))
+    positions = sorted(range(len(probes)), key=lambda position: -rates.rate(probes[position]))
+    loads = [0] * shard_count
+    assigned = [[] for _ in range(shard_count)]
+    for position in positions:
+        shard = loads.index(min(loads))
+        loads[shard] += rates.rate(probes[position])
+        assigned[shard].append(position)
+    return [[probes[position] for position in sorted(shard)] for shard in assigned if shard]
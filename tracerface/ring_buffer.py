@@ -0,0 +1,168 @@
+'''
+This module contains a byte ring buffer in shared memory
+through which a single process can pass text records to another
+without pickling them or waking up a feeder thread for each one
+'''
+import multiprocessing
+from queue import Empty
+import struct
+
+try:
+    from multiprocessing.shared_memory import SharedMemory
+except ImportError: # shared memory needs Python 3.8
+    SharedMemory = None
+
+
+# Default number of bytes the buffer can hold
+DEFAULT_RING_SIZE = 16 * 1024 * 1024
+
+# The header holds the write position, the read position and the
+# number of dropped records. Positions only ever grow, their
+# remainder by the buffer size is the offset of the next byte
+_COUNTER = struct.Struct('Q')
+_WRITE_POSITION = 0
+_READ_POSITION = _COUNTER.size
+_DROPPED_RECORDS = 2 * _COUNTER.size
+_HEADER_SIZE = 3 * _COUNTER.size
+
+# Each record is framed by its length
+_LENGTH = struct.Struct('I')
+
+
+# Raised when shared memory can not be used on the system
+class SharedMemoryUnavailableError(Exception):
+    pass
+
+
+# Ring buffer with a single writer and a single reader process.
+# The writer only moves the write position and the reader only the read
+# position, so they do not need a lock. Text records which do not fit into
+# the free space are dropped and counted instead of blocking the writer.
+# It has a write and flush method to redirect text streams into, and get
+# methods like a Queue, so it can be used in place of the WritableQueue.
+# Records of bytes are passed with the put_bytes and get_bytes methods
+class RingBuffer:
+    def __init__(self, size=DEFAULT_RING_SIZE, ctx=None):
+        if SharedMemory is None:
+            raise SharedMemoryUnavailableError('Shared memory is not supported by this Python version')
+        if ctx is None:
+            ctx = multiprocessing.get_context()
+        try:
+            self._memory = SharedMemory(create=True, size=_HEADER_SIZE + size)
+        except OSError as e:
+            raise SharedMemoryUnavailableError('Could not create shared memory: {}'.format(e))
+        self._size = size
+        self._data_ready = ctx.Event() # set by the writer when it writes into an empty buffer
+        self._create_views()
+        for offset in (_WRITE_POSITION, _READ_POSITION, _DROPPED_RECORDS):
+            _COUNTER.pack_into(self._header, offset, 0)
+
+    def _create_views(self):
+        self._header = self._memory.buf[:_HEADER_SIZE]
+        self._data = self._memory.buf[_HEADER_SIZE:_HEADER_SIZE + self._size]
+
+    # Views of the shared memory can not be pickled,
+    # they are created again in the other process
+    def __getstate__(self):
+        return {'_memory': self._memory, '_size': self._size, '_data_ready': self._data_ready}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._create_views()
+
+    def _counter(self, offset):
+        return _COUNTER.unpack_from(self._header, offset)[0]
+
+    # Copy bytes into the buffer starting at the given position
+    def _copy_in(self, position, data):
+        offset = position % self._size
+        first = min(len(data), self._size - offset)
+        self._data[offset:offset + first] = data[:first]
+        self._data[:len(data) - first] = data[first:]
+
+    # Copy bytes out of the buffer starting at the given position
+    def _copy_out(self, position, length):
+        offset = position % self._size
+        first = min(length, self._size - offset)
+        return bytes(self._data[offset:offset + first]) + bytes(self._data[:length - first])
+
+    # Append a record of bytes, returns False if it does not fit
+    def put_bytes(self, data):
+        record = _LENGTH.pack(len(data)) + data
+        write_position = self._counter(_WRITE_POSITION)
+        if len(record) > self._size - (write_position - self._counter(_READ_POSITION)):
+            return False
+        self._copy_in(write_position, record)
+        _COUNTER.pack_into(self._header, _WRITE_POSITION, write_position + len(record))
+        # The reader might have found the buffer empty and be waiting
+        if self._counter(_READ_POSITION) == write_position:
+            self._data_ready.set()
+        return True
+
+    # Return the oldest record of bytes, raises Empty if there is none
+    def get_bytes_nowait(self):
+        read_position = self._counter(_READ_POSITION)
+        if read_position == self._counter(_WRITE_POSITION):
+            raise Empty
+        length = _LENGTH.unpack(self._copy_out(read_position, _LENGTH.size))[0]
+        data = self._copy_out(read_position + _LENGTH.size, length)
+        _COUNTER.pack_into(self._header, _READ_POSITION, read_position + _LENGTH.size + length)
+        return data
+
+    # Return the oldest record of bytes, waiting at most timeout
+    # seconds for one to be written, raises Empty if there is none
+    def get_bytes(self, timeout=None):
+        try:
+            return self.get_bytes_nowait()
+        except Empty:
+            pass
+        self._data_ready.clear()
+        # A record written before clearing would not wake us up
+        try:
+            return self.get_bytes_nowait()
+        except Empty:
+            pass
+        self._data_ready.wait(timeout)
+        return self.get_bytes_nowait()
+
+    # Append a text record, or drop it if it does not fit
+    def write(self, s):
+        if not self.put_bytes(s.encode()):
+            self.count_dropped(1)
+
+    # Count call-stacks the writer could not pass
+    def count_dropped(self, count):
+        _COUNTER.pack_into(self._header, _DROPPED_RECORDS, self._counter(_DROPPED_RECORDS) + count)
+
+    def flush(self):
+        pass
+
+    # Return the oldest text record, raises Empty if there is none
+    def get_nowait(self):
+        return self.get_bytes_nowait().decode()
+
+    # Return the oldest text record, waiting at most timeout
+    # seconds for one to be written, raises Empty if there is none
+    def get(self, timeout=None):
+        return self.get_bytes(timeout).decode()
+
+    # Returns the number of text records which did not fit into the buffer,
+    # along with the call-stacks counted as dropped by the writer
+    def dropped(self):
+        return self._counter(_DROPPED_RECORDS)
+
+    # Returns the part of the buffer taken by records not read yet
+    def backlog(self):
+        return (self._counter(_WRITE_POSITION) - self._counter(_READ_POSITION)) / self._size
+
+    # Release the buffer in this process
+    def close(self):
+        self._header.release()
+        self._data.release()
+        self._memory.close()
+
+    # Release the buffer and free the shared memory, which
+    # has to be done by exactly one of the processes
+    def unlink(self):
+        self.close()
+        self._memory.unlink()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+'''
+Pre-aggregation of parsed call-stacks.
+Identical call-stacks are counted instead of being merged
+into the call graph one by one, so every distinct call-stack
+is merged only once, multiplied by the number of its occurrences
+'''
+from tracerface.call_graph import GraphBatch
+from tracerface.parse_stack import FoldedStack
+
+
+# Counts folded call-stacks until they are applied to a call graph.
+# Call-stacks with different parameters are counted separately
+class StackFolder:
+    def __init__(self, symbols):
+        self._symbols = symbols
+        self._stacks = {}
+        self._stack_count = 0
+
+    # Count an occurrence of a folded call-stack
+    def add(self, folded, count=1):
+        self._stacks[folded] = self._stacks.get(folded, 0) + count
+        self._stack_count += count
+
+    # Count (frames, params, count) call-stacks whose node ids belong to
+    # another symbol table, translating them through the given list. The list
+    # is first extended with the ids of new_symbols, the (name, source)
+    # pairs of the other table which were not translated before
+    def add_translated(self, new_symbols, stacks, node_ids):
+        node_ids.extend(self._symbols.intern(name, source) for name, source in new_symbols)
+        for frames, params, count in stacks:
+            self.add(FoldedStack(frames=tuple(node_ids[frame] for frame in frames), params=params), count)
+
+    # Count every call-stack of another folder, translating its node ids
+    # through the given list, which is extended with the ids of the
+    # symbols of the other folder which were not translated before
+    def add_folder(self, other, node_ids):
+        new_symbols = other.symbols().symbols()[len(node_ids):]
+        stacks = ((folded.frames, folded.params, count) for folded, count in other.stacks().items())
+        self.add_translated(new_symbols, stacks, node_ids)
+
+    # Return the counted folded call-stacks
+    def stacks(self):
+        return self._stacks
+
+    # Return the symbol table the node ids are interned in
+    def symbols(self):
+        return self._symbols
+
+    # Return the number of call-stacks counted, including repetitions
+    def stack_count(self):
+        return self._stack_count
+
+    # Aggregate the counted call-stacks into a batch for the call graph.
+    # The traced function at the top of a call-stack and the edge leading
+    # to it are counted, other functions and edges only need to be present
+    def batch(self):
+        node_counts = {}
+        edge_counts = {}
+        edge_params = {}
+        for folded, count in self._stacks.items():
+            frames = folded.frames
+            if not frames:
+                continue
+            node_counts[frames[0]] = node_counts.get(frames[0], 0) + count
+            for node_id in frames[1:]:
+                node_counts.setdefault(node_id, 0)
+            if len(frames) < 2:
+                continue
+            traced_edge = (frames[1], frames[0])
+            edge_counts[traced_edge] = edge_counts.get(traced_edge, 0) + count
+            if folded.params:
+                params = edge_params.setdefault(traced_edge, {})
+                params[folded.params] = params.get(folded.params, 0) + count
+            for index in range(2, len(frames)):
+                edge_counts.setdefault((frames[index], frames[index - 1]), 0)
+        return GraphBatch(
+            symbols=self._symbols,
+            node_counts=node_counts,
+            edge_counts=edge_counts,
+            edge_params=edge_params
+        )
+
+    # Merge every distinct call-stack into the call graph once,
+    # weighted by its count, then start counting from scratch
+    def apply(self, call_graph):
+        call_graph.merge_batch(self.batch())
+        self.clear()
+
+    # Forget every counted call-stack
+    def clear(self):
+        self._stacks = {}
+        self._stack_count = 0
+
+    # Return the number of distinct call-stacks counted
+    def __len__(self):
+        return len(self._stacks)
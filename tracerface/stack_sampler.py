@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+'''
+Sampling of call-stacks while the reader of the trace output
+falls behind. Only every N-th call-stack is parsed and counted
+N times, N grows while the unread output piles up and shrinks
+once the reader caught up, so the graph stays approximately right
+instead of the tracing process dropping call-stacks
+'''
+
+# Part of the output budget taken by unread output above which
+# fewer call-stacks are sampled, and below which more of them are
+_HIGH_BACKLOG = 0.5
+_LOW_BACKLOG = 0.125
+
+# Default largest number of call-stacks a sampled one stands for
+DEFAULT_MAX_INTERVAL = 1024
+
+
+# Chooses which call-stacks are counted, one in every interval of them.
+# The interval doubles whenever the backlog is high and halves whenever
+# it is low, so all call-stacks are counted while the reader keeps up
+class AdaptiveSampler:
+    def __init__(self, max_interval=DEFAULT_MAX_INTERVAL):
+        self._max_interval = max_interval
+        self._interval = 1
+        self._position = 0
+        self._skipped = 0
+
+    # Adapt the interval to the part of the output budget taken by unread output
+    def adjust(self, backlog):
+        if backlog >= _HIGH_BACKLOG:
+            self._interval = min(self._interval * 2, self._max_interval)
+        elif backlog <= _LOW_BACKLOG:
+            self._interval = max(self._interval // 2, 1)
+
+    # Returns how many times the next call-stack is counted, 0 if it is left
+    # out. A counted call-stack stands for itself and every call-stack left
+    # out since the last counted one, even if the interval shrank meanwhile
+    def keep(self):
+        self._position += 1
+        if self._position >= self._interval:
+            count, self._position = self._position, 0
+            return count
+        self._skipped += 1
+        return 0
+
+    # Returns the number of call-stacks between counted ones
+    def interval(self):
+        return self._interval
+
+    # Returns the number of call-stacks left out
+    def skipped(self):
+        return self._skipped
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+'''
+Interning table for the functions found in bcc trace output.
+Every distinct function is identified by its name and source
+and gets a small integer id which is used as its node id
+'''
+
+
+# Hands out compact integer ids for (name, source) pairs,
+# the same pair always gets the same id
+class SymbolTable:
+    def __init__(self):
+        self._ids = {}
+        self._symbols = []
+
+    # Return the id of a function, registering it if it is new
+    def intern(self, name, source):
+        key = (name, source)
+        try:
+            return self._ids[key]
+        except KeyError:
+            symbol_id = len(self._symbols)
+            self._ids[key] = symbol_id
+            self._symbols.append(key)
+            return symbol_id
+
+    # Return the (name, source) pair belonging to an id
+    def symbol(self, symbol_id):
+        return self._symbols[symbol_id]
+
+    # Return all registered (name, source) pairs indexed by their ids
+    def symbols(self):
+        return self._symbols
+
+    def __len__(self):
+        return len(self._symbols)
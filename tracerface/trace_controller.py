@@ -1,64 +1,312 @@
-from threading import Thread
+from threading import Lock, Thread
+import time
 
-from tracerface.parse_stack import parse_stack
-from tracerface.trace_process import TraceProcess
+from tracerface.folded_output import fold_delta
+from tracerface.parse_stack import StackParser
+from tracerface.probe_sharding import ProbeRates, shard_probes
+from tracerface.stack_folder import StackFolder
+from tracerface.stack_sampler import AdaptiveSampler
+from tracerface.symbol_table import SymbolTable
+from tracerface.ring_buffer import SharedMemoryUnavailableError
+from tracerface.trace_process import DEFAULT_OUTPUT_BUDGET, RING_TRANSPORT, TraceProcess
+from tracerface.trace_source import bcc_trace_source
+from tracerface.tracer_pool import TracerPool
+
+
+# Default seconds to collect call-stacks for before merging them into the graph
+DEFAULT_BATCH_WINDOW = 0.1
+
+# Default number of call-stacks which are merged into the graph
+# as soon as they are collected, even if the window did not end yet
+DEFAULT_BATCH_SIZE = 10000
+
+# Default number of tracing processes the application keeps ready
+DEFAULT_WARM_TRACERS = 1
+
+
+# Reads the lines of raw output of the tracing process and counts their
+# call-stacks. Call-stacks left out by the sampler are skipped without
+# parsing them, the ones kept are counted as many times as the sampler says
+class _OutputReader:
+    def __init__(self, parser, folder, sampler):
+        self._parser = parser
+        self._folder = folder
+        self._sampler = sampler
+        self._in_stack = False # a call-stack started and did not end yet
+        self._weight = 1 # times the current call-stack is counted, 0 if it is skipped
+
+    def _feed(self, line):
+        # an empty line ends the call-stack
+        if not line.strip():
+            self._in_stack = False
+            folded = self._parser.feed_folded(line) if self._weight else None
+            if folded:
+                self._folder.add(folded, self._weight)
+            return
+        if not self._in_stack:
+            self._in_stack = True
+            self._weight = self._sampler.keep()
+        if self._weight:
+            self._parser.feed_folded(line)
+
+    # Read a batch of output, returns the batch size
+    def read(self, trace_process, timeout):
+        lines, record_count = trace_process.get_lines(timeout)
+        self._sampler.adjust(trace_process.backlog())
+        for line in lines:
+            self._feed(line)
+        return record_count
+
+    # Count the last call-stack once the output ended, even if it was not ended
+    def finish(self, trace_process):
+        for line in trace_process.flush_lines():
+            self._feed(line)
+        folded = self._parser.flush_folded() if self._weight else None
+        if folded:
+            self._folder.add(folded, self._weight)
+
+
+# Returns empty metrics of merging batches into the graph
+def _new_metrics():
+    return {
+        'batches': 0,
+        'stacks': 0,
+        'last_flush_latency': 0.0,
+        'max_flush_latency': 0.0,
+        'mean_flush_latency': 0.0,
+        'merge_seconds': 0.0
+    }
+
+
+# Reads the deltas folded by the tracing process and counts their call-stacks
+class _DeltaReader:
+    def __init__(self, folder):
+        self._folder = folder
+        self._node_ids = [] # ids in the symbol table by the ids of the tracing process
+
+    # Read a batch of deltas, returns the batch size
+    def read(self, trace_process, timeout):
+        deltas = trace_process.get_deltas(timeout)
+        for delta in deltas:
+            fold_delta(delta, self._node_ids, self._folder)
+        return len(deltas)
+
+    # Deltas hold whole call-stacks only, nothing is left once the output ended
+    def finish(self, trace_process):
+        pass
 
 
 # The TraceController class manages the lifecycle
 # of the tracing process, consumes and parses its
-# outputs, and loads them into the given CallGraph
+# outputs, and loads them into the given CallGraph.
+# Outputs are parsed by the monitoring thread,
+# or already in the tracing process if fold_in_tracer is set.
+# The probes can be split between multiple tracing processes, each
+# of them monitored by its own thread. Threads parse the outputs with
+# their own symbol table and translate ids only when merging the graph.
+# The output is printed by trace sources created by source_factory
+# for the functions traced by a process, which run bcc trace by default.
+# Call-stacks are collected into a batch which is merged into the graph at
+# once, batch_window seconds after its first call-stack was read or when
+# it holds batch_size call-stacks, whichever comes first. The tracing
+# process folds its output in windows of batch_window seconds as well.
+# A tracing process holds at most output_budget bytes of unread output
+# and drops call-stacks beyond that. Before it comes to that, the reader
+# samples the call-stacks and scales up their counts while it falls behind,
+# either way the graph of the trace is only approximate.
+# With warm_tracers, that many tracing processes are started in advance
+# and kept between traces, so tracing the same functions again starts
+# quickly. Further tracing processes are started when they are needed
 class TraceController:
-    def __init__(self):
+    def __init__(self, transport=RING_TRANSPORT, fold_in_tracer=False, shards=1,
+                 source_factory=bcc_trace_source, batch_window=DEFAULT_BATCH_WINDOW,
+                 batch_size=DEFAULT_BATCH_SIZE, output_budget=DEFAULT_OUTPUT_BUDGET,
+                 warm_tracers=0):
         self._thread_enabled = False
         self._thread_error = None
+        self._transport = transport
+        self._fold_in_tracer = fold_in_tracer
+        self._shards = shards
+        self._source_factory = source_factory
+        self._batch_window = batch_window
+        self._batch_size = batch_size
+        self._output_budget = output_budget
+        self._monitoring = []
+        self._probe_rates = ProbeRates()
+        self._dropped_stacks = {}
+        self._sampled_stacks = {}
+        self._symbols = SymbolTable()
+        self._merge_lock = Lock()
+        self._metrics = _new_metrics()
+        self._tracer_pool = None
+        # Warm tracing processes pass their output through shared memory only
+        if warm_tracers > 0 and transport == RING_TRANSPORT:
+            tracer_pool = TracerPool(warm_tracers, output_budget)
+            try:
+                tracer_pool.start()
+                self._tracer_pool = tracer_pool
+            except SharedMemoryUnavailableError:
+                tracer_pool.close()
 
-    # While tracing, consume items from the queue and process them
-    def _monitor_tracing(self, trace_process, call_graph):
-        calls = []
-        last_line_was_empty = False # call-stack ends when two empty lines follow eachother
+    # Merge call-stacks counted by a monitoring thread into the graph and
+    # empty its folder, node_ids translates the ids of the thread to shared ones.
+    # The batch started when its first call-stack was read at batch_start
+    def _merge(self, folder, node_ids, call_graph, batch_start):
+        with self._merge_lock:
+            merge_start = time.monotonic()
+            merged = StackFolder(self._symbols)
+            merged.add_folder(folder, node_ids)
+            with call_graph.lock():
+                merged.apply(call_graph)
+                call_graph.init_colors()
+            merge_end = time.monotonic()
+            self._record_flush(folder.stack_count(), merge_end - batch_start, merge_end - merge_start)
+        folder.clear()
+
+    # Update the metrics with a merged batch
+    def _record_flush(self, stack_count, latency, merge_seconds):
+        metrics = self._metrics
+        metrics['batches'] += 1
+        metrics['stacks'] += stack_count
+        metrics['last_flush_latency'] = latency
+        metrics['max_flush_latency'] = max(metrics['max_flush_latency'], latency)
+        metrics['mean_flush_latency'] += (latency - metrics['mean_flush_latency']) / metrics['batches']
+        metrics['merge_seconds'] += merge_seconds
+
+    # While tracing, consume items from the queue and process them.
+    # The thread sleeps until there is output or the window ends,
+    # so it does not take CPU time from the server while idle.
+    # The rate of call-stacks is recorded for the traced probes
+    def _monitor_tracing(self, trace_process, call_graph, probes=()):
+        symbols = SymbolTable()
+        folder = StackFolder(symbols)
+        node_ids = []
+        sampler = AdaptiveSampler()
+        if trace_process.folds_output():
+            reader = _DeltaReader(folder)
+        else:
+            reader = _OutputReader(StackParser(symbols), folder, sampler)
+        start = time.monotonic()
+        batch_start = None # when the first call-stack of the current batch was read
+        stack_count = 0
         while self._thread_enabled:
-            # If process died unexpectedly, report error
+            # Read what the process output before it stopped,
+            # if process died unexpectedly, report error
             if not trace_process.is_alive():
-                self._thread_error = 'Tracing stopped unexpectedly'
+                while reader.read(trace_process, self._batch_window):
+                    pass
+                reader.finish(trace_process)
+                if trace_process.exitcode or not trace_process.source().ends_by_itself():
+                    self._thread_error = 'Tracing stopped unexpectedly'
                 break
-            output = trace_process.get_output()
-            # call-stack ended
-            if output == '\n' and last_line_was_empty:
-                stack = parse_stack(calls)
-                call_graph.load_edges(stack.edges)
-                call_graph.load_nodes(stack.nodes)
-                call_graph.init_colors()
-                calls.clear()
-            # new line after a regular output
-            elif output == '\n':
-                last_line_was_empty = True
-            # regular output from bcc trace
-            elif output:
-                last_line_was_empty = False
-                calls.append(output)
+            # Wait for output at most until the window of the batch ends
+            timeout = self._batch_window
+            if batch_start is not None:
+                timeout = max(0, batch_start + self._batch_window - time.monotonic())
+            reader.read(trace_process, timeout)
+            self._dropped_stacks[trace_process] = trace_process.dropped_stacks()
+            self._sampled_stacks[trace_process] = sampler.skipped()
+            if not folder:
+                continue
+            if batch_start is None:
+                batch_start = time.monotonic()
+            # Merge the batch once its window ended or it is large enough
+            if (time.monotonic() - batch_start >= self._batch_window
+                    or folder.stack_count() >= self._batch_size):
+                stack_count += folder.stack_count()
+                self._merge(folder, node_ids, call_graph, batch_start)
+                batch_start = None
+        if folder:
+            stack_count += folder.stack_count()
+            self._merge(folder, node_ids, call_graph, batch_start or time.monotonic())
+        self._probe_rates.observe(probes, stack_count, time.monotonic() - start)
         # Terminate process when tracing is stopped by the user
         if trace_process.is_alive():
-            trace_process.terminate()
+            trace_process.stop()
             trace_process.join()
+        trace_process.close_output()
 
-    # Starts tracing of given functions
+    # Starts tracing of given functions into the cleared graph.
+    # The previous trace is stopped and its processes are
+    # waited for first, so none of its output is merged anymore
     def start_trace(self, functions, call_graph):
+        self.stop_trace()
+        self.join()
+        call_graph.clear()
         if not functions:
             self._thread_error = 'No functions to trace'
             return
         self._thread_error = None
         self._thread_enabled = True
+        self._dropped_stacks = {}
+        self._sampled_stacks = {}
+        self._monitoring = []
+        # The graph of the new trace is built from scratch, so are the ids of its functions
+        with self._merge_lock:
+            self._metrics = _new_metrics()
+            self._symbols = SymbolTable()
 
-        args = ['', '-UK'] + [fr'{function}' for function in functions]
-        trace_process = TraceProcess(args=args)
-        monitoring = Thread(target=self._monitor_tracing, args=(trace_process, call_graph,))
-        trace_process.start()
-        monitoring.start()
+        fold_window = self._batch_window if self._fold_in_tracer else None
+        # Replace warm tracing processes which died, before any trace is read
+        if self._tracer_pool is not None:
+            try:
+                self._tracer_pool.start()
+            except SharedMemoryUnavailableError:
+                pass
+        for probes in shard_probes(functions, self._shards, self._probe_rates):
+            source = self._source_factory(probes)
+            trace_process = None
+            if self._tracer_pool is not None:
+                trace_process = self._tracer_pool.acquire(source, fold_window)
+            if trace_process is None:
+                trace_process = TraceProcess(source=source, transport=self._transport, fold_window=fold_window,
+                                             output_budget=self._output_budget)
+            self._dropped_stacks[trace_process] = 0
+            self._sampled_stacks[trace_process] = 0
+            monitoring = Thread(target=self._monitor_tracing, args=(trace_process, call_graph, probes))
+            self._monitoring.append(monitoring)
+            trace_process.start()
+            monitoring.start()
 
     # Stop tracing and initialize colors
     def stop_trace(self):
         self._thread_enabled = False
 
+    # Wait until every process of the last trace is stopped and its output is
+    # merged, which happens without stopping the trace only if sources end by themselves
+    def join(self, timeout=None):
+        for monitoring in self._monitoring:
+            monitoring.join(timeout)
+
+    # Returns the number of call-stacks of the last trace lost
+    # because they were produced faster than they could be read
+    def dropped_stacks(self):
+        return sum(self._dropped_stacks.values())
+
+    # Returns the number of call-stacks of the last trace left out by
+    # sampling, which are accounted for by the ones sampled instead
+    def sampled_stacks(self):
+        return sum(self._sampled_stacks.values())
+
+    # Returns whether call counts of the last trace are only approximate
+    def approximate(self):
+        return self.dropped_stacks() > 0 or self.sampled_stacks() > 0
+
+    # Returns metrics of merging batches of the last trace into the graph.
+    # The flush latency of a batch is the time from reading its first
+    # call-stack until the batch is merged, in seconds
+    def metrics(self):
+        with self._merge_lock:
+            return dict(self._metrics)
+
     # Returns error happening while an active trace
     def thread_error(self):
         return self._thread_error
+
+    # Stop the trace and the warm tracing processes, waiting
+    # at most timeout seconds for the output to be merged
+    def close(self, timeout=None):
+        self.stop_trace()
+        self.join(timeout)
+        if self._tracer_pool is not None:
+            self._tracer_pool.close()
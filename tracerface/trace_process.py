@@ -1,48 +1,279 @@
 from contextlib import redirect_stdout
-from importlib import machinery, util
 import multiprocessing
 from multiprocessing.queues import Queue
+import os
 from queue import Empty
-import sys
+import signal
 
+from tracerface.folded_output import decode_delta, FoldingWriter
+from tracerface.line_splitter import LineSplitter
+from tracerface.ring_buffer import DEFAULT_RING_SIZE, RingBuffer, SharedMemoryUnavailableError
+from tracerface.trace_source import BccTraceSource
+from tracerface.trace_stop import install_stop_handler, stoppable, TraceStopped
 
-# BCC trace is supposed to be run from the terminal.
-# With this hack we can use it as a reuglar class instead.
-def _get_bcc_trace_tool(args):
-    sys.path.append('/usr/lib/python3/dist-packages')
-    loader = machinery.SourceFileLoader('bcc_trace', '/usr/share/bcc/tools/trace')
-    spec = util.spec_from_loader(loader.name, loader)
-    bcc_trace = util.module_from_spec(spec)
-    loader.exec_module(bcc_trace)
-    sys.argv = args
-    return bcc_trace.Tool()
+
+# Maximum number of outputs returned at once, so the
+# caller gets control back regularly even under heavy load
+_MAX_OUTPUT_BATCH = 4096
+
+# Ways of passing the output of the tracing to the parent process
+QUEUE_TRANSPORT = 'queue'
+RING_TRANSPORT = 'ring'
+
+# Default number of bytes of output waiting to be read
+# before the tracing process starts dropping call-stacks
+DEFAULT_OUTPUT_BUDGET = DEFAULT_RING_SIZE
+
+# Seconds a stopped tracing process gets to pass the rest of its output
+_STOP_SECONDS = 5
 
 
 # Special Queue class with a write and flush method
-# which can be used to write text streams into
+# which can be used to write text streams into.
+# Records of bytes are passed the same way as the ring buffer passes them.
+# Like the ring buffer, it holds at most budget bytes of records,
+# records which do not fit are dropped instead of blocking the writer.
+# Text records are measured by their length, not their encoded size
 class WritableQueue(Queue):
+    def __init__(self, budget=DEFAULT_OUTPUT_BUDGET, *, ctx):
+        super().__init__(ctx=ctx)
+        self._budget = budget
+        self._queued_bytes = ctx.Value('q', 0) # changed by both processes
+        self._dropped = ctx.Value('q', 0, lock=False) # changed by the writer only
+
+    def __getstate__(self):
+        return super().__getstate__(), self._budget, self._queued_bytes, self._dropped
+
+    def __setstate__(self, state):
+        queue_state, self._budget, self._queued_bytes, self._dropped = state
+        super().__setstate__(queue_state)
+
+    # Take room for records of the given size, returns False if they do not fit
+    def _reserve(self, size):
+        with self._queued_bytes.get_lock():
+            if self._queued_bytes.value + size > self._budget:
+                return False
+            self._queued_bytes.value += size
+            return True
+
+    def write(self, s):
+        if self._reserve(len(s)):
+            self.put(s)
+        else:
+            self.count_dropped(1)
+
+    # Count call-stacks the writer could not pass
+    def count_dropped(self, count):
+        self._dropped.value += count
+
+    def flush(self):
+        pass
+
+    def put_bytes(self, data):
+        if not self._reserve(len(data)):
+            return False
+        self.put(data)
+        return True
+
+    def get(self, block=True, timeout=None):
+        record = super().get(block, timeout)
+        with self._queued_bytes.get_lock():
+            self._queued_bytes.value -= len(record)
+        return record
+
+    def get_bytes(self, timeout=None):
+        return self.get(timeout=timeout)
+
+    def get_bytes_nowait(self):
+        return self.get_nowait()
+
+    # Returns the number of text records which did not fit,
+    # along with the call-stacks counted as dropped by the writer
+    def dropped(self):
+        return self._dropped.value
+
+    # Returns the part of the budget taken by records not read yet
+    def backlog(self):
+        return self._queued_bytes.value / self._budget
+
+
+# Text stream which passes the output to the transport one call-stack at a
+# time. Lines are collected from writes of any size until an empty line
+# ends the call-stack, then all of them are written as a single record,
+# so when the transport is full whole call-stacks are dropped and the
+# reader never gets a partial one. Every record ends with a line break
+class StackWriter:
+    def __init__(self, transport):
+        self._transport = transport
+        self._lines = LineSplitter()
+        self._stack = [] # lines of the call-stack not ended yet
+
     def write(self, s):
-        self.put(s)
+        for line in self._lines.feed(s):
+            self._stack.append(line)
+            if not line.strip():
+                self._write_stack()
 
     def flush(self):
         pass
 
+    # Write the last call-stack, which might not be ended
+    def close(self):
+        self._stack.extend(self._lines.flush())
+        if self._stack:
+            self._write_stack()
+
+    def _write_stack(self):
+        self._stack.append('')
+        self._transport.write('\n'.join(self._stack))
+        self._stack = []
+
+
+# Returns the transport of the given kind holding at most output_budget bytes.
+# A ring buffer falls back to a queue if shared memory can not be used
+def create_transport(transport, output_budget=DEFAULT_OUTPUT_BUDGET):
+    if transport == RING_TRANSPORT:
+        try:
+            return RingBuffer(output_budget, ctx=multiprocessing.get_context())
+        except SharedMemoryUnavailableError:
+            pass
+    return WritableQueue(output_budget, ctx=multiprocessing.get_context())
+
+
+# Run a source until it ends or the trace is stopped, which is
+# right away if stopped returns True once the trace can be stopped
+def _run_stoppable(source, args, stopped):
+    try:
+        with stoppable():
+            if stopped is not None and stopped():
+                raise TraceStopped()
+            source.run(*args)
+    except TraceStopped:
+        pass
+
+
+# Run a trace source with its output passed through the transport, line
+# by line or folded in windows of fold_window seconds if it is given.
+# Output written before the source stopped, even by an exception or by
+# stopping the trace, is passed. Any further arguments are passed on to the source
+def run_source(source, transport, fold_window, *args, stopped=None):
+    if fold_window is None:
+        writer = StackWriter(transport)
+        try:
+            with redirect_stdout(writer):
+                _run_stoppable(source, args, stopped)
+        finally:
+            writer.close()
+        return
+    writer = FoldingWriter(transport.put_bytes, transport.count_dropped)
+    writer.start_sending(fold_window)
+    try:
+        with redirect_stdout(writer):
+            _run_stoppable(source, args, stopped)
+    finally:
+        writer.stop_sending()
+
+
+# Reads the output a trace source passes through the transport in _queue.
+# Classes using it set _queue, _source and _fold_window, and _lines to
+# a new LineSplitter, the number of records dropped before the output
+# started is kept in _dropped_before
+class TraceOutputReader:
+    # Returns the source printing the output
+    def source(self):
+        return self._source
+
+    # Returns whether the output is passed as folded deltas
+    def folds_output(self):
+        return self._fold_window is not None
+
+    # Wait at most timeout seconds for a record, then return it
+    # along with every other record available without waiting
+    def _get_records(self, get, get_nowait, timeout):
+        try:
+            records = [get(timeout=timeout)]
+        except Empty:
+            return []
+        while len(records) < _MAX_OUTPUT_BATCH:
+            try:
+                records.append(get_nowait())
+            except Empty:
+                break
+        return records
+
+    # Wait at most timeout seconds for output, then return its lines along
+    # with the lines of every other output available without waiting.
+    # Lines are stripped of spaces, an empty line ends a call-stack.
+    # Returns the number of records read too, which is not 0 while there
+    # was output, even if it did not complete a line
+    def get_lines(self, timeout):
+        records = self._get_records(self._queue.get, self._queue.get_nowait, timeout)
+        lines = []
+        for record in records:
+            lines.extend(self._lines.feed(record))
+        return [line.strip(' ') for line in lines], len(records)
+
+    # Returns the last line of the output if it did not end with a line break
+    def flush_lines(self):
+        return [line.strip(' ') for line in self._lines.flush()]
+
+    # Wait at most timeout seconds for a folded delta, then return
+    # it along with every other delta available without waiting
+    def get_deltas(self, timeout):
+        deltas = self._get_records(self._queue.get_bytes, self._queue.get_bytes_nowait, timeout)
+        return [decode_delta(delta) for delta in deltas]
+
+    # Returns the number of call-stacks, or of outputs of the tracing process
+    # which did not end a call-stack, lost because the reader could not keep up
+    def dropped_stacks(self):
+        return self._queue.dropped() - self._dropped_before
+
+    # Returns the part of the output budget taken by output not read yet
+    def backlog(self):
+        return self._queue.backlog()
+
 
 # Speacial Process class which runs the tracing
 # and makes it possible to retrieve its output.
-class TraceProcess(multiprocessing.Process):
-    def __init__(self, args):
+# The output is printed by the given trace source,
+# or by bcc trace run with the given arguments.
+# The output is passed through a queue, or through a ring buffer in
+# shared memory, which falls back to the queue if it can not be created.
+# With a fold window the output is parsed in the tracing process, and
+# the call-stacks counted in each window are passed as a single delta.
+# At most output_budget bytes of output wait to be read, when the reader
+# falls further behind, new call-stacks are dropped as a whole.
+# The tracing is stopped by an interrupt signal, so the process
+# passes the output it has not passed yet before it ends
+class TraceProcess(TraceOutputReader, multiprocessing.Process):
+    def __init__(self, args=None, transport=QUEUE_TRANSPORT, fold_window=None, source=None,
+                 output_budget=DEFAULT_OUTPUT_BUDGET):
         super().__init__()
-        self._queue = WritableQueue(ctx=multiprocessing.get_context())
-        self._args = args
+        self._lines = LineSplitter() # only used by the reading process
+        self._dropped_before = 0
+        self._source = source if source is not None else BccTraceSource(args)
+        self._fold_window = fold_window
+        self._queue = create_transport(transport, output_budget)
+        self._ready = multiprocessing.Event() # set once signals stop the tracing
 
     def run(self):
-        tool = _get_bcc_trace_tool(self._args)
-        with redirect_stdout(self._queue):
-            tool.run()
+        install_stop_handler()
+        self._ready.set()
+        run_source(self._source, self._queue, self._fold_window)
 
-    def get_output(self):
-        try:
-            return self._queue.get_nowait().strip(' ')
-        except Empty:
-            return None
+    # Stop the tracing, which ends the process once its output is passed.
+    # A process which does not end in time, or could not be
+    # interrupted yet, is terminated instead
+    def stop(self):
+        if self._ready.is_set() and self.is_alive():
+            os.kill(self.pid, signal.SIGINT)
+            self.join(_STOP_SECONDS)
+        if self.is_alive():
+            self.terminate()
+
+    # Free resources used to pass the output once it is not read anymore
+    def close_output(self):
+        if isinstance(self._queue, RingBuffer):
+            self._queue.unlink()
+        else:
+            self._queue.close()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+'''
+Sources of trace output run inside the tracing process.
+A source prints bcc trace output to the standard output,
+either by running bcc trace or by replaying a recorded output
+'''
+from collections import OrderedDict
+from contextlib import redirect_stdout
+from importlib import machinery, util
+import os
+import sys
+import time
+
+from tracerface.load_output import iter_lines, open_trace_output
+from tracerface.trace_stop import check_stopped, protected
+
+
+# Default number of bcc trace tools kept attached by a tracing process
+DEFAULT_TOOL_CACHE_SIZE = 4
+
+# Seconds spent discarding the events left once the probes of a tool are detached
+_STALE_EVENTS_SECONDS = 0.05
+
+# Milliseconds bcc waits for events before checking whether the trace was stopped
+_POLL_MILLISECONDS = 100
+
+# The bcc trace script, loaded once per process, as importing bcc is slow
+_bcc_trace = None
+
+
+# Load the bcc trace script as a module
+def _load_bcc_trace():
+    global _bcc_trace
+    if _bcc_trace is None:
+        sys.path.append('/usr/lib/python3/dist-packages')
+        loader = machinery.SourceFileLoader('bcc_trace', '/usr/share/bcc/tools/trace')
+        spec = util.spec_from_loader(loader.name, loader)
+        bcc_trace = util.module_from_spec(spec)
+        loader.exec_module(bcc_trace)
+        _bcc_trace = bcc_trace
+    return _bcc_trace
+
+
+# BCC trace is supposed to be run from the terminal.
+# With this hack we can use it as a reuglar class instead.
+def _get_bcc_trace_tool(args):
+    bcc_trace = _load_bcc_trace()
+    sys.argv = args
+    return bcc_trace.Tool()
+
+
+# Load bcc in advance, so the first trace does not wait for it.
+# Returns whether bcc trace could be loaded
+def preload_bcc_trace():
+    try:
+        _load_bcc_trace()
+    except (ImportError, OSError):
+        return False
+    return True
+
+
+# Throw away the events left in the buffers of a tool once its probes are
+# detached, so the next run of the tool does not print them
+def _discard_stale_events(tool):
+    deadline = time.monotonic() + _STALE_EVENTS_SECONDS
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        while time.monotonic() < deadline:
+            tool.bpf.perf_buffer_poll(timeout=0)
+
+
+# Print the events of a tool until the trace is stopped. bcc prints them
+# from callbacks which a stop can not interrupt, so it is checked between polls
+def _poll_events(tool):
+    while True:
+        tool.bpf.perf_buffer_poll(timeout=_POLL_MILLISECONDS)
+        check_stopped()
+
+
+# Returns whether the probes of a tool can be attached again from its loaded
+# program, which is not the case for USDT probes enabled when it is loaded
+def _reattachable(tool):
+    return all(probe.probe_type != 'u' for probe in tool.probes)
+
+
+# Attach the probes of a tool again to its loaded program
+def _reattach_probes(tool):
+    for probe in tool.probes:
+        if probe.library:
+            probe._attach_u(tool.bpf)
+        else:
+            probe._attach_k(tool.bpf)
+
+
+# Detach every probe of a tool, keeping its program loaded
+def _detach_probes(tool):
+    bpf = tool.bpf
+    for event in list(bpf.kprobe_fds):
+        bpf.detach_kprobe_event(event)
+    for event in list(bpf.uprobe_fds):
+        bpf.detach_uprobe_event(event)
+    for tracepoint in list(bpf.tracepoint_fds):
+        bpf.detach_tracepoint(tracepoint)
+
+
+# Keeps bcc trace tools of a tracing process with their programs compiled
+# and loaded, keyed by the arguments of bcc trace, so tracing the same probes
+# again only attaches them. Probes are detached when a run of a tool stops,
+# nothing is traced while it is not run. The least recently run tool is
+# unloaded when the cache is full, a cache of size 0 keeps no tool. Probes are attached and detached in
+# protected blocks, so stopping the trace does not leave them half attached
+class BccToolCache:
+    def __init__(self, size=DEFAULT_TOOL_CACHE_SIZE):
+        self._size = size
+        self._tools = OrderedDict()
+
+    # Returns the tool for the arguments with its probes attached
+    def _attach(self, args):
+        key = tuple(args)
+        tool = self._tools.pop(key, None)
+        if tool is not None:
+            _reattach_probes(tool)
+        else:
+            tool = _get_bcc_trace_tool(list(args))
+            tool._create_probes()
+            tool._generate_program()
+            try:
+                tool._attach_probes()
+            except BaseException:
+                if getattr(tool, 'bpf', None) is not None:
+                    tool.bpf.cleanup()
+                raise
+            if self._size < 1 or not _reattachable(tool):
+                return tool
+        self._tools[key] = tool
+        while len(self._tools) > self._size:
+            _, evicted = self._tools.popitem(last=False)
+            evicted.bpf.cleanup()
+        return tool
+
+    # Detach the probes of a tool once its run stopped,
+    # a tool which is not cached is unloaded instead
+    def _detach(self, tool):
+        if tool not in self._tools.values():
+            tool.bpf.cleanup()
+            return
+        _detach_probes(tool)
+        _discard_stale_events(tool)
+
+    # Run bcc trace with the given arguments until the trace is stopped
+    def run(self, args):
+        tool = None
+        try:
+            with protected():
+                tool = self._attach(args)
+            _poll_events(tool)
+        finally:
+            if tool is not None:
+                with protected():
+                    self._detach(tool)
+
+    def __len__(self):
+        return len(self._tools)
+
+
+# Traces with bcc trace run with the given command line arguments.
+# It runs until the tracing process is terminated or the trace is stopped.
+# With a tool cache, the tool of bcc trace is kept for the next run
+class BccTraceSource:
+    def __init__(self, args):
+        self._args = args
+
+    def run(self, tools=None):
+        if tools is None:
+            tools = BccToolCache(size=0)
+        tools.run(self._args)
+
+    # Returns the command line arguments of bcc trace
+    def args(self):
+        return self._args
+
+    # Returns whether the source stops on its own when done
+    def ends_by_itself(self):
+        return False
+
+
+# Returns a source running bcc trace for the given functions
+def bcc_trace_source(functions):
+    return BccTraceSource(['', '-UK'] + [fr'{function}' for function in functions])
+
+
+# Prints the output recorded in a file the same way bcc trace printed
+# it, which makes it possible to run the tracing without bcc or root.
+# Files compressed in any way supported by loading are replayed too.
+# The output is replayed as fast as possible, or at most
+# stacks_per_second call-stacks are printed in each second.
+# A stopped trace is checked for after every line
+class ReplayTraceSource:
+    def __init__(self, file_path, stacks_per_second=None, repeat=1):
+        self._file_path = file_path
+        self._stacks_per_second = stacks_per_second
+        self._repeat = repeat
+
+    # Nothing is worth keeping between replays, so tools are not used
+    def run(self, tools=None):
+        start = time.monotonic()
+        stack_count = 0
+        for _ in range(self._repeat):
+            with open_trace_output(self._file_path) as stream:
+                for line in iter_lines(stream):
+                    print(line.rstrip('\r'))
+                    check_stopped()
+                    # An empty line ends a call-stack
+                    if line.strip() or not self._stacks_per_second:
+                        continue
+                    stack_count += 1
+                    delay = start + stack_count / self._stacks_per_second - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+
+    # Returns whether the source stops on its own when done
+    def ends_by_itself(self):
+        return True
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+'''
+Stopping of the trace run by a tracing process.
+An interrupt signal only marks the trace as stopped, sources check
+for it between the events they print and stop by raising TraceStopped.
+bcc prints events from callbacks of its C library, an exception raised
+by a signal handler while one of them runs would be swallowed.
+While probes are being attached or detached the trace stops right
+after that, so probes are never left attached half way
+'''
+from contextlib import contextmanager
+import signal
+
+
+# Raised in a tracing process to stop the trace it runs
+class TraceStopped(Exception):
+    pass
+
+
+_running = False # a trace runs, stops are ignored otherwise
+_protected = False # probes are attached or detached
+_stopped = False # a stop arrived while the trace runs
+
+
+# Mark the running trace as stopped, it stops the next time it checks for it
+def request_stop():
+    global _stopped
+    if _running:
+        _stopped = True
+
+
+# Raise TraceStopped if the running trace was stopped,
+# unless probes are being attached or detached
+def check_stopped():
+    if _stopped and _running and not _protected:
+        raise TraceStopped()
+
+
+def _handle_signal(signum, frame):
+    request_stop()
+
+
+# Make the interrupt signal stop the trace run by this process
+def install_stop_handler():
+    signal.signal(signal.SIGINT, _handle_signal)
+
+
+# Run a trace in the block, which the interrupt signal stops
+@contextmanager
+def stoppable():
+    global _running, _stopped
+    _stopped = False
+    _running = True
+    try:
+        yield
+    finally:
+        _running = False
+
+
+# Attach or detach probes in the block, a stop
+# arriving meanwhile is raised after the block
+@contextmanager
+def protected():
+    global _protected
+    _protected = True
+    try:
+        yield
+    finally:
+        _protected = False
+    check_stopped()
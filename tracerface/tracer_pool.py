@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+'''
+Pool of tracing processes started before they are needed.
+Workers load bcc once when they start and keep running traces one
+after another, keeping the compiled programs of recent traces, so
+starting a trace does not wait for a new process, bcc or the compiler
+'''
+import multiprocessing
+import os
+from queue import Empty
+import signal
+from threading import Lock
+import traceback
+
+from tracerface.line_splitter import LineSplitter
+from tracerface.ring_buffer import RingBuffer, SharedMemoryUnavailableError
+from tracerface.trace_process import (
+    create_transport,
+    DEFAULT_OUTPUT_BUDGET,
+    RING_TRANSPORT,
+    run_source,
+    TraceOutputReader
+)
+from tracerface.trace_source import BccToolCache, preload_bcc_trace
+from tracerface.trace_stop import install_stop_handler
+
+
+# Seconds a worker gets to end by itself when it is shut down
+_SHUT_DOWN_SECONDS = 5
+
+# Seconds a stopped trace gets to pass the rest of its output
+_STOP_SECONDS = 5
+
+
+# Process running traces submitted to it one at a time. A trace runs until
+# its source ends or it is stopped by an interrupt signal, which leaves the
+# worker running, a stop requested before the trace started ends it as
+# soon as it starts. The output of every trace is passed through the same
+# ring buffer, only records which do not stay in a feeder thread of
+# a queue can be discarded reliably when the next trace starts
+class TracerWorker(multiprocessing.Process):
+    def __init__(self, output_budget=DEFAULT_OUTPUT_BUDGET, ctx=None):
+        super().__init__(daemon=True)
+        if ctx is None:
+            ctx = multiprocessing.get_context()
+        self._transport = create_transport(RING_TRANSPORT, output_budget)
+        if not isinstance(self._transport, RingBuffer):
+            self._transport.close()
+            raise SharedMemoryUnavailableError('Tracer workers need shared memory')
+        self._jobs = ctx.SimpleQueue()
+        self._done = ctx.Event() # set while no trace runs
+        self._done.set()
+        self._stop_requested = ctx.Event()
+        self._ready = ctx.Event() # set once signals stop traces
+        self._failed = ctx.Value('b', 0, lock=False)
+        self._shut_down = False # only used by the parent process
+
+    def run(self):
+        install_stop_handler()
+        self._ready.set()
+        preload_bcc_trace()
+        tools = BccToolCache()
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            source, fold_window = job
+            failed = False
+            try:
+                # The signal of a stop requested until the trace can be stopped was ignored
+                run_source(source, self._transport, fold_window, tools, stopped=self._stop_requested.is_set)
+            except SystemExit as e:
+                # bcc trace exits with an error even when it is interrupted
+                failed = bool(e.code) and not self._stop_requested.is_set()
+            except Exception:
+                traceback.print_exc()
+                failed = True
+            self._failed.value = failed
+            self._done.set()
+
+    # Returns the transport the output of traces is passed through
+    def transport(self):
+        return self._transport
+
+    # Start running a trace of the source, once the last one is done.
+    # Output left over from the last trace is discarded first
+    def submit(self, source, fold_window):
+        self._done.wait()
+        while True:
+            try:
+                self._transport.get_bytes_nowait()
+            except Empty:
+                break
+        self._stop_requested.clear()
+        self._done.clear()
+        self._jobs.put((source, fold_window))
+
+    # Returns whether no trace runs in the worker
+    def done(self):
+        return self._done.is_set()
+
+    # Returns whether the last trace ended with an error
+    def failed(self):
+        return bool(self._failed.value)
+
+    # Wait at most timeout seconds for the trace to end,
+    # returns whether it ended
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    # Interrupt the trace running in the worker. Until the worker is ready
+    # to be interrupted, the trace is stopped as soon as it starts instead
+    def stop(self):
+        self._stop_requested.set()
+        if self.is_alive() and self._ready.is_set() and not self.done():
+            os.kill(self.pid, signal.SIGINT)
+
+    # Let the worker end once it finished its trace and free its transport
+    def shut_down(self, timeout=_SHUT_DOWN_SECONDS):
+        if self._shut_down:
+            return
+        self._shut_down = True
+        if self.is_alive():
+            self.stop()
+            self._jobs.put(None)
+            self.join(timeout)
+            if self.is_alive():
+                self.terminate()
+                self.join()
+        self._transport.unlink()
+
+
+# A trace run by a worker of the pool. It is used the same way as a
+# TraceProcess, but it hands the worker back to the pool instead of
+# ending it when its output is closed
+class PooledTrace(TraceOutputReader):
+    def __init__(self, pool, worker, source, fold_window):
+        self._pool = pool
+        self._worker = worker
+        self._source = source
+        self._fold_window = fold_window
+        self._queue = worker.transport()
+        self._lines = LineSplitter()
+        self._dropped_before = 0
+        self._started = False
+
+    def start(self):
+        self._dropped_before = self._queue.dropped()
+        self._worker.submit(self._source, self._fold_window)
+        self._started = True
+
+    # Returns whether the trace still runs
+    def is_alive(self):
+        return self._started and not self._worker.done() and self._worker.is_alive()
+
+    # Returns None while the trace runs, otherwise 0 if it ended fine
+    @property
+    def exitcode(self):
+        if not self._worker.is_alive():
+            return self._worker.exitcode or 1
+        if not self._started or not self._worker.done():
+            return None
+        return 1 if self._worker.failed() else 0
+
+    # Stop the trace, the worker stays ready for the next one. A worker
+    # whose trace does not end in time is terminated instead, the pool
+    # replaces it once the output of the trace is not read anymore
+    def stop(self):
+        self._worker.stop()
+        if self._worker.is_alive() and not self._worker.wait(_STOP_SECONDS):
+            self._worker.terminate()
+            self._worker.join()
+
+    # Wait at most timeout seconds for the trace to end, or for its worker to die
+    def join(self, timeout=None):
+        if self._worker.is_alive():
+            self._worker.wait(timeout)
+
+    # Give the worker back to the pool
+    def close_output(self):
+        self._pool.release(self._worker)
+
+
+# Keeps size tracing processes ready for traces. Workers are taken for a trace
+# and given back once its output was read, a worker which died is shut down.
+# Workers are only started by start, which is called from the thread starting
+# traces, so the server does not fork processes from the threads reading output.
+# If no worker is free, the caller has to start a tracing process of its own
+class TracerPool:
+    def __init__(self, size, output_budget=DEFAULT_OUTPUT_BUDGET):
+        self._size = size
+        self._output_budget = output_budget
+        self._idle = []
+        self._busy = set()
+        self._lock = Lock()
+        self._closed = False
+
+    # Start workers until there are size of them, replacing the ones which died.
+    # Raises SharedMemoryUnavailableError if the output of workers can not be passed
+    def start(self):
+        with self._lock:
+            if self._closed:
+                return
+            for worker in [worker for worker in self._idle if not worker.is_alive()]:
+                self._idle.remove(worker)
+                worker.shut_down()
+            while len(self._idle) + len(self._busy) < self._size:
+                worker = TracerWorker(self._output_budget)
+                worker.start()
+                self._idle.append(worker)
+
+    # Returns a trace of the source run by a free worker, None if there is none.
+    # The trace is started by its start method
+    def acquire(self, source, fold_window=None):
+        with self._lock:
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.is_alive():
+                    self._busy.add(worker)
+                    return PooledTrace(self, worker, source, fold_window)
+                worker.shut_down()
+            return None
+
+    # Take back a worker once the output of its trace is not read anymore
+    def release(self, worker):
+        with self._lock:
+            self._busy.discard(worker)
+            if self._closed or not worker.is_alive():
+                worker.shut_down()
+            else:
+                self._idle.append(worker)
+
+    # Returns the number of free workers
+    def idle_count(self):
+        with self._lock:
+            return len(self._idle)
+
+    # Stop every trace and end every worker, busy ones included
+    def close(self):
+        with self._lock:
+            self._closed = True
+            workers = self._idle + list(self._busy)
+            self._idle = []
+            self._busy = set()
+        for worker in workers:
+            worker.shut_down()
@@ -26,6 +26,16 @@ class WarningAlert(BaseAlert):
         super().__init__(message=message, color='warning')
 
 
+# Lasting warning that the traced call counts are not exact
+class ApproximateGraphAlert(Alert):
+    def __init__(self, dropped, sampled):
+        super().__init__(
+            [P('The graph is approximate:'),
+             P('{} call-stacks were dropped and {} were sampled out to keep up with tracing'.format(dropped, sampled))],
+            color='warning', dismissable=True
+        )
+
+
 # Special long error for tracing alerts
 class TraceErrorAlert(Alert):
     def __init__(self, error):
@@ -20,6 +20,7 @@ class Dashboard(html.Div):
                 self.trace_group(),
                 self.search_function_input(),
                 self.slider_group(),
+                self.param_stats_group(),
                 self.spacing_group(),
                 self.animate_checklist(),
                 ManageApplicationDialog(),
@@ -83,6 +84,10 @@ class Dashboard(html.Div):
             html.Div(
                 id='trace-error-notification',
                 children=None,
+                style=element_style()),
+            html.Div(
+                id='trace-approximate-notification',
+                children=None,
                 style=element_style())
         ])
 
@@ -142,6 +147,13 @@ class Dashboard(html.Div):
             ],
             style=element_style())
 
+    @staticmethod
+    def param_stats_group():
+        return html.Div(
+            id='param-stats',
+            children=None,
+            style=element_style())
+
     @staticmethod
     def search_function_input():
         return dbc.Input(
@@ -1,4 +1,5 @@
 from dash_bootstrap_components import Col, Row
+from dash_core_components import Store
 from dash_html_components import Div
 
 from tracerface.web_ui.dashboard import Dashboard
@@ -9,8 +10,16 @@ from .graph import Graph
 class Layout(Div):
     def __init__(self):
         super().__init__(
-            children=Row([
-                Col(Graph()),
-                Col(Dashboard(), width=3)
-            ]),
+            children=[
+                Row([
+                    Col(Graph()),
+                    Col(Dashboard(), width=3)
+                ]),
+                # Changes of the graph sent by the server
+                # and the version of the graph shown
+                Store(id='graph-delta'),
+                Store(id='graph-client-version'),
+                # Counts of dropped and sampled call-stacks the browser warns about
+                Store(id='approximate-counts-shown')
+            ],
             style={'width': '99vw'},)
@@ -7,9 +7,9 @@ def element_style():
     return {'margin-top': '10px'}
 
 
-def expanded_style(node_id):
+def expanded_style(element_id):
     return {
-        'selector': '#{}'.format(node_id),
+        'selector': '#{}'.format(element_id),
         'style': {
             'label': 'data(info)',
             'text-wrap': 'wrap'
@@ -4,36 +4,169 @@ This module contains functions to convert
 data in the call graph into the format
 which dash cytoscape requires
 '''
+from collections import deque
+from threading import RLock
 
-# Returns list of nodes in a format usable to cytoscape
-def convert_nodes_to_cytoscape_format(nodes, edges):
-    return [
-        {
-            'data': {
-                'id': node_id,
-                'name': nodes[node_id]['name'],
-                'source': nodes[node_id]['source'],
-                'count': nodes[node_id]['call_count'],
-                'info': _get_info_text_for_node(nodes[node_id], _get_params_of_node(node_id, edges))
-            }
-        } for node_id in nodes
-    ]
+from tracerface.param_counter import ParamCounter
+
+_NO_PARAMS = ParamCounter()
+
+# Number of updates remembered to send browsers only what changed since
+# the version they have, browsers lagging further behind get everything
+_CHANGELOG_SIZE = 64
+
+# Returns the id of a node used in the browser
+def node_element_id(node_id):
+    return 'n{}'.format(node_id)
+
+# Returns the id of an edge used in the browser
+def edge_element_id(edge):
+    return 'e{}-{}'.format(edge[0], edge[1])
+
+# Returns the node id or the edge which the id used in the browser belongs to
+def parse_element_id(element_id):
+    if element_id.startswith('n'):
+        return int(element_id[1:])
+    caller, called = element_id[1:].split('-')
+    return (int(caller), int(called))
+
+# Returns list of nodes in a format usable to cytoscape.
+# Parameters of calls to each node are collected from
+# the edges, unless they are given by node id
+def convert_nodes_to_cytoscape_format(nodes, edges, node_params=None):
+    if node_params is None:
+        node_params = _get_params_by_node(edges)
+    return [_convert_node(node_id, nodes[node_id], node_params) for node_id in nodes]
 
 # Returns list of edges in a format usable to cytoscape
 def convert_edges_to_cytoscape_format(nodes, edges):
-    return [
-        {
-            'data': {
-                'source': edge[0],
-                'target': edge[1],
-                'params': _get_param_visuals_for_edge(edges[edge]['params']),
-                'call_count': edges[edge]['call_count'],
-                'caller_name': nodes[edge[0]]['name'],
-                'called_name': nodes[edge[1]]['name'],
-                'info': _get_info_text_for_edge(edges[edge])
-            }
-        } for edge in edges
-    ]
+    return [_convert_edge(edge, edges[edge], nodes) for edge in edges]
+
+# Returns a single node in a format usable to cytoscape,
+# the info text is only needed while the node is expanded
+def _convert_node(node_id, node, node_params, with_info=True):
+    element = {
+        'data': {
+            'id': node_element_id(node_id),
+            'name': node['name'],
+            'source': node['source'],
+            'count': node['call_count']
+        }
+    }
+    if with_info:
+        element['data']['info'] = _get_info_text_for_node(node, node_params.get(node_id, _NO_PARAMS))
+    return element
+
+# Returns a single edge in a format usable to cytoscape,
+# the info text is only needed while the edge is expanded
+def _convert_edge(edge, stored, nodes, with_info=True):
+    element = {
+        'data': {
+            'id': edge_element_id(edge),
+            'source': node_element_id(edge[0]),
+            'target': node_element_id(edge[1]),
+            'params': _get_param_visuals_for_edge(stored['params']),
+            'call_count': stored['call_count'],
+            'caller_name': nodes[edge[0]]['name'],
+            'called_name': nodes[edge[1]]['name']
+        }
+    }
+    if with_info:
+        element['data']['info'] = _get_info_text_for_edge(stored)
+    return element
+
+
+# Keeps the elements of a call graph in the format usable to cytoscape,
+# converting again only the nodes and edges which changed in the graph.
+# Only elements expanded in the call graph get their info text, an element
+# has to be marked as changed in the graph when it is expanded or collapsed.
+# The changes are copied from the graph at once and converted afterwards,
+# so the graph is not locked while the elements are built.
+# The changes of recent updates are remembered, so a browser showing an
+# older version of the graph can be sent only the elements it lacks.
+# The cache is shared by concurrent requests, its lock is held while it
+# changes or is read, and by callers to get the delta of their own update
+class CytoscapeCache:
+    def __init__(self):
+        self._lock = RLock()
+        self._version = None
+        self._nodes = {}
+        self._edges = {}
+        self._base_version = None # browsers older than this get all elements
+        self._changelog = deque() # (version, node ids, edges) of each update
+
+    # Returns the lock of the cache, held to update it and read the delta at once
+    def lock(self):
+        return self._lock
+
+    # Convert changes of the call graph since the last update,
+    # returns False if the graph has not changed at all
+    def update(self, call_graph):
+        with self._lock:
+            return self._update(call_graph)
+
+    def _update(self, call_graph):
+        version = call_graph.version()
+        if version == self._version:
+            return False
+        changes = call_graph.drain_changes()
+        version = changes.version
+        if changes.cleared:
+            self._nodes = {}
+            self._edges = {}
+            self._base_version = version
+            self._changelog.clear()
+        else:
+            self._changelog.append((version, changes.dirty_nodes, changes.dirty_edges))
+            if len(self._changelog) > _CHANGELOG_SIZE:
+                self._base_version = self._changelog.popleft()[0]
+        for node_id in changes.dirty_nodes:
+            with_info = node_element_id(node_id) in changes.expanded
+            self._nodes[node_id] = _convert_node(node_id, changes.nodes[node_id], changes.node_params, with_info)
+        for edge in changes.dirty_edges:
+            with_info = edge_element_id(edge) in changes.expanded
+            self._edges[edge] = _convert_edge(edge, changes.edges[edge], changes.nodes, with_info)
+        self._version = version
+        return True
+
+    # Returns nodes followed by edges
+    def elements(self):
+        with self._lock:
+            return list(self._nodes.values()) + list(self._edges.values())
+
+    # Returns the changes a browser showing the given version of the graph
+    # has to apply to show the current one, or None if it is up to date.
+    # Elements in upsert are added or replace the ones with the same id,
+    # with reset set every element shown before has to be removed first
+    def delta(self, client_version):
+        with self._lock:
+            return self._delta(client_version)
+
+    def _delta(self, client_version):
+        if self._version is None or client_version == self._version:
+            return None
+        if client_version is None or not self._base_version <= client_version <= self._version:
+            return {'version': self._version, 'reset': True, 'upsert': self.elements()}
+        node_ids = set()
+        edges = set()
+        for version, dirty_nodes, dirty_edges in self._changelog:
+            if version > client_version:
+                node_ids.update(dirty_nodes)
+                edges.update(dirty_edges)
+        upsert = [self._nodes[node_id] for node_id in node_ids] + [self._edges[edge] for edge in edges]
+        return {'version': self._version, 'reset': False, 'upsert': upsert}
+
+# Returns text listing parameters of a parameter counter
+def _get_params_text(params):
+    lines = []
+    for param, count in params.items():
+        line = ', '.join(param)
+        if count > 1:
+            line = '{} ({} times)'.format(line, count)
+        lines.append(line)
+    if params.other_count():
+        lines.append('Other parameters ({} times)'.format(params.other_count()))
+    return '\n'.join(lines)
 
 # Returns text containing information about given node
 def _get_info_text_for_node(node, params):
@@ -42,34 +175,33 @@ def _get_info_text_for_node(node, params):
         node['source'],
         node['call_count']
     )
-    if len(params) > 0:
-        text = '{}\nWith parameters:\n{}'.format(
-            text,
-            '\n'.join([', '.join(param) for param in params])
-        )
+    if params.total() > 0:
+        text = '{}\nWith parameters:\n{}'.format(text, _get_params_text(params))
     return text
 
 # Returns text containing information about given edge
 def _get_info_text_for_edge(edge):
     text = 'Call made {} times'.format(edge['call_count'])
     params = edge['params']
-    if len(params) > 0:
-        text = '{}\nWith parameters:\n{}'.format(
-            text,
-            '\n'.join([', '.join(param) for param in params])
-        )
+    if params.total() > 0:
+        text = '{}\nWith parameters:\n{}'.format(text, _get_params_text(params))
     return text
 
 # Returns label of a given edge based on its parameters
 def _get_param_visuals_for_edge(params):
-    if len(params) == 0:
+    if params.total() == 0:
         return ''
-    elif len(params) == 1:
-        return ', '.join(params[0])
+    elif len(params) == 1 and params.other_count() == 0:
+        return ', '.join(params.items()[0][0])
     else:
         return '...'
 
-# Returns parameters for a node defined by its id/hash
-def _get_params_of_node(node_id, edges):
-    params_by_calls = [edges[edge]['params'] for edge in edges if str(edge[1]) == node_id]
-    return [params for calls in params_by_calls for params in calls]
+# Returns parameters of calls to each node in a single pass over the edges,
+# keeping as many distinct parameters per node as the edges keep
+def _get_params_by_node(edges):
+    node_params = {}
+    for edge in edges:
+        params = edges[edge]['params']
+        if params.total():
+            node_params.setdefault(edge[1], ParamCounter(params.capacity())).update(params)
+    return node_params